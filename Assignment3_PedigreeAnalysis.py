@@ -20,10 +20,13 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from pedigree_pipeline import chromosome_means, scan_windows, sex_differentiation, write_scan, SCAN_WINDOW, SCAN_STEP
+from pedigree_pipeline import permutation_test, PhasingCache, filter_painted
 
 vcf_path = './YHPedigree_Class.vcf'    # modify this line if needed to match your file location
-vcf_dict = allel.read_vcf(vcf_path, fields=['variants/CHROM', 'calldata/GT', 'calldata/DP', 'samples'])
+vcf_dict = allel.read_vcf(vcf_path, fields=['variants/CHROM', 'variants/POS', 'calldata/GT', 'calldata/DP', 'samples'])
 chromosome = vcf_dict['variants/CHROM']
+position = vcf_dict['variants/POS']
 genotype = vcf_dict['calldata/GT']
 depth = vcf_dict['calldata/DP']
 samples = vcf_dict['samples']
@@ -62,21 +65,26 @@ maternal_mask = (converted_genotype.is_hom()[:, 0]) & (converted_genotype.is_het
 paternal_masked_genotype = converted_genotype[paternal_mask]
 maternal_masked_genotype = converted_genotype[maternal_mask]
 
-# phase the masked genotypes using the allel.phase_by_transmission function with the window_size set to 100
-# Replace "None" with your code
-paternal_phased = allel.phase_by_transmission(paternal_masked_genotype, 100)
-maternal_phased = allel.phase_by_transmission(maternal_masked_genotype, 100)
-
-# Convert the phased maternal and paternal data to allel.HaplotypeArray objects
-# Hint: use the .to_haplotypes() method of the allel.GenotypeArray objects
-# Replace "None" with your code
-paternal_haplotypes = paternal_phased.to_haplotypes()
-maternal_haplotypes = maternal_phased.to_haplotypes()
-
-# Uncomment the next three lines of completed code to paint offspring haplotypes by parental haplotypes.
-num_progeny = samples.size - 2
-paternally_painted = allel.paint_transmission(paternal_haplotypes[:,(0,1)],paternal_haplotypes[:,range(4,num_progeny*2+4,2)])
-maternally_painted = allel.paint_transmission(maternal_haplotypes[:,(2,3)],maternal_haplotypes[:,range(5,num_progeny*2+4,2)])
+# Phasing and painting are the slow steps, so their results are cached in phasing_cache_dir, keyed by the contents
+# of the VCF, the sample layout, the window size and the parent. Runs that only change sections 3-7 load them from
+# the cache; delete the directory to force a re-phase.
+phasing_cache_dir = './pedigree_cache'
+phasing_cache = PhasingCache(phasing_cache_dir)
+
+# phase the masked genotypes using the allel.phase_by_transmission function with the window_size set to 100, convert
+# the phased data to allel.HaplotypeArray objects and paint offspring haplotypes by parental haplotypes
+paternal_phased, paternally_painted = phasing_cache.phase_and_paint(vcf_path, samples, paternal_masked_genotype,
+                                                                    'paternal', 100)
+maternal_phased, maternally_painted = phasing_cache.phase_and_paint(vcf_path, samples, maternal_masked_genotype,
+                                                                    'maternal', 100)
+
+# paternal_phased = allel.phase_by_transmission(paternal_masked_genotype, 100)
+# maternal_phased = allel.phase_by_transmission(maternal_masked_genotype, 100)
+# paternal_haplotypes = paternal_phased.to_haplotypes()
+# maternal_haplotypes = maternal_phased.to_haplotypes()
+# num_progeny = samples.size - 2
+# paternally_painted = allel.paint_transmission(paternal_haplotypes[:,(0,1)],paternal_haplotypes[:,range(4,num_progeny*2+4,2)])
+# maternally_painted = allel.paint_transmission(maternal_haplotypes[:,(2,3)],maternal_haplotypes[:,range(5,num_progeny*2+4,2)])
 # print(paternally_painted)
 # print(maternally_painted)
 
@@ -88,37 +96,29 @@ At this point, the paternally_painted and maternally_painted arrays should conta
 filter these arrays. 
 """
 
-# first, subtract 1 from each value in the paternally_painted and maternally_painted arrays so that the values of
-# interest become 0 and 1
-# Replace "None" with your code
-# 1 = allele inherited from paternal haplotype; 2 = allele inherited from maternal haplotype
-paternally_painted -= 1 
-maternally_painted -= 1
-
-# next, convert the dtype of  both arrays to float so that we can have nan values
-# Replace "None" with your code
-paternally_painted = paternally_painted.astype(np.float16)
-maternally_painted = maternally_painted.astype(np.float16)
-
-# using boolean indexing, set all values greater than 1 to np.nan
-paternally_painted[paternally_painted > 1] = np.nan
-maternally_painted[maternally_painted > 1] = np.nan
-
-# using the paternal_phased and maternal_phased arrays, and the .is_phased attribute, set all non-phased values in the
-# paternally_painted and maternally_painted arrays to np.nan. Hint: you can use the ~ operator, or the np.logical_not
-# function, to invert a boolean array.
-paternally_painted[~paternal_phased[:, 2:].is_phased] = np.nan
-maternally_painted[~maternal_phased[:, 2:].is_phased] = np.nan
-
-
-# set all values with a sequencing depth less than 5 in the paternally_painted and maternally_painted arrays to np.nan
-# HINT: you will need the array called "depth" that was created in section 1, as well as the paternal_mask
-# and maternal_mask arrays from earlier in this section.
-depth_mask_paternal = (depth[paternal_mask] < 5)[:, 2:]
-paternally_painted[depth_mask_paternal] = np.nan
-
-depth_mask_maternal = (depth[maternal_mask] < 5)[:, 2:]
-maternally_painted[depth_mask_maternal] = np.nan
+# The steps below (subtract 1 so that the values of interest become 0 and 1, convert to float16 so that dropped calls
+# can be nan, then set values greater than 1, non-phased values and values with a sequencing depth less than 5 to nan)
+# each made a full-size copy or boolean mask. filter_painted does all of them in one pass over blocks of rows and
+# returns a compact int8 array instead, with 0 = allele inherited from the first parental haplotype, 1 = allele
+# inherited from the second parental haplotype and -1 (pedigree_pipeline.MISSING) for dropped calls. The depth rows
+# are looked up through the row numbers of the masks, so depth[paternal_mask] is never materialized.
+paternally_painted = filter_painted(paternally_painted, paternal_phased.is_phased[:, 2:], depth[:, 2:],
+                                    min_depth=5, rows=np.flatnonzero(paternal_mask))
+maternally_painted = filter_painted(maternally_painted, maternal_phased.is_phased[:, 2:], depth[:, 2:],
+                                    min_depth=5, rows=np.flatnonzero(maternal_mask))
+
+# paternally_painted -= 1
+# maternally_painted -= 1
+# paternally_painted = paternally_painted.astype(np.float16)
+# maternally_painted = maternally_painted.astype(np.float16)
+# paternally_painted[paternally_painted > 1] = np.nan
+# maternally_painted[maternally_painted > 1] = np.nan
+# paternally_painted[~paternal_phased[:, 2:].is_phased] = np.nan
+# maternally_painted[~maternal_phased[:, 2:].is_phased] = np.nan
+# depth_mask_paternal = (depth[paternal_mask] < 5)[:, 2:]
+# paternally_painted[depth_mask_paternal] = np.nan
+# depth_mask_maternal = (depth[maternal_mask] < 5)[:, 2:]
+# maternally_painted[depth_mask_maternal] = np.nan
 
 """
 Section 4: Prep for Plotting
@@ -131,28 +131,21 @@ In this section, you will calculate summary statistics from your painted arrays,
 # appropriate code
 unique_chromosomes = np.unique(chromosome)
 
-# The next two lines of code do not need to be modified. They simply set up empty lists that you'll use later
-all_paternal_means = []
-all_maternal_means = []
-
-# Now fill in the missing sections of this loop to calculate summary statistics for each chromosome:
-for chrom in unique_chromosomes:
-    # extract the rows of the paternally_painted array associated with "chrom"
-    # Replace "None" with your code
-    paternal_slice = paternally_painted[chromosome[paternal_mask] == chrom]
-    # find the mean of this array along the 0th dimension, ignoring nan values. The resulting array should have 24
-    # values, each representing the summary statistic for a single individual
-    # Replace "None" with your code
-    pat_means = np.nanmean(paternal_slice, axis=0)
-    # append the pat_mean array to the all_paternal_means list
-    all_paternal_means.append(pat_means)
-
-    # repeat the above steps (extract, summarize, and append) with the maternally_painted array. Be sure to append to
-    # the all_maternal_means list, and to use the appropriate maternal equivalents when performing the first filtering
-    # step
-    maternal_slice = maternally_painted[chromosome[maternal_mask] == chrom]
-    mat_means = np.nanmean(maternal_slice, axis=0)
-    all_maternal_means.append(mat_means)
+# The loop below rebuilt a boolean mask over every painted row for each chromosome; chromosome_means sorts the rows
+# by chromosome once and sums every chromosome with one reduceat, skipping the dropped (-1) calls. The result is one
+# array of 24 per-individual means per chromosome, in the order of unique_chromosomes
+all_paternal_means = chromosome_means(chromosome[paternal_mask], paternally_painted, unique_chromosomes)
+all_maternal_means = chromosome_means(chromosome[maternal_mask], maternally_painted, unique_chromosomes)
+
+# all_paternal_means = []
+# all_maternal_means = []
+# for chrom in unique_chromosomes:
+#     paternal_slice = paternally_painted[chromosome[paternal_mask] == chrom]
+#     pat_means = np.nanmean(paternal_slice, axis=0)
+#     all_paternal_means.append(pat_means)
+#     maternal_slice = maternally_painted[chromosome[maternal_mask] == chrom]
+#     mat_means = np.nanmean(maternal_slice, axis=0)
+#     all_maternal_means.append(mat_means)
 
 """
 Section 5: Plotting
@@ -204,3 +197,53 @@ axes[1].set(title='maternal inheritance')
 fig.tight_layout()
 fig.savefig('assignment3_visualization.pdf')
 plt.close(fig)
+
+"""
+Section 6: Sliding-window scan
+
+The boxplots point at a whole linkage group. To narrow the signal down to a candidate interval, the painted arrays are
+scanned in overlapping windows along every chromosome and the male and female means of every window are compared.
+Windows where males and females inherited different haplotypes from a parent have a differentiation near +1 or -1.
+The full track is written to sex_linkage_scan.csv.
+"""
+is_male = np.isin(samples[2:], male_ids)
+is_female = np.isin(samples[2:], female_ids)
+scans = {'paternal': scan_windows(chromosome[paternal_mask], position[paternal_mask], paternally_painted,
+                                  SCAN_WINDOW, SCAN_STEP),
+         'maternal': scan_windows(chromosome[maternal_mask], position[maternal_mask], maternally_painted,
+                                  SCAN_WINDOW, SCAN_STEP)}
+write_scan(scans, 'sex_linkage_scan.csv', is_male, is_female, linkageGroups)
+for parent, scan in scans.items():
+    differentiation = sex_differentiation(scan['means'], is_male, is_female)
+    # windows where the males or the females have no calls have no differentiation; chromosomes without a single
+    # scored window are reported instead of ranked, and nanargmax is only asked when some window is scored
+    scored = np.isfinite(differentiation)
+    for chrom in sorted(set(scan['chromosome'].tolist()) - set(scan['chromosome'][scored].tolist())):
+        print(f"no {parent} window on {linkageGroups.get(chrom, chrom)} has calls in both sexes")
+    if not scored.any():
+        print(f"no {parent} window has calls in both sexes, so there is no strongest {parent} window")
+        continue
+    top = np.nanargmax(np.abs(differentiation))
+    print(f"strongest {parent} window: {linkageGroups.get(scan['chromosome'][top], scan['chromosome'][top])} "
+          f"{scan['start'][top]}-{scan['stop'][top]}, differentiation {differentiation[top]:.2f}")
+
+"""
+Section 7: Permutation test
+
+The boxplots show the difference between males and females but not whether it is larger than chance. The sex labels
+are shuffled among the progeny 10000 times and the male-vs-female difference of every linkage group is recomputed
+under each shuffle. The corrected p-value accounts for testing all 22 linkage groups: it compares every linkage group
+against the largest difference over all linkage groups in each shuffle. The table is written to
+sex_linkage_permutation.csv.
+"""
+permutation_tables = []
+for parent, all_means in (('paternal', all_paternal_means), ('maternal', all_maternal_means)):
+    test = permutation_test(np.vstack(all_means), is_male, is_female, seed=8802)
+    permutation_tables.append(pd.DataFrame({'parent': parent,
+                                            'linkage_group': [linkageGroups[x] for x in unique_chromosomes],
+                                            'difference': test['difference'],
+                                            'p_value': test['p_value'],
+                                            'p_adjusted': test['p_adjusted']}))
+permutation_df = pd.concat(permutation_tables, ignore_index=True)
+permutation_df.to_csv('sex_linkage_permutation.csv', index=False)
+print(permutation_df[permutation_df.p_adjusted < 0.05].to_string(index=False))
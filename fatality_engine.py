@@ -0,0 +1,246 @@
+import os # Population matrix cache files
+import numpy as np # Population and rate matrices
+import pandas as pd # Demographics tables and reports
+try:
+    import pyarrow # Parquet cache of the population matrix; a pickle is used without it
+except ImportError:
+    pyarrow = None
+
+"""
+Matrix engine for the covid-19 fatality estimates of hw4.py. The demographics are pivoted once into a dense
+countries x ages population matrix, and every fatality-rate scenario is a column of an ages x scenarios rate matrix.
+The expected deaths of every country under every scenario then come from a single matrix multiply, so alternative
+age bands, vaccination-adjusted rates and thousands of Monte Carlo draws cost one product instead of one merge and
+groupby each.
+"""
+
+MAX_AGE = 100 # Oldest age of the rate table; older ages are left out, as by the merge on Age in hw4.py
+AGES = np.arange(MAX_AGE + 1)
+# Table 1 of hw4.py: fatalities per million infections for the age bands (first age, last age)
+CDC_BANDS = [((0, 17), 20), ((18, 49), 500), ((50, 64), 6000), ((65, MAX_AGE), 90000)]
+MC_RELATIVE_SD = 0.25 # Default spread of the Monte Carlo rate draws (sd of the log of the rate multiplier)
+DEMOGRAPHIC_COLUMNS = ['PopulationID', 'Age', '#Alive'] # The only columns read
+DEMOGRAPHIC_DTYPES = {'PopulationID': 'category', 'Age': 'int16'} # #Alive is inferred: int64, float64 if fractional
+READ_CHUNK_ROWS = 1_000_000 # Demographics rows read at a time
+
+
+def band_rates(bands: list[tuple[tuple[int, int], float]] = CDC_BANDS) -> np.ndarray:
+    """
+    Expand an age-band table of fatalities per million infections into a per-age fatality rate.
+
+    :param bands: list of ((first age, last age), fatalities per million) covering ages 0 to MAX_AGE
+    :return rates: float64 array of the fatality rate of every age from 0 to MAX_AGE
+    """
+    rates = np.full(len(AGES), np.nan)
+    for (first, last), per_million in bands:
+        rates[first:last + 1] = per_million / 1_000_000
+    assert not np.isnan(rates).any(), 'the age bands must cover every age from 0 to MAX_AGE'
+    return rates
+
+
+def _read_demographic_chunks(csv_path: str, chunk_rows: int):
+    """Read PopulationID, Age and #Alive of a demographics CSV in chunks of chunk_rows rows"""
+    return pd.read_csv(csv_path, usecols=DEMOGRAPHIC_COLUMNS, dtype=DEMOGRAPHIC_DTYPES, chunksize=chunk_rows)
+
+
+def _alive_counts(csv_path: str, chunk: pd.DataFrame) -> pd.Series:
+    """#Alive of a chunk as numbers, raising a ValueError for empty or non-numeric counts"""
+    alive = chunk['#Alive']
+    if not pd.api.types.is_numeric_dtype(alive):
+        # counts beyond the uint64 range are parsed as text and only fit in float64
+        try:
+            alive = pd.to_numeric(alive).astype(np.float64)
+        except ValueError as error:
+            raise ValueError(f'{csv_path}: #Alive must be a number: {error}') from None
+    missing = alive.isna().to_numpy()
+    if missing.any():
+        raise ValueError(f'{csv_path}: #Alive is missing for {missing.sum()} rows, the first for '
+                         f'{chunk["PopulationID"].iloc[missing.argmax()]} at age {chunk["Age"].iloc[missing.argmax()]}')
+    return alive
+
+
+def _stream_population_matrix(csv_path: str, chunk_rows: int) -> tuple[pd.Index, np.ndarray]:
+    """Sum a demographics CSV into the countries x ages matrix chunk by chunk; see read_population_matrix"""
+    rows = {} # country name -> row of the matrix, in order of first appearance
+    population = np.zeros((0, len(AGES)))
+    whole_counts = True # whether #Alive parsed as integers in every chunk so far
+    for chunk in _read_demographic_chunks(csv_path, chunk_rows):
+        in_table = chunk['Age'].between(0, MAX_AGE).to_numpy()
+        # the categories differ between chunks, so they are mapped onto the rows of the matrix chunk by chunk
+        country = chunk['PopulationID'].cat
+        chunk_rows_of = np.array([rows.setdefault(name, len(rows)) for name in country.categories], dtype=np.int64)
+        if len(rows) > len(population):
+            population = np.vstack([population, np.zeros((len(rows) - len(population), len(AGES)))])
+        alive = _alive_counts(csv_path, chunk)
+        whole_counts &= pd.api.types.is_integer_dtype(alive)
+        codes = country.codes.to_numpy()[in_table]
+        cells = chunk_rows_of[codes] * len(AGES) + chunk['Age'].to_numpy()[in_table]
+        population += np.bincount(cells, weights=alive.to_numpy(dtype=np.float64)[in_table],
+                                  minlength=population.size).reshape(population.shape)
+    names = np.array(list(rows), dtype=object)
+    order = np.argsort(names)
+    if whole_counts and population.max(initial=0) < 2 ** 53:
+        population = population.astype(np.int64) # whole counts below 2**53 add up exactly in float64
+    return pd.Index(names[order], name='PopulationID'), population[order]
+
+
+def population_cache_path(csv_path: str) -> str:
+    """Path of the population matrix cache of a demographics CSV: Parquet with pyarrow, a pickle without it"""
+    return f'{os.path.splitext(csv_path)[0]}.population.{"parquet" if pyarrow else "pkl"}'
+
+
+def read_population_matrix(csv_path: str, chunk_rows: int = READ_CHUNK_ROWS,
+                           use_cache: bool = True) -> tuple[pd.Index, np.ndarray]:
+    """
+    Read a demographics CSV straight into a dense countries x ages population matrix. Rows of the same country and
+    age are added up, and ages above MAX_AGE are left out. Only the PopulationID, Age and #Alive columns are parsed,
+    as categorical, int16 and, for #Alive, whatever pandas infers per chunk: int64 for whole counts, float64 for
+    fractional ones. Each chunk of rows is summed into the matrix before the next one is read, so the full table is
+    never in memory and the CSV is read only once. An empty or non-numeric #Alive raises a ValueError rather than
+    giving the country a NaN population, and any other parse error (e.g. an Age of "100+") is raised as it is. The
+    matrix is cached next to the CSV (see population_cache_path) and read from there while the cache is newer than the
+    CSV and holds the ages 0 to MAX_AGE of this version of the engine.
+
+    :param csv_path: demographics CSV with PopulationID, Age and #Alive columns
+    :param chunk_rows: rows read at a time
+    :param use_cache: read and write the cache
+    :return countries, population: the sorted country names, and the matrix of people alive per country (rows) and
+    age (columns); int64 when #Alive holds whole numbers whose sums stay below 2**53, float64 otherwise
+    """
+    cache_path = population_cache_path(csv_path)
+    if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(csv_path):
+        cached = pd.read_parquet(cache_path) if pyarrow else pd.read_pickle(cache_path)
+        # the columns are the ages of the matrix, so a cache written with another MAX_AGE is rebuilt
+        if list(cached.columns) == [str(age) for age in AGES]:
+            return cached.index, cached.to_numpy()
+
+    countries, population = _stream_population_matrix(csv_path, chunk_rows)
+
+    if use_cache:
+        table = pd.DataFrame(population, index=countries, columns=[str(age) for age in AGES])
+        tmp = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            table.to_parquet(tmp) if pyarrow else table.to_pickle(tmp)
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass # a read-only data directory only costs the cache
+    return countries, population
+
+
+def vaccinated_rates(rates: np.ndarray, coverage: np.ndarray | float, efficacy: float) -> np.ndarray:
+    """
+    Fatality rates after vaccinating a fraction of every age with a vaccine preventing a fraction of deaths.
+
+    :param rates: per-age fatality rates
+    :param coverage: vaccinated fraction of every age, or one fraction for all ages
+    :param efficacy: fraction of deaths prevented in the vaccinated
+    :return rates: per-age fatality rates with vaccination
+    """
+    return rates * (1 - np.asarray(coverage) * efficacy)
+
+
+def monte_carlo_rates(bands: list[tuple[tuple[int, int], float]] = CDC_BANDS, n_draws: int = 1000,
+                      relative_sd: float = MC_RELATIVE_SD, seed: int = None) -> np.ndarray:
+    """
+    Draw uncertain versions of an age-band rate table. Every draw multiplies the rate of each band by its own
+    lognormal factor with median 1, and all ages of a band share the factor.
+
+    :param bands: list of ((first age, last age), fatalities per million)
+    :param n_draws: number of draws
+    :param relative_sd: standard deviation of the log of the factors
+    :param seed: random seed
+    :return rates: ages x draws matrix of fatality rates
+    """
+    rng = np.random.default_rng(seed)
+    band_of_age = np.empty(len(AGES), dtype=np.int64)
+    for band, ((first, last), _) in enumerate(bands):
+        band_of_age[first:last + 1] = band
+    factors = rng.lognormal(mean=0.0, sigma=relative_sd, size=(len(bands), n_draws))
+    return band_rates(bands)[:, None] * factors[band_of_age]
+
+
+def scenario_matrix(scenarios: dict[str, np.ndarray]) -> tuple[list[str], np.ndarray]:
+    """
+    Stack named rate scenarios into one ages x scenarios matrix. A scenario is either one per-age rate array or an
+    ages x draws matrix, whose columns are named '<name>_<draw>'.
+
+    :param scenarios: dict of per-age rates or rate matrices keyed by scenario name
+    :return names, rates: the column names and the ages x scenarios rate matrix
+    """
+    names = []
+    columns = []
+    for name, rates in scenarios.items():
+        rates = np.asarray(rates, dtype=np.float64)
+        if rates.ndim == 1:
+            names.append(name)
+            columns.append(rates[:, None])
+        else:
+            names.extend(f'{name}_{draw}' for draw in range(rates.shape[1]))
+            columns.append(rates)
+    return names, np.hstack(columns)
+
+
+def expected_deaths(population: np.ndarray, rates: np.ndarray) -> np.ndarray:
+    """
+    Expected deaths of every country under every scenario if everyone were infected.
+
+    :param population: countries x ages population matrix
+    :param rates: ages x scenarios rate matrix
+    :return deaths: countries x scenarios matrix of expected deaths
+    """
+    return population @ rates
+
+
+def fatality_table(countries: pd.Index, population: np.ndarray, deaths: np.ndarray) -> pd.DataFrame:
+    """
+    Build the covid_fatality.csv table of hw4.py for one scenario.
+
+    :param countries: country names
+    :param population: countries x ages population matrix
+    :param deaths: expected deaths of every country under the scenario
+    :return dt3: table indexed by PopulationID with total_polulation, total_exp_death and died_perc columns
+    """
+    dt3 = pd.DataFrame({'total_polulation': population.sum(axis=1), 'total_exp_death': deaths}, index=countries)
+    dt3['died_perc'] = dt3['total_exp_death'] / dt3['total_polulation'] * 100
+    return dt3
+
+
+def scenario_table(countries: pd.Index, population: np.ndarray, names: list[str], deaths: np.ndarray) -> pd.DataFrame:
+    """
+    Long-format table of the expected deaths and death percentage of every country under every scenario.
+
+    :param countries: country names
+    :param population: countries x ages population matrix
+    :param names: scenario names
+    :param deaths: countries x scenarios matrix of expected deaths
+    :return table: one row per country and scenario with PopulationID, scenario, total_population, exp_death and
+    died_perc columns
+    """
+    totals = population.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        died_perc = deaths / totals[:, None] * 100
+    return pd.DataFrame({'PopulationID': np.repeat(countries.to_numpy(), len(names)),
+                         'scenario': np.tile(np.asarray(names, dtype=object), len(countries)),
+                         'total_population': np.repeat(totals, len(names)),
+                         'exp_death': deaths.ravel(),
+                         'died_perc': died_perc.ravel()})
+
+
+def draw_summary(countries: pd.Index, population: np.ndarray, deaths: np.ndarray,
+                 quantiles: tuple[float, ...] = (0.025, 0.5, 0.975)) -> pd.DataFrame:
+    """
+    Summarize Monte Carlo draws: the mean and quantiles of every country's death percentage over the draws.
+
+    :param countries: country names
+    :param population: countries x ages population matrix
+    :param deaths: countries x draws matrix of expected deaths
+    :param quantiles: quantiles to report
+    :return summary: table indexed by PopulationID with died_perc_mean and one died_perc_q<quantile> column per
+    quantile
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        died_perc = deaths / population.sum(axis=1)[:, None] * 100
+    summary = pd.DataFrame({'died_perc_mean': died_perc.mean(axis=1)}, index=countries)
+    for quantile, values in zip(quantiles, np.quantile(died_perc, quantiles, axis=1)):
+        summary[f'died_perc_q{quantile:g}'] = values
+    return summary
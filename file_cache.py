@@ -0,0 +1,51 @@
+import hashlib # Content hashes of cached inputs
+import json # Records of the remembered hashes
+import os # File sizes, modification times and atomic renames
+
+"""
+Helpers shared by the on-disk caches of rad_hw.py (CutSiteCache, GenotypeStore) and pedigree_pipeline.py
+(PhasingCache): content hashes of their input files, remembered so a file is only hashed again after it changes, and
+atomic writes, so that workers and runs sharing a cache never read a partial file.
+"""
+
+
+def file_sha256(path: str) -> str:
+    """Hex SHA-256 digest of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(8 * 1024 ** 2), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, write, mode: str = 'w'):
+    """Write through a temporary file and rename it into place, so concurrent workers never see partial files"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, mode) as handle:
+        write(handle)
+    os.replace(tmp, path)
+
+
+def cached_file_hash(path: str, record_path: str) -> str:
+    """
+    Hash the contents of a file. The hash is remembered in a JSON record file per file path, size and modification
+    time, so the file is only read again after it changes.
+
+    :param path: file to hash
+    :param record_path: JSON file holding the remembered hashes
+    :return digest: hex SHA-256 digest of the file contents
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    records = {}
+    if os.path.exists(record_path):
+        with open(record_path) as record_file:
+            records = json.load(record_file)
+    record = records.get(key)
+    if record and record['size'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns:
+        return record['sha256']
+
+    digest = file_sha256(path)
+    records[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    write_atomic(record_path, lambda handle: json.dump(records, handle))
+    return digest
@@ -2,13 +2,209 @@
 
 import subprocess
 import os
+import base64
+import secrets
+import time
+import json
+import hashlib
+import logging
+import queue
+import re
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TransferResult:
+    """outcome of copying one file with rclone"""
+    source: str
+    destination: str
+    success: bool
+    attempts: int
+    seconds: float
+    size: int = 0
+    error: str = ''
+
+@dataclass
+class BatchResult:
+    """outcome of a batch of transfers, with aggregate counts and throughput"""
+    results: list[TransferResult]
+    seconds: float
+    skipped: int = 0
+
+    @property
+    def succeeded(self) -> list[TransferResult]:
+        return [result for result in self.results if result.success]
+
+    @property
+    def failed(self) -> list[TransferResult]:
+        return [result for result in self.results if not result.success]
+
+    @property
+    def size(self) -> int:
+        """bytes moved by the successful transfers"""
+        return sum(result.size for result in self.succeeded)
+
+    @property
+    def throughput(self) -> float:
+        """bytes per second over the whole batch"""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        summary = (f'{len(self.succeeded)} of {len(self.results)} files transferred, {self.size} bytes in '
+                   f'{self.seconds:.2f} s ({self.throughput / 1024 ** 2:.2f} MB/s), {len(self.failed)} failed')
+        return f'{summary}, {self.skipped} unchanged' if self.skipped else summary
+
+def file_md5(filename:str, block_size:int = 1 << 20) -> str:
+    """md5 of a file, read in blocks so large files are not loaded into memory"""
+    digest = hashlib.md5()
+    with open(filename, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+MANIFEST_NAME = '.file_manager_manifest.json'
+RCLONE_ERROR = re.compile(r'ERROR : (.+?): ')
+CHECK_ERRORS = {'-': 'missing at the destination after the copy',
+                '*': 'differs from the source after the copy',
+                '!': 'could not be checked after the copy'}
+
+def write_file_list(paths:list[str]) -> str:
+    """writes paths one per line to a temporary file for --files-from-raw, returning its name; the caller removes it"""
+    with tempfile.NamedTemporaryFile('w', prefix = 'rclone_files_', suffix = '.txt', delete = False) as handle:
+        handle.write(''.join(f'{path}\n' for path in paths))
+    return handle.name
+
+def check_errors(report:list[str], paths:list[str]) -> dict:
+    """per-file errors from an rclone check --one-way --combined report, whose lines are '= path' for a file that
+    matches at the destination and '-', '*' or '!' followed by the path otherwise; a path the report does not
+    mention was not found at the source"""
+    states = {line[2:]: line[0] for line in report if len(line) > 2 and line[1] == ' '}
+    return {path: CHECK_ERRORS.get(states.get(path), 'not found at the source')
+            for path in paths if states.get(path) != '='}
+
+class RcloneDaemon:
+    """client for a persistent rclone remote-control server (rclone rcd), so that many copies share one process,
+    one config read and one session per remote. start() launches the server unless one already answers at address.
+    The server only accepts calls with user and password (random ones unless given), since the remote-control API
+    can read the rclone config, tokens included. They are handed to rclone through its environment rather than its
+    command line. The server's log goes to log_file, or is discarded"""
+    def __init__(self, rclone:str = 'rclone', address:str = '127.0.0.1:5572', startup_timeout:float = 30.0,
+                 user:str = None, password:str = None, log_file:str = None):
+        self.rclone = rclone
+        self.address = address
+        self.startup_timeout = startup_timeout
+        self.user = user or f'file_manager_{secrets.token_hex(4)}'
+        self.password = password or secrets.token_urlsafe(24)
+        self.log_file = log_file
+        self.process = None
+        self.process_exit_code = None
+        self.log = None
+
+    def call(self, command:str, **params) -> dict:
+        """posts one remote-control command, e.g. call('core/stats', group = 'job/1'), and returns its JSON reply"""
+        credentials = base64.b64encode(f'{self.user}:{self.password}'.encode()).decode()
+        request = urllib.request.Request(f'http://{self.address}/{command}', data = json.dumps(params).encode(),
+                                         headers = {'Content-Type': 'application/json',
+                                                    'Authorization': f'Basic {credentials}'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            reply = error.read().decode()
+            try:
+                reply = json.loads(reply).get('error', reply)
+            except ValueError:
+                pass
+            raise RuntimeError(f'rclone rc {command} failed: {reply}') from None
+
+    def alive(self) -> bool:
+        """whether a server answers at address"""
+        try:
+            self.call('rc/noop')
+            return True
+        except (OSError, RuntimeError):
+            return False
+
+    def start(self) -> 'RcloneDaemon':
+        """launches rclone rcd and waits until it answers"""
+        if self.alive():
+            return self
+        environment = dict(os.environ, RCLONE_RC_USER = self.user, RCLONE_RC_PASS = self.password)
+        self.log = open(self.log_file, 'ab') if self.log_file else None
+        self.process = subprocess.Popen([self.rclone, 'rcd', f'--rc-addr={self.address}'], env = environment,
+                                        stdout = subprocess.DEVNULL, stderr = self.log or subprocess.DEVNULL)
+        deadline = time.perf_counter() + self.startup_timeout
+        while not self.alive():
+            if self.process.poll() is not None:
+                self.stop()
+                where = f'; see {self.log_file}' if self.log_file else ''
+                raise RuntimeError(f'rclone rcd exited with code {self.process_exit_code}{where}')
+            if time.perf_counter() > deadline:
+                self.stop()
+                raise RuntimeError(f'rclone rcd did not answer on {self.address} within {self.startup_timeout} s')
+            time.sleep(0.1)
+        return self
+
+    def stop(self):
+        """stops the server if this client launched it"""
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process_exit_code = self.process.wait()
+            self.process = None
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def __enter__(self) -> 'RcloneDaemon':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def copy_files(self, source:str, destination:str, paths:list[str], poll:float = 0.5, progress = None) -> dict:
+        """copies paths relative to the source root into the destination root as one asynchronous sync/copy job,
+        polling job/status and the job's core/stats until it finishes. progress, if given, is called with every
+        stats reply. Which files made it is decided afterwards by an operations/check of the destination against
+        the source, since the job's own transfer list is capped and keeps the failures of attempts that a later
+        retry fixed. Returns {'status': job status, 'stats': final stats, 'errors': {path: error}}"""
+        file_list = write_file_list(paths)
+        try:
+            job = self.call('sync/copy', srcFs = source, dstFs = destination, _async = True,
+                            _filter = {'FilesFromRaw': [file_list]})['jobid']
+            group = f'job/{job}'
+            while True:
+                status = self.call('job/status', jobid = job)
+                stats = self.call('core/stats', group = group)
+                if progress is not None:
+                    progress(stats)
+                if status['finished']:
+                    break
+                time.sleep(poll)
+            check = self.call('operations/check', srcFs = source, dstFs = destination, oneWay = True, combined = True,
+                              _filter = {'FilesFromRaw': [file_list]})
+        finally:
+            os.remove(file_list)
+        return {'status': status, 'stats': stats, 'errors': check_errors(check.get('combined') or [], paths)}
 
 class FileManager:
-    def __init__(self, remote:str, local_master:str, cloud_master:str):
-        """Initialize attributes"""
+    def __init__(self, remote:str, local_master:str, cloud_master:str, rclone:str = 'rclone', max_workers:int = 8,
+                 retries:int = 3, backoff:float = 1.0):
+        """Initialize attributes; rclone is the rclone executable, and max_workers, retries and backoff (seconds
+        before the first retry, doubled for every further one) apply to upload_many and download_many"""
         self.remote = remote
         self.local_master = local_master
         self.cloud_master = cloud_master
+        self.rclone = rclone
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
 
     def convertCloudToLocal(self, filename:str) -> str:
         """converts cloud location into local path"""
@@ -44,11 +240,354 @@ class FileManager:
         else:
             print(f"Download failed. Error:\n{download.stderr}")
 
+    def _transfer(self, source:str, destination:str) -> TransferResult:
+        """copies one file with rclone copyto, retrying failed attempts with exponential backoff"""
+        start = time.perf_counter()
+        error = ''
+        for attempt in range(1, self.retries + 2):
+            try:
+                transfer = subprocess.run([self.rclone, 'copyto', source, destination], capture_output = True, text = True)
+            except FileNotFoundError:
+                error = f'rclone executable {self.rclone} not found'
+                break
+            except OSError as exc:
+                # e.g. a non-executable rclone; fail this file instead of aborting the whole batch
+                error = f'could not run {self.rclone}: {exc}'
+                break
+            if transfer.returncode == 0:
+                local = destination if os.path.exists(destination) else source
+                size = os.path.getsize(local) if os.path.exists(local) else 0
+                return TransferResult(source, destination, True, attempt, time.perf_counter() - start, size)
+            error = transfer.stderr.strip()
+            if attempt <= self.retries:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        return TransferResult(source, destination, False, attempt, time.perf_counter() - start, error = error)
+
+    def _transfer_many(self, pairs:list[tuple[str, str]], max_workers:int = None) -> BatchResult:
+        """runs transfers of (source, destination) pairs through a bounded thread pool"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = max_workers or self.max_workers) as pool:
+            results = list(pool.map(lambda pair: self._transfer(*pair), pairs))
+        return BatchResult(results, time.perf_counter() - start)
+
+    def upload_many(self, filenames:list[str], max_workers:int = None) -> BatchResult:
+        """uploads local files to their cloud locations concurrently; each file is copied to exactly the path given
+        by convertLocalToCloud"""
+        return self._transfer_many([(filename, self.convertLocalToCloud(filename)) for filename in filenames], max_workers)
+
+    def download_many(self, filenames:list[str], max_workers:int = None) -> BatchResult:
+        """downloads cloud files to their local paths concurrently"""
+        return self._transfer_many([(filename, self.convertCloudToLocal(filename)) for filename in filenames], max_workers)
+
+    def _copy_bulk(self, source:str, destination:str, paths:list[str], daemon:RcloneDaemon = None) -> dict:
+        """copies paths relative to the source root into the destination root with a single rclone copy
+        --files-from-raw, or as one job on a running rclone rcd; returns {path: error} for the files that failed.
+        rclone retries the whole copy and only reports on the batch, so a file counts as copied if a one-way
+        rclone check finds it at the destination, matching the source, once the copy is over"""
+        if daemon is not None:
+            return daemon.copy_files(source, destination, paths)['errors']
+        file_list = write_file_list(paths)
+        try:
+            copy = subprocess.run([self.rclone, 'copy', '--files-from-raw', file_list, f'--transfers={self.max_workers}',
+                                   f'--retries={self.retries + 1}', f'--retries-sleep={self.backoff}s', source, destination],
+                                  capture_output = True, text = True)
+            check = subprocess.run([self.rclone, 'check', '--one-way', '--files-from-raw', file_list, '--combined=-',
+                                    f'--checkers={self.max_workers}', source, destination], capture_output = True, text = True)
+        except FileNotFoundError:
+            return {path: f'rclone executable {self.rclone} not found' for path in paths}
+        finally:
+            os.remove(file_list)
+        if check.returncode != 0 and not check.stdout.strip():
+            return {path: f'rclone check failed: {check.stderr.strip()}' for path in paths}
+        errors = check_errors(check.stdout.splitlines(), paths)
+        # the copy's own error line for a file says more than the check
+        for line in copy.stderr.splitlines():
+            match = RCLONE_ERROR.search(line)
+            if match and match.group(1) in errors:
+                errors[match.group(1)] = line[match.end():].strip()
+        return errors
+
+    def _bulk_results(self, sources:list[str], destinations:list[str], paths:list[str], errors:dict, local:list[str],
+                      seconds:float) -> BatchResult:
+        """one TransferResult per file of a bulk copy; rclone retries the copy itself, so attempts is always 1"""
+        results = []
+        for source, destination, path, filename in zip(sources, destinations, paths, local):
+            error = errors.get(path, '')
+            size = os.path.getsize(filename) if not error and os.path.exists(filename) else 0
+            results.append(TransferResult(source, destination, not error, 1, seconds, size, error))
+        return BatchResult(results, seconds)
+
+    def upload_bulk(self, filenames:list[str], daemon:RcloneDaemon = None) -> BatchResult:
+        """uploads local files under local_master to their convertLocalToCloud locations in one rclone process (or one
+        job on the given rclone rcd) instead of one process per file"""
+        start = time.perf_counter()
+        paths = [os.path.relpath(filename, self.local_master) for filename in filenames]
+        for filename, path in zip(filenames, paths):
+            assert not path.startswith('..'), f'{filename} is not under {self.local_master}'
+        errors = self._copy_bulk(self.local_master, f'{self.remote}:/{self.cloud_master}', paths, daemon) if paths else {}
+        destinations = [self.convertLocalToCloud(filename) for filename in filenames]
+        return self._bulk_results(filenames, destinations, paths, errors, filenames, time.perf_counter() - start)
+
+    def download_bulk(self, filenames:list[str], daemon:RcloneDaemon = None) -> BatchResult:
+        """downloads cloud files under cloud_master to their convertCloudToLocal paths in one rclone process (or one
+        job on the given rclone rcd) instead of one process per file"""
+        start = time.perf_counter()
+        cloud = f'{self.remote}:/{self.cloud_master}/'
+        for filename in filenames:
+            assert filename.startswith(cloud), f'{filename} is not under {cloud}'
+        paths = [filename[len(cloud):] for filename in filenames]
+        errors = self._copy_bulk(cloud.rstrip('/'), self.local_master, paths, daemon) if paths else {}
+        destinations = [self.convertCloudToLocal(filename) for filename in filenames]
+        return self._bulk_results(filenames, destinations, paths, errors, destinations, time.perf_counter() - start)
+
+    def default_manifest(self) -> str:
+        """manifest used by sync when none is given, kept in local_master and never uploaded itself"""
+        return os.path.join(self.local_master, MANIFEST_NAME)
+
+    def read_manifest(self, manifest:str = None) -> dict:
+        """reads the sync manifest, {path relative to local_master: {size, mtime_ns, md5, cloud}}; empty if missing"""
+        manifest = manifest or self.default_manifest()
+        if not os.path.exists(manifest):
+            return {}
+        with open(manifest) as handle:
+            return json.load(handle)['files']
+
+    def write_manifest(self, entries:dict, manifest:str = None):
+        """writes the sync manifest atomically, so an interrupted sync leaves the previous one intact"""
+        manifest = manifest or self.default_manifest()
+        tmp = f'{manifest}.tmp'
+        with open(tmp, 'w') as handle:
+            json.dump({'remote': self.remote, 'cloud_master': self.cloud_master, 'files': entries}, handle, indent = 1)
+        os.replace(tmp, manifest)
+
+    def scan_local(self, manifest:str = None) -> dict:
+        """size and mtime of every file under local_master, keyed by path relative to local_master"""
+        manifest = os.path.abspath(manifest or self.default_manifest())
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.local_master):
+            dirnames.sort()
+            for name in sorted(filenames):
+                full = os.path.join(dirpath, name)
+                if os.path.abspath(full) in (manifest, f'{manifest}.tmp'):
+                    continue
+                stat = os.stat(full)
+                found[os.path.relpath(full, self.local_master)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return found
+
+    def hash_local(self, found:dict, cached:dict, max_workers:int = None) -> dict:
+        """fills in the md5 of every scanned file; a file whose size and mtime match its cached entry keeps the cached
+        md5, and the rest are hashed concurrently"""
+        stale = []
+        for path, entry in found.items():
+            previous = cached.get(path)
+            if previous and previous['size'] == entry['size'] and previous['mtime_ns'] == entry['mtime_ns']:
+                entry['md5'] = previous['md5']
+            else:
+                stale.append(path)
+        with ThreadPoolExecutor(max_workers = max_workers or self.max_workers) as pool:
+            hashes = pool.map(lambda path: file_md5(os.path.join(self.local_master, path)), stale)
+            for path, md5 in zip(stale, hashes):
+                found[path]['md5'] = md5
+        return found
+
+    def list_remote(self) -> dict:
+        """size and md5 (None if the remote does not provide one) of every file under cloud_master, keyed by path
+        relative to cloud_master; empty if cloud_master does not exist yet"""
+        listing = subprocess.run([self.rclone, 'lsjson', '-R', '--files-only', '--hash', f'{self.remote}:/{self.cloud_master}'],
+                                 capture_output = True, text = True)
+        if listing.returncode != 0:
+            if 'directory not found' in listing.stderr:
+                return {}
+            raise RuntimeError(f'listing {self.remote}:/{self.cloud_master} failed:\n{listing.stderr}')
+        return {entry['Path']: {'size': entry['Size'], 'md5': entry.get('Hashes', {}).get('md5')}
+                for entry in json.loads(listing.stdout) if not entry.get('IsDir')}
+
+    def sync(self, manifest:str = None, check_remote:bool = True, max_workers:int = None, bulk:bool = False,
+             daemon:RcloneDaemon = None) -> BatchResult:
+        """uploads only the files under local_master that are new or changed. A file is changed if its md5 differs
+        from the remote one, or, for remotes without md5 (e.g. Dropbox), from the one recorded when it was last
+        uploaded; with check_remote=False the remote is not listed and the manifest alone decides. The manifest is
+        updated for every file found in sync or uploaded successfully. bulk (or a daemon) uploads the changed files
+        with upload_bulk instead of upload_many"""
+        start = time.perf_counter()
+        cached = self.read_manifest(manifest)
+        found = self.hash_local(self.scan_local(manifest), cached, max_workers)
+        remote = self.list_remote() if check_remote else None
+
+        entries, pending = {}, []
+        for path, entry in found.items():
+            entry['cloud'] = self.convertLocalToCloud(os.path.join(self.local_master, path))
+            previous = cached.get(path)
+            synced = previous is not None and previous['md5'] == entry['md5'] and previous.get('cloud') == entry['cloud']
+            if remote is not None:
+                copy = remote.get(path)
+                if copy is None or copy['size'] != entry['size']:
+                    synced = False
+                elif copy['md5'] is not None:
+                    synced = copy['md5'] == entry['md5']
+            if synced:
+                entries[path] = entry
+            else:
+                pending.append(path)
+
+        filenames = [os.path.join(self.local_master, path) for path in pending]
+        if bulk or daemon is not None:
+            batch = self.upload_bulk(filenames, daemon)
+        else:
+            batch = self.upload_many(filenames, max_workers)
+        for path, result in zip(pending, batch.results):
+            if result.success:
+                entries[path] = found[path]
+        self.write_manifest(entries, manifest)
+        return BatchResult(batch.results, time.perf_counter() - start, skipped = len(found) - len(pending))
+
+    def prefetch(self, filenames:list[str], depth:int = 2, disk_budget:int = None, evict:bool = False) -> 'Prefetcher':
+        """iterates over cloud files as local paths, downloading ahead in the background; see Prefetcher"""
+        return Prefetcher(self, filenames, depth, disk_budget, evict)
+
     def __str__(self) -> str:
         return f'Remote: {self.remote} \nLocal master path: {self.local_master} \nCloud master path: {self.cloud_master}'
 
+class Prefetcher:
+    """downloads cloud files in a background thread while the caller works on the ones already fetched, handing the
+    local paths over through a queue of at most depth finished downloads. Files are downloaded to their
+    convertCloudToLocal paths in the local_master mirror and are kept there by default. When evict is set, a file is
+    deleted as soon as the caller asks for the next one, and no new download starts while the fetched files still on
+    disk add up to disk_budget bytes or more, so disk use stays below disk_budget plus one file. Eviction only ever
+    deletes files the prefetcher created: a file that was already in the mirror before its download is refreshed but
+    kept, and does not count towards disk_budget. Failed downloads are skipped and logged as warnings on the
+    file_manager logger; batch.failed holds them, with their errors, once the iteration is over.
+
+    Example, analysing chromosomes while the next ones download, keeping at most 20 GB of them on disk:
+        with fm.prefetch(vcf_files, depth = 2, disk_budget = 20 * 1024 ** 3, evict = True) as inputs:
+            for vcf_file in inputs:
+                run_pipeline(vcf_file, ...)"""
+    def __init__(self, manager:FileManager, filenames:list[str], depth:int = 2, disk_budget:int = None, evict:bool = False):
+        assert depth >= 1, 'depth must be at least 1'
+        self.manager = manager
+        self.filenames = list(filenames)
+        self.disk_budget = disk_budget
+        self.evict = evict
+        self.ready = queue.Queue(maxsize = depth)
+        self.condition = threading.Condition()
+        self.on_disk = 0
+        self.preexisting = set() # destinations already in the mirror before their download, never evicted
+        self.stopped = False
+        self.results = []
+        self.thread = None
+        self.start_time = None
+
+    def _wait_for_budget(self) -> bool:
+        """blocks until the fetched files leave room under disk_budget; False if the prefetcher was closed"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or self.disk_budget is None or not self.evict
+                                    or self.on_disk < self.disk_budget)
+            return not self.stopped
+
+    def _hand_over(self, result:TransferResult) -> bool:
+        """puts a finished download on the queue, giving up if the prefetcher is closed while the queue is full"""
+        while not self.stopped:
+            try:
+                self.ready.put(result, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        # the end marker is handed over however the loop ends, or the consumer would wait on the queue forever
+        try:
+            for filename in self.filenames:
+                if not self._wait_for_budget():
+                    break
+                destination = self.manager.convertCloudToLocal(filename)
+                if os.path.exists(destination):
+                    self.preexisting.add(destination)
+                start = time.perf_counter()
+                try:
+                    result = self.manager._transfer(filename, destination)
+                except Exception as error:
+                    result = TransferResult(filename, destination, False, 1, time.perf_counter() - start,
+                                            error = f'{type(error).__name__}: {error}')
+                self.results.append(result)
+                if result.success and destination not in self.preexisting:
+                    with self.condition:
+                        self.on_disk += result.size
+                if not self._hand_over(result):
+                    self.release(result)
+                    break
+        finally:
+            self._hand_over(None)
+
+    def start(self) -> 'Prefetcher':
+        """starts the background downloads"""
+        if self.thread is None:
+            self.start_time = time.perf_counter()
+            self.thread = threading.Thread(target = self._run, name = 'prefetcher', daemon = True)
+            self.thread.start()
+        return self
+
+    def release(self, result:TransferResult):
+        """marks a fetched file as processed, deleting it when evicting unless it was in the mirror beforehand"""
+        if not self.evict or not result.success or result.destination in self.preexisting:
+            return
+        if os.path.exists(result.destination):
+            os.remove(result.destination)
+        with self.condition:
+            self.on_disk -= result.size
+            self.condition.notify_all()
+
+    def __iter__(self):
+        self.start()
+        current = None
+        try:
+            while True:
+                if current is not None:
+                    self.release(current)
+                    current = None
+                result = self.ready.get()
+                if result is None:
+                    break
+                if not result.success:
+                    logger.warning('download of %s failed: %s', result.source, result.error)
+                    continue
+                current = result
+                yield result.destination
+        finally:
+            if current is not None:
+                self.release(current)
+            self.close()
+
+    def close(self):
+        """stops downloading and removes fetched files nobody asked for"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        while True:
+            try:
+                result = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if result is not None:
+                self.release(result)
+
+    @property
+    def batch(self) -> BatchResult:
+        """outcome of the downloads so far"""
+        seconds = time.perf_counter() - self.start_time if self.start_time else 0.0
+        return BatchResult(list(self.results), seconds)
+
+    def __enter__(self) -> 'Prefetcher':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
 
-fm = FileManager("dropbox_remote", "/home/anagha/BIOL8802/topic4/hw2", "Anagha Mohana Krishna/dropbox_rclone")
-print(fm)
-fm.uploadData('/home/anagha/BIOL8802/topic4/hw2/local_rclone/test.txt')
-fm.downloadData('dropbox_remote:/Anagha Mohana Krishna/dropbox_rclone/test1/Biopython_re_comparision.png')
\ No newline at end of file
+if __name__ == '__main__':
+    fm = FileManager("dropbox_remote", "/home/anagha/BIOL8802/topic4/hw2", "Anagha Mohana Krishna/dropbox_rclone")
+    print(fm)
+    fm.uploadData('/home/anagha/BIOL8802/topic4/hw2/local_rclone/test.txt')
+    fm.downloadData('dropbox_remote:/Anagha Mohana Krishna/dropbox_rclone/test1/Biopython_re_comparision.png')
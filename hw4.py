@@ -30,41 +30,59 @@ deaths for each country to create dt3.
 '''
 
 import pandas as pd
+from fatality_engine import AGES, CDC_BANDS, band_rates, read_population_matrix, vaccinated_rates, monte_carlo_rates
+from fatality_engine import scenario_matrix, expected_deaths, fatality_table, scenario_table, draw_summary
+
+N_DRAWS = 1000 # Monte Carlo draws of the Table 1 rates
+SEED = 8802 # Random seed of the draws
 
 # 1. Create a dataframe (dt1) using the Table 1 data where each row contains an age
 # (from 0-100) and expected fatality rate (e.g. 0.09).
-d = {'Age': [], 'FPM': []}
-for i in range(101):
-    d['Age'].append(i)
-    if i < 18:
-        d['FPM'].append(20/1000000)
-    elif 18 <= i <= 49:
-        d['FPM'].append(500/1000000)
-    elif 50 <= i <= 64:
-        d['FPM'].append(6000/1000000)
-    else:
-        d['FPM'].append(90000/1000000)
+dt1 = pd.DataFrame({'Age': AGES, 'FPM': band_rates(CDC_BANDS)})
 
-dt1 = pd.DataFrame.from_dict(d)
+# d = {'Age': [], 'FPM': []}
+# for i in range(101):
+#     d['Age'].append(i)
+#     if i < 18:
+#         d['FPM'].append(20/1000000)
+#     elif 18 <= i <= 49:
+#         d['FPM'].append(500/1000000)
+#     elif 50 <= i <= 64:
+#         d['FPM'].append(6000/1000000)
+#     else:
+#         d['FPM'].append(90000/1000000)
+# dt1 = pd.DataFrame.from_dict(d)
 
 # 2. Read in the WorldDemographics.csv file (dt2)
-dt2 = pd.read_csv('../hw/WorldDemographics.csv')
-dt2 = dt2.drop(['Unnamed: 0'], axis=1)
+# Only PopulationID, Age and #Alive are read, in chunks and with narrow dtypes, and every chunk is summed straight
+# into a countries x ages population matrix, which is cached next to the CSV for later runs.
+countries, population = read_population_matrix('../hw/WorldDemographics.csv')
 
-# 3. Join the dt1 and dt2 files together on Age.
-covid_dt = pd.merge(dt1, dt2, how='inner', on='Age')
-# covid_dt = covid_dt.drop(['country_code', 'Level', 'continent_code'], axis=1)
+# dt2 = pd.read_csv('../hw/WorldDemographics.csv')
+# dt2 = dt2.drop(['Unnamed: 0'], axis=1)
 
-# 4. Calculate the expected number of deaths for each age.
-covid_dt['exp_death'] = covid_dt['FPM'] * covid_dt['#Alive']
+# 3.-5. Instead of joining dt1 and dt2 on Age and grouping the expected deaths by country, the demographics are
+# pivoted into the population matrix above. The rates of dt1 are one column of an ages x scenarios rate matrix, next
+# to a vaccination scenario and Monte Carlo draws of the Table 1 rates, and the expected deaths of every country
+# under every scenario come from one matrix multiply.
+scenario_names, rates = scenario_matrix({
+    'cdc': dt1['FPM'].to_numpy(),
+    'cdc_vaccinated_65plus': vaccinated_rates(dt1['FPM'].to_numpy(), coverage=(AGES >= 65) * 0.8, efficacy=0.9),
+    'cdc_draw': monte_carlo_rates(CDC_BANDS, n_draws=N_DRAWS, seed=SEED)})
+deaths = expected_deaths(population, rates)
 
-# 5. Group the data together by country to calculate the total population and expected
-# deaths for each country to create dt3.
-dt3 = covid_dt.groupby('PopulationID').agg(total_polulation=('#Alive', 'sum'), total_exp_death=('exp_death', 'sum'))
+# covid_dt = pd.merge(dt1, dt2, how='inner', on='Age')
+# covid_dt['exp_death'] = covid_dt['FPM'] * covid_dt['#Alive']
+# dt3 = covid_dt.groupby('PopulationID').agg(total_polulation=('#Alive', 'sum'), total_exp_death=('exp_death', 'sum'))
 
 # 6. Calculate a percentage died column in the dt3 table.
-dt3['died_perc'] = dt3['total_exp_death']/dt3['total_polulation'] * 100
+dt3 = fatality_table(countries, population, deaths[:, scenario_names.index('cdc')])
 
 #print and save the dataframe as CSV
 print(dt3)
-dt3.to_csv('covid_fatality.csv', encoding='utf-8')
\ No newline at end of file
+dt3.to_csv('covid_fatality.csv', encoding='utf-8')
+
+# every scenario and draw, and the spread of the death percentage over the draws
+scenario_table(countries, population, scenario_names, deaths).to_csv('covid_fatality_scenarios.csv', index=False)
+is_draw = [name.startswith('cdc_draw_') for name in scenario_names]
+print(draw_summary(countries, population, deaths[:, is_draw]))
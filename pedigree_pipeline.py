@@ -0,0 +1,742 @@
+import argparse # Take in arguments
+import csv # Write the per-chromosome summaries
+import hashlib # Content hashes for the phasing cache
+import json # Hash records and entry descriptions of the phasing cache
+import os # Phasing cache files
+import re # Read contig names from the VCF header
+from concurrent.futures import ProcessPoolExecutor # Paint families and chromosomes in parallel
+import allel # Read, phase and paint the pedigree
+import numpy as np
+from file_cache import write_atomic, cached_file_hash # Content hashes and atomic writes of the phasing cache
+
+"""
+Out-of-core version of sections 2-4 of Assignment3_PedigreeAnalysis.py. The assignment reads GT and DP for every
+variant at once and then makes several full-size copies of them (the masked, phased, painted and filtered arrays).
+Here the VCF is read in blocks of variants with allel.iter_vcf_chunks, and each block is masked, phased, painted and
+filtered on its own. Only the per-chromosome sums and counts of the painted values are kept, so memory depends on the
+block length rather than on the size of the VCF.
+
+Phasing a block on its own is not enough, because phase_by_transmission orients each parent against the parent's
+previous phased heterozygous sites. The last window_size of those sites are therefore carried into the next block
+together with their phased state (see StreamingPhaser), which gives the same phase as phasing the whole VCF at once.
+Painting and filtering only look at one variant at a time.
+
+Like the assignment, the first two samples of the VCF are the father and the mother and the rest are their progeny.
+With -PedFile the VCF can instead hold many families, described by a PED file; every family and chromosome is then
+phased and painted in a pool of worker processes and all families are combined into one report.
+
+Example:
+    python pedigree_pipeline.py YHPedigree_Class.vcf -Output painting_means.csv
+    python pedigree_pipeline.py broods.vcf.gz -PedFile broods.ped -Output brood_report.csv -Processes 8
+"""
+
+PHASE_WINDOW = 100 # window_size passed to allel.phase_by_transmission
+MIN_DEPTH = 5 # painted calls with a sequencing depth below this are dropped
+MISSING = -1 # filtered painted value of a dropped call
+FILTER_BLOCK = 65536 # rows filtered and accumulated at a time
+DEFAULT_CHUNK_LENGTH = 65536 # variants read from the VCF at a time
+SCAN_WINDOW = 1_000_000 # bases per window of the sliding-window scan
+SCAN_STEP = 250_000 # bases between the starts of consecutive windows
+N_PERMUTATIONS = 10000 # sex-label shuffles of the permutation test
+PERMUTATION_BLOCK = 1000 # shuffles evaluated per matrix product, to bound memory
+PARENTS = ('paternal', 'maternal')
+VCF_FIELDS = ['variants/CHROM', 'calldata/GT', 'calldata/DP']
+
+
+def my_parse_args() -> argparse.Namespace:
+    """
+    Parse the command-line options of the pipeline.
+
+    :return parsed_args: the parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(description='phase and paint a pedigree VCF chunk by chunk and summarize the '
+                                                 'painted haplotypes of every progeny per chromosome')
+    parser.add_argument('VCFFile', type = str, help = 'pedigree VCF with the father, the mother and then the progeny')
+    parser.add_argument('-ChunkLength', type = int, help = 'number of variants read at a time', default = DEFAULT_CHUNK_LENGTH)
+    parser.add_argument('-WindowSize', type = int, help = 'window size for phasing the parents', default = PHASE_WINDOW)
+    parser.add_argument('-MinDepth', type = int, help = 'drop painted calls with a lower sequencing depth', default = MIN_DEPTH)
+    parser.add_argument('-Output', type = str, help = 'CSV file for the per-chromosome means, or the family report with -PedFile', default = 'painting_means.csv')
+    parser.add_argument('-PedFile', type = str, help = 'PED file describing the families in the VCF; switches to batch mode', default = None)
+    parser.add_argument('-Processes', type = int, help = 'number of worker processes in batch mode', default = None)
+    parser.add_argument('-Permutations', type = int, help = 'sex-label shuffles per family and parent in batch mode', default = N_PERMUTATIONS)
+    return parser.parse_args()
+
+
+def parent_masks(genotype: allel.GenotypeArray) -> dict[str, np.ndarray]:
+    """
+    Find the variants informative for each parent: heterozygous in that parent and homozygous in the other.
+
+    :param genotype: genotypes with the father and the mother as the first two samples
+    :return masks: boolean row masks keyed by 'paternal' and 'maternal'
+    """
+    is_het = genotype.is_het()
+    is_hom = genotype.is_hom()
+    return {'paternal': is_het[:, 0] & is_hom[:, 1],
+            'maternal': is_hom[:, 0] & is_het[:, 1]}
+
+
+def paint_progeny(phased: allel.GenotypeArray, parent: str) -> np.ndarray:
+    """
+    Paint the haplotype each progeny inherited from one parent by that parent's two haplotypes.
+
+    :param phased: phased genotypes with the father and the mother as the first two samples
+    :param parent: 'paternal' or 'maternal'
+    :return painted: array of shape (variants, progeny) with the allel.paint_transmission codes (1 to 7)
+    """
+    haplotypes = phased.to_haplotypes()
+    num_progeny = phased.n_samples - 2
+    if parent == 'paternal':
+        return allel.paint_transmission(haplotypes[:, (0, 1)], haplotypes[:, range(4, num_progeny*2+4, 2)])
+    return allel.paint_transmission(haplotypes[:, (2, 3)], haplotypes[:, range(5, num_progeny*2+4, 2)])
+
+
+class StreamingPhaser:
+    """
+    Phase consecutive blocks of variants with Mendelian transmission, with the same result as
+    allel.phase_by_transmission on all the blocks at once. Progeny are phased one variant at a time. A parent's
+    heterozygous site is oriented against the parent's previous window_size phased heterozygous sites, which may lie
+    in earlier blocks. The phaser therefore keeps those sites of each parent as phased, with their is_phased flags.
+    Each block's parents are phased with these rows in front. allel.phase_parents_by_transmission leaves rows that
+    are already phased as they are, but still uses them to orient the rows after them. A row kept for only one
+    parent has the other parent's genotype blanked, so the other parent ignores it.
+
+    :param window_size: window size for phasing the parents
+    """
+    def __init__(self, window_size: int = PHASE_WINDOW):
+        self.window_size = window_size
+        self.context = None
+        self.context_is_phased = None
+
+    def phase(self, genotype: allel.GenotypeArray) -> allel.GenotypeArray:
+        """
+        Phase the next block of variants.
+
+        :param genotype: genotypes of the block, with the father and the mother as the first two samples
+        :return phased: phased genotypes of the block, with is_phased set
+        """
+        block = allel.phase_progeny_by_transmission(np.asarray(genotype, dtype='i1'))
+        n_context = 0 if self.context is None else len(self.context)
+        if n_context:
+            phased = allel.GenotypeArray(np.concatenate([self.context, block.values]))
+            phased.is_phased = np.concatenate([self.context_is_phased, block.is_phased])
+        else:
+            phased = block
+        allel.phase_parents_by_transmission(phased, self.window_size)
+        self._keep_context(phased)
+
+        result = allel.GenotypeArray(phased.values[n_context:])
+        result.is_phased = phased.is_phased[n_context:]
+        return result
+
+    def _keep_context(self, phased: allel.GenotypeArray):
+        """
+        Keep the last window_size phased heterozygous rows of each parent for the next block.
+
+        :param phased: context and block after phasing the parents
+        """
+        parent_het = phased.is_het()[:, :2] & phased.is_phased[:, :2]
+        kept = np.zeros(parent_het.shape, dtype=bool)
+        for parent in range(2):
+            kept[np.flatnonzero(parent_het[:, parent])[-self.window_size:], parent] = True
+        rows = np.flatnonzero(kept.any(axis=1))
+        self.context = phased.values[rows].copy()
+        self.context_is_phased = phased.is_phased[rows].copy()
+        for parent in range(2):
+            self.context[~kept[rows, parent], parent] = MISSING
+
+class PhasingCache:
+    """
+    On-disk cache of phased genotypes and painted arrays, so that changing a downstream step (the depth threshold,
+    the summaries, the plots) does not rerun phase_by_transmission and paint_transmission. An entry is keyed by a
+    content hash of the VCF, the sample layout (parents first, then progeny), the phasing window size and the parent
+    painted. Entries are read back as copy-on-write memory maps: nothing is read until it is used, and in-place edits
+    such as the "-= 1" of section 3 change only the copy in memory, never the cache.
+
+    :param cache_dir: directory holding the cache
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def vcf_hash(self, vcf_path: str) -> str:
+        """
+        Hash the contents of a VCF, remembered in the cache directory so the file is only read again after it changes
+        (see cached_file_hash).
+
+        :param vcf_path: path to the VCF
+        :return digest: hex SHA-256 digest of the file contents
+        """
+        return cached_file_hash(vcf_path, os.path.join(self.cache_dir, 'vcf_hashes.json'))
+
+    def entry_dir(self, vcf_hash: str, samples: list[str], window_size: int, parent: str) -> str:
+        """Directory of the entry for one VCF, sample layout, window size and parent"""
+        key = hashlib.sha1(json.dumps([list(map(str, samples)), window_size, parent]).encode()).hexdigest()
+        return os.path.join(self.cache_dir, vcf_hash, key)
+
+    def phase_and_paint(self, vcf_path: str, samples: list[str], genotype: allel.GenotypeArray, parent: str,
+                        window_size: int = PHASE_WINDOW) -> tuple[allel.GenotypeArray, np.ndarray]:
+        """
+        Phase the informative variants of one parent and paint the progeny by that parent's haplotypes, or load both
+        from the cache.
+
+        :param vcf_path: path to the VCF the genotypes were read from
+        :param samples: sample names of the genotype columns (father, mother, then progeny)
+        :param genotype: genotypes of the informative variants of the parent (the rows of its parent_masks mask)
+        :param parent: 'paternal' or 'maternal'
+        :param window_size: window size for phasing the parents
+        :return phased, painted: phased genotypes with is_phased set, and the painted codes (memory-mapped if cached)
+        """
+        entry = self.entry_dir(self.vcf_hash(vcf_path), samples, window_size, parent)
+        if os.path.exists(os.path.join(entry, 'meta.json')):
+            phased = allel.GenotypeArray(np.load(os.path.join(entry, 'phased.npy'), mmap_mode='c'))
+            phased.is_phased = np.load(os.path.join(entry, 'is_phased.npy'), mmap_mode='c')
+            return phased, np.load(os.path.join(entry, 'painted.npy'), mmap_mode='c')
+
+        phased = allel.phase_by_transmission(genotype, window_size)
+        painted = paint_progeny(phased, parent)
+        os.makedirs(entry, exist_ok=True)
+        for name, values in (('phased', phased.values), ('is_phased', phased.is_phased), ('painted', painted)):
+            write_atomic(os.path.join(entry, f'{name}.npy'), lambda handle: np.save(handle, values), mode='wb')
+        # written last: an entry without it is incomplete and gets recomputed
+        meta = {'samples': list(map(str, samples)), 'window_size': window_size, 'parent': parent,
+                'n_variants': len(painted)}
+        write_atomic(os.path.join(entry, 'meta.json'), lambda handle: json.dump(meta, handle))
+        return phased, painted
+
+
+def filter_painted(painted: np.ndarray, is_phased: np.ndarray, depth: np.ndarray, min_depth: int = MIN_DEPTH,
+                   rows: np.ndarray = None, block_rows: int = FILTER_BLOCK) -> np.ndarray:
+    """
+    Section 3 of the assignment in a single pass: keep the calls painted 1 (first parental haplotype) or 2 (second
+    parental haplotype) as 0 or 1, and set everything else, the unphased calls and the calls shallower than min_depth
+    to MISSING. The assignment does this with an in-place subtraction, a float16 copy and three full-size boolean
+    masks. Here the rows are processed in blocks through a few reused block-sized buffers and written straight into
+    an int8 result, so the only full-size array is the result, at half the size of the float16 copy.
+
+    :param painted: painted codes of shape (variants, progeny), as returned by paint_progeny
+    :param is_phased: phased flags of the progeny for the same rows (the is_phased[:, 2:] of the phased genotypes)
+    :param depth: sequencing depth of the progeny (depth[:, 2:]), either for the same rows as painted or, with rows,
+    for all variants
+    :param min_depth: shallowest call kept
+    :param rows: row of depth for every row of painted (e.g. np.flatnonzero of the parent's mask), so that depth does
+    not have to be subset first
+    :param block_rows: rows processed at a time
+    :return filtered: int8 array of shape (variants, progeny) with 0, 1 or MISSING
+    """
+    n_rows, n_progeny = painted.shape
+    filtered = np.empty((n_rows, n_progeny), dtype=np.int8)
+    block_rows = max(1, min(block_rows, n_rows))
+    code = np.empty((block_rows, n_progeny), dtype=np.uint8)
+    keep = np.empty((block_rows, n_progeny), dtype=bool)
+    deep = np.empty((block_rows, n_progeny), dtype=bool)
+    for start in range(0, n_rows, block_rows):
+        stop = min(start + block_rows, n_rows)
+        n = stop - start
+        # codes 1 and 2 become 0 and 1; the undetermined code 0 wraps around to 255 and is dropped with codes 3-7
+        np.subtract(painted[start:stop], 1, out=code[:n], casting='unsafe')
+        np.less_equal(code[:n], 1, out=keep[:n])
+        np.logical_and(keep[:n], is_phased[start:stop], out=keep[:n])
+        block_depth = depth[start:stop] if rows is None else depth[rows[start:stop]]
+        np.greater_equal(block_depth, min_depth, out=deep[:n])
+        np.logical_and(keep[:n], deep[:n], out=keep[:n])
+        filtered[start:stop] = MISSING
+        np.copyto(filtered[start:stop], code[:n], casting='unsafe', where=keep[:n])
+    return filtered
+
+
+def _called_values(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Split filtered values into the calls that were kept and the values with dropped calls set to 0.
+
+    :param values: filtered values, int8 with MISSING or float with nan for dropped calls
+    :return called, filled: boolean array of kept calls, and the values with 0 for dropped calls
+    """
+    called = ~np.isnan(values) if values.dtype.kind == 'f' else values != MISSING
+    return called, np.where(called, values, 0)
+
+
+class ChromosomeAccumulator:
+    """
+    Running per-chromosome, per-progeny sums and counts of the filtered painted values. Dividing the two gives the
+    per-chromosome means that the assignment computes with np.nanmean in section 4.
+
+    :param n_progeny: number of progeny
+    """
+    def __init__(self, n_progeny: int):
+        self.n_progeny = n_progeny
+        self.sums = {}
+        self.counts = {}
+
+    def register(self, chromosomes: np.ndarray):
+        """
+        Make sure every chromosome of a block has an entry, even if none of its variants pass the filters.
+
+        :param chromosomes: chromosome names of the variants in a block
+        """
+        for chrom in np.unique(chromosomes):
+            if chrom not in self.sums:
+                self.sums[chrom] = np.zeros(self.n_progeny, dtype=np.float64)
+                self.counts[chrom] = np.zeros(self.n_progeny, dtype=np.int64)
+
+    def add(self, chromosomes: np.ndarray, values: np.ndarray):
+        """
+        Add filtered values. Rows of the same chromosome are expected to be contiguous, as in a sorted VCF; each run
+        of rows is summed with one reduceat. The rows are added in blocks, so no full-size temporary is made.
+
+        :param chromosomes: chromosome name of every row
+        :param values: filtered values of shape (rows, progeny), int8 with MISSING (as from filter_painted) or float
+        with nan for dropped calls
+        """
+        if not len(values):
+            return
+        self.register(chromosomes)
+        for start in range(0, len(values), FILTER_BLOCK):
+            block_chromosomes = chromosomes[start:start + FILTER_BLOCK]
+            called, filled = _called_values(values[start:start + FILTER_BLOCK])
+            starts = np.flatnonzero(np.r_[True, block_chromosomes[1:] != block_chromosomes[:-1]])
+            sums = np.add.reduceat(filled, starts, axis=0, dtype=np.float64)
+            counts = np.add.reduceat(called, starts, axis=0, dtype=np.int64)
+            for chrom, chrom_sums, chrom_counts in zip(block_chromosomes[starts], sums, counts):
+                self.sums[chrom] += chrom_sums
+                self.counts[chrom] += chrom_counts
+
+    def chromosomes(self) -> list[str]:
+        """
+        :return chromosomes: the chromosomes seen so far, sorted like np.unique
+        """
+        return sorted(self.sums)
+
+    def means(self) -> list[np.ndarray]:
+        """
+        :return means: per-progeny mean of every chromosome, in the order of chromosomes(); nan without any calls
+        """
+        return [np.divide(self.sums[chrom], self.counts[chrom], out=np.full(self.n_progeny, np.nan),
+                          where=self.counts[chrom] > 0)
+                for chrom in self.chromosomes()]
+
+
+def chromosome_means(chromosomes: np.ndarray, values: np.ndarray, unique_chromosomes: list[str]) -> list[np.ndarray]:
+    """
+    Per-chromosome, per-progeny nan-aware means of the filtered painted values, as section 4 of the assignment
+    computes them. The rows are sorted by chromosome once and every chromosome is summed with one reduceat, instead
+    of building a boolean mask over all rows for every chromosome.
+
+    :param chromosomes: chromosome name of every row
+    :param values: filtered values of shape (rows, progeny), int8 with MISSING or float with nan for dropped calls
+    :param unique_chromosomes: chromosomes to report, in order; those without rows get nan means
+    :return means: one array of per-progeny means per chromosome of unique_chromosomes
+    """
+    totals = ChromosomeAccumulator(values.shape[1])
+    totals.register(np.asarray(unique_chromosomes))
+    order = np.argsort(chromosomes, kind='stable')
+    totals.add(chromosomes[order], values[order])
+    means = dict(zip(totals.chromosomes(), totals.means()))
+    return [means[chrom] for chrom in unique_chromosomes]
+
+
+def scan_windows(chromosomes: np.ndarray, positions: np.ndarray, values: np.ndarray, window_size: int = SCAN_WINDOW,
+                 step: int = None) -> dict:
+    """
+    Per-window, per-progeny nan-aware sums, counts and means of the filtered painted values along every chromosome.
+    The rows are sorted by chromosome and position once and summed into bins of step bases with np.add.reduceat.
+    Overlapping windows (step smaller than window_size) are then differences of the cumulative bin sums, so every
+    window costs the same however much it overlaps its neighbours. Windows cover bases start to stop (1-based,
+    inclusive) and the last window of a chromosome ends at its last bin.
+
+    :param chromosomes: chromosome name of every row
+    :param positions: 1-based position of every row
+    :param values: filtered values of shape (rows, progeny), int8 with MISSING or float with nan for dropped calls
+    :param window_size: bases per window
+    :param step: bases between window starts; defaults to window_size (adjacent windows). window_size must be a
+    multiple of it
+    :return windows: dict of arrays with one entry per window: 'chromosome', 'start', 'stop', 'n_variants', and the
+    (windows, progeny) arrays 'sums', 'counts' and 'means'
+    """
+    step = step or window_size
+    assert window_size % step == 0, 'window_size must be a multiple of step'
+    bins_per_window = window_size // step
+    n_progeny = values.shape[1]
+
+    order = np.lexsort((positions, chromosomes))
+    chromosomes = chromosomes[order]
+    bins = (positions[order] - 1) // step
+    called, filled = _called_values(values[order])
+
+    # reduce every run of rows sharing a chromosome and a bin
+    new_run = np.r_[True, (chromosomes[1:] != chromosomes[:-1]) | (bins[1:] != bins[:-1])]
+    run_starts = np.flatnonzero(new_run)
+    run_sums = np.add.reduceat(filled, run_starts, axis=0, dtype=np.float64)
+    run_counts = np.add.reduceat(called, run_starts, axis=0, dtype=np.int64)
+    run_variants = np.diff(np.r_[run_starts, len(bins)])
+    run_chroms = chromosomes[run_starts]
+    run_bins = bins[run_starts]
+
+    # lay the bins of all chromosomes out densely, one chromosome after the other
+    names, first_run = np.unique(run_chroms, return_index=True)
+    chrom_of_run = np.searchsorted(names, run_chroms)
+    n_bins = np.maximum.reduceat(run_bins, first_run) + 1
+    bin_offsets = np.r_[0, np.cumsum(n_bins)]
+    dense_index = bin_offsets[chrom_of_run] + run_bins
+    dense_sums = np.zeros((bin_offsets[-1], n_progeny))
+    dense_counts = np.zeros((bin_offsets[-1], n_progeny), dtype=np.int64)
+    dense_variants = np.zeros(bin_offsets[-1], dtype=np.int64)
+    dense_sums[dense_index] = run_sums
+    dense_counts[dense_index] = run_counts
+    dense_variants[dense_index] = run_variants
+
+    # a window starts at every bin that leaves room for a full window, and at least at the first bin
+    n_windows = np.maximum(n_bins - bins_per_window + 1, 1)
+    window_chrom = np.repeat(np.arange(len(names)), n_windows)
+    window_bin = np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    first = bin_offsets[window_chrom] + window_bin
+    last = np.minimum(first + bins_per_window, bin_offsets[window_chrom + 1])
+
+    def window_totals(dense):
+        cumulative = np.concatenate([np.zeros((1,) + dense.shape[1:], dtype=dense.dtype), np.cumsum(dense, axis=0)])
+        return cumulative[last] - cumulative[first]
+
+    sums = window_totals(dense_sums)
+    counts = window_totals(dense_counts)
+    return {'chromosome': names[window_chrom],
+            'start': window_bin * step + 1,
+            'stop': (window_bin + (last - first)) * step,
+            'n_variants': window_totals(dense_variants),
+            'sums': sums,
+            'counts': counts,
+            'means': np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)}
+
+
+def group_mean(means: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """
+    Mean over a group of progeny of per-progeny means, ignoring progeny without calls.
+
+    :param means: array of shape (windows or chromosomes, progeny)
+    :param group: boolean mask over the progeny
+    :return group_means: one value per row of means, nan where no progeny of the group has calls
+    """
+    group_values = means[:, group]
+    n_called = (~np.isnan(group_values)).sum(axis=1)
+    return np.divide(np.nansum(group_values, axis=1), n_called, out=np.full(len(means), np.nan), where=n_called > 0)
+
+
+def sex_differentiation(means: np.ndarray, is_male: np.ndarray, is_female: np.ndarray) -> np.ndarray:
+    """
+    Male-vs-female differentiation of per-progeny means: the mean over the males minus the mean over the females,
+    ignoring progeny without calls. A sex-linked region inherited from one parent gives values near +1 or -1 for that
+    parent, and unlinked regions give values near 0.
+
+    :param means: array of shape (windows or chromosomes, progeny)
+    :param is_male: boolean mask over the progeny
+    :param is_female: boolean mask over the progeny
+    :return differentiation: one value per row of means, nan where either sex has no calls
+    """
+    return group_mean(means, is_male) - group_mean(means, is_female)
+
+
+def permutation_test(means: np.ndarray, is_male: np.ndarray, is_female: np.ndarray,
+                     n_permutations: int = N_PERMUTATIONS, seed: int = None,
+                     block_size: int = PERMUTATION_BLOCK) -> dict:
+    """
+    Test every row of a mean matrix (one row per chromosome or per window, one column per progeny) for a difference
+    between the males and the females by shuffling the sex labels. A block of shuffles is one label matrix, and the
+    nan-aware male sums and counts of every row under every shuffle come from two matrix products with it, so no
+    Python loop runs over the shuffles. Besides the per-row empirical p-value, each row gets a p-value corrected for
+    testing all rows: the fraction of shuffles whose largest difference over all rows reaches the observed one
+    (max-statistic correction).
+
+    :param means: array of shape (rows, progeny) with nan where a progeny has no calls
+    :param is_male: boolean mask over the progeny
+    :param is_female: boolean mask over the progeny; progeny of neither sex are left out
+    :param n_permutations: number of shuffles
+    :param seed: random seed
+    :param block_size: shuffles per label matrix
+    :return results: dict of per-row arrays: 'difference' (male mean minus female mean), 'p_value' and 'p_adjusted',
+    plus 'n_permutations'
+    """
+    rng = np.random.default_rng(seed)
+    grouped = is_male | is_female
+    values = np.asarray(means, dtype=np.float64)[:, grouped]
+    called = ~np.isnan(values)
+    values = np.where(called, values, 0.0)
+    called = called.astype(np.float64)
+    total_sums = values.sum(axis=1)
+    total_counts = called.sum(axis=1)
+    labels = is_male[grouped].astype(np.float64)
+
+    def abs_difference(male_labels):
+        male_sums = male_labels @ values.T
+        male_counts = male_labels @ called.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.abs(male_sums / male_counts - (total_sums - male_sums) / (total_counts - male_counts))
+
+    difference = sex_differentiation(means, is_male, is_female)
+    observed = np.abs(difference)
+    # a shuffle ties the observed value when it is equal up to rounding
+    threshold = observed - 1e-12
+    exceed = np.zeros(len(values), dtype=np.int64)
+    exceed_max = np.zeros(len(values), dtype=np.int64)
+    for start in range(0, n_permutations, block_size):
+        n_block = min(block_size, n_permutations - start)
+        shuffled = rng.permuted(np.broadcast_to(labels, (n_block, len(labels))), axis=1)
+        permuted = abs_difference(shuffled)
+        exceed += (permuted >= threshold).sum(axis=0)
+        block_max = np.max(np.where(np.isnan(permuted), -np.inf, permuted), axis=1)
+        exceed_max += (block_max[:, None] >= threshold).sum(axis=0)
+
+    untestable = np.isnan(observed)
+    p_value = (exceed + 1) / (n_permutations + 1)
+    p_adjusted = (exceed_max + 1) / (n_permutations + 1)
+    p_value[untestable] = np.nan
+    p_adjusted[untestable] = np.nan
+    return {'difference': difference, 'p_value': p_value, 'p_adjusted': p_adjusted, 'n_permutations': n_permutations}
+
+
+def write_scan(scans: dict, path: str, is_male: np.ndarray, is_female: np.ndarray, linkage_groups: dict = None):
+    """
+    Write the sliding-window scans of both parents, with their male-vs-female differentiation track, as a CSV.
+
+    :param scans: output of scan_windows keyed by parent
+    :param path: path of the CSV file
+    :param is_male: boolean mask over the progeny
+    :param is_female: boolean mask over the progeny
+    :param linkage_groups: optional chromosome to linkage group names
+    """
+    linkage_groups = linkage_groups or {}
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(['parent', 'chromosome', 'linkage_group', 'start', 'stop', 'n_variants', 'differentiation'])
+        for parent, scan in scans.items():
+            differentiation = sex_differentiation(scan['means'], is_male, is_female)
+            for row in zip(scan['chromosome'], scan['start'], scan['stop'], scan['n_variants'], differentiation):
+                chrom = row[0]
+                writer.writerow([parent, chrom, linkage_groups.get(chrom, chrom), *row[1:]])
+
+
+def read_ped(ped_path: str) -> dict[str, dict]:
+    """
+    Read the families of a PED file (whitespace-separated FamilyID, IndividualID, PaternalID, MaternalID, Sex and
+    optional further columns; 0 for an unknown parent, sex 1 for male and 2 for female). The progeny of a family are
+    its individuals with both parents given, and all of them must share the same two parents.
+
+    :param ped_path: path to the PED file
+    :return families: dict keyed by family ID with the 'father', the 'mother', the list of 'progeny' and a boolean
+    array each for 'is_male' and 'is_female' over the progeny
+    """
+    sexes = {}
+    broods = {}
+    with open(ped_path) as ped_file:
+        for line in ped_file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            family, individual, father, mother, sex = fields[:5]
+            sexes[individual] = sex
+            if father != '0' and mother != '0':
+                broods.setdefault(family, {}).setdefault((father, mother), []).append(individual)
+
+    families = {}
+    for family, parents in broods.items():
+        assert len(parents) == 1, f'family {family} has progeny of more than one pair of parents'
+        (father, mother), progeny = next(iter(parents.items()))
+        families[family] = {'father': father,
+                            'mother': mother,
+                            'progeny': progeny,
+                            'is_male': np.array([sexes[child] == '1' for child in progeny]),
+                            'is_female': np.array([sexes[child] == '2' for child in progeny])}
+    return families
+
+
+def vcf_chromosomes(vcf_path: str) -> list[str]:
+    """
+    List the chromosomes of a VCF, from its ##contig header lines or, without them, from its records.
+
+    :param vcf_path: path to the VCF
+    :return chromosomes: chromosome names in order of appearance
+    """
+    headers = allel.read_vcf_headers(vcf_path).headers
+    chromosomes = [match.group(1) for match in (re.match(r'##contig=<ID=([^,>]+)', line) for line in headers) if match]
+    if not chromosomes:
+        chromosomes = list(dict.fromkeys(allel.read_vcf(vcf_path, fields=['variants/CHROM'])['variants/CHROM']))
+    return chromosomes
+
+
+# Each worker keeps the chromosome it read last. Tasks are handed out chromosome by chromosome, so a chromosome is
+# parsed once per worker however many families share it.
+_REGION_STATE = {}
+
+
+def _load_region(vcf_path: str, chromosome: str, samples: list[str]) -> dict | None:
+    key = (vcf_path, chromosome)
+    if _REGION_STATE.get('key') != key:
+        _REGION_STATE.clear()
+        region = allel.read_vcf(vcf_path, region=chromosome, samples=samples,
+                                fields=['calldata/GT', 'calldata/DP', 'samples'])
+        _REGION_STATE.update(key=key, region=region)
+    return _REGION_STATE['region']
+
+
+def _paint_family_chromosome(task: tuple) -> tuple[str, str, dict]:
+    """
+    Phase, paint and filter one family on one chromosome and sum the painted values of every progeny.
+
+    :param task: tuple of the VCF path, the chromosome, the family ID, the family's samples (father, mother, then
+    progeny), all samples of the batch, the phasing window size and the depth threshold
+    :return result: tuple of the family ID, the chromosome and a (sums, counts) pair per parent
+    """
+    vcf_path, chromosome, family, family_samples, all_samples, window_size, min_depth = task
+    region = _load_region(vcf_path, chromosome, all_samples)
+    n_progeny = len(family_samples) - 2
+    totals = {parent: (np.zeros(n_progeny), np.zeros(n_progeny, dtype=np.int64)) for parent in PARENTS}
+    if region is None: # no variants on this chromosome
+        return family, chromosome, totals
+    columns = [list(region['samples']).index(sample) for sample in family_samples]
+    genotype = allel.GenotypeArray(region['calldata/GT'][:, columns])
+    depth = region['calldata/DP'][:, columns]
+    for parent, mask in parent_masks(genotype).items():
+        if not mask.any():
+            continue
+        phased = allel.phase_by_transmission(genotype[mask], window_size)
+        filtered = filter_painted(paint_progeny(phased, parent), phased.is_phased[:, 2:], depth[:, 2:], min_depth,
+                                  rows=np.flatnonzero(mask))
+        called, filled = _called_values(filtered)
+        totals[parent] = (filled.sum(axis=0, dtype=np.float64), called.sum(axis=0))
+    return family, chromosome, totals
+
+
+def run_families(vcf_path: str, families: dict[str, dict], processes: int = None, window_size: int = PHASE_WINDOW,
+                 min_depth: int = MIN_DEPTH, chromosomes: list[str] = None) -> dict[str, dict]:
+    """
+    Phase and paint every family of a multi-family VCF, one task per family and chromosome, in a pool of worker
+    processes. Unlike the single-family script, every chromosome is phased on its own, so the phase of the parents
+    is not carried over from the end of one chromosome to the start of the next.
+
+    :param vcf_path: VCF holding all families; a bgzip-compressed VCF with a tabix index lets each chromosome be read
+    without scanning the others
+    :param families: output of read_ped
+    :param processes: number of worker processes; defaults to the number of CPUs
+    :param window_size: window size for phasing the parents
+    :param min_depth: shallowest painted call kept
+    :param chromosomes: chromosomes to analyze; defaults to every chromosome of the VCF
+    :return results: dict keyed by family ID with a ChromosomeAccumulator per parent
+    """
+    if chromosomes is None:
+        chromosomes = vcf_chromosomes(vcf_path)
+    vcf_samples = set(allel.read_vcf_headers(vcf_path).samples)
+    family_samples = {}
+    for family, members in families.items():
+        family_samples[family] = [members['father'], members['mother']] + members['progeny']
+        missing = [sample for sample in family_samples[family] if sample not in vcf_samples]
+        assert not missing, f'samples of family {family} missing from {vcf_path}: {", ".join(missing)}'
+    all_samples = sorted({sample for samples in family_samples.values() for sample in samples})
+
+    tasks = [(vcf_path, chromosome, family, family_samples[family], all_samples, window_size, min_depth)
+             for chromosome in chromosomes for family in families]
+    results = {family: {parent: ChromosomeAccumulator(len(families[family]['progeny'])) for parent in PARENTS}
+               for family in families}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for family, chromosome, totals in pool.map(_paint_family_chromosome, tasks, chunksize=len(families)):
+            for parent, (sums, counts) in totals.items():
+                results[family][parent].register(np.array([chromosome]))
+                results[family][parent].sums[chromosome] += sums
+                results[family][parent].counts[chromosome] += counts
+    return results
+
+
+def write_family_report(results: dict[str, dict], families: dict[str, dict], path: str,
+                        n_permutations: int = N_PERMUTATIONS, seed: int = None):
+    """
+    Write one CSV row per family, parent and chromosome with the male and female means, their difference and its
+    permutation p-values (corrected over the chromosomes of the family and parent).
+
+    :param results: output of run_families
+    :param families: output of read_ped
+    :param path: path of the CSV file
+    :param n_permutations: sex-label shuffles per family and parent
+    :param seed: random seed
+    """
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(['family', 'parent', 'chromosome', 'n_progeny', 'n_calls', 'male_mean', 'female_mean',
+                         'difference', 'p_value', 'p_adjusted'])
+        for family, totals in results.items():
+            is_male = families[family]['is_male']
+            is_female = families[family]['is_female']
+            for parent in PARENTS:
+                chromosomes = totals[parent].chromosomes()
+                means = np.vstack(totals[parent].means())
+                male_means = group_mean(means, is_male)
+                female_means = group_mean(means, is_female)
+                test = permutation_test(means, is_male, is_female, n_permutations=n_permutations, seed=seed)
+                for idx, chrom in enumerate(chromosomes):
+                    writer.writerow([family, parent, chrom, len(is_male), totals[parent].counts[chrom].sum(),
+                                     male_means[idx], female_means[idx], test['difference'][idx],
+                                     test['p_value'][idx], test['p_adjusted'][idx]])
+
+
+def run_pipeline(vcf_path: str, chunk_length: int = DEFAULT_CHUNK_LENGTH, window_size: int = PHASE_WINDOW,
+                 min_depth: int = MIN_DEPTH) -> dict:
+    """
+    Run sections 2-4 of the assignment chunk by chunk.
+
+    :param vcf_path: pedigree VCF with the father, the mother and then the progeny
+    :param chunk_length: number of variants read at a time
+    :param window_size: window size for phasing the parents
+    :param min_depth: shallowest painted call kept
+    :return results: dict with the VCF 'samples' and a ChromosomeAccumulator for 'paternal' and for 'maternal'
+    """
+    fields, samples, headers, chunks = allel.iter_vcf_chunks(vcf_path, fields=VCF_FIELDS, chunk_length=chunk_length)
+    n_progeny = len(samples) - 2
+    phasers = {parent: StreamingPhaser(window_size) for parent in PARENTS}
+    results = {'samples': samples}
+    results.update({parent: ChromosomeAccumulator(n_progeny) for parent in PARENTS})
+
+    for chunk, _, _, _ in chunks:
+        chromosome = chunk['variants/CHROM']
+        genotype = allel.GenotypeArray(chunk['calldata/GT'])
+        depth = chunk['calldata/DP']
+        for parent, mask in parent_masks(genotype).items():
+            results[parent].register(chromosome)
+            if not mask.any():
+                continue
+            phased = phasers[parent].phase(genotype[mask])
+            painted = paint_progeny(phased, parent)
+            filtered = filter_painted(painted, phased.is_phased[:, 2:], depth[:, 2:], min_depth,
+                                      rows=np.flatnonzero(mask))
+            results[parent].add(chromosome[mask], filtered)
+    return results
+
+
+def write_means(results: dict, path: str):
+    """
+    Write the per-chromosome means of every progeny as a long-format CSV.
+
+    :param results: output of run_pipeline
+    :param path: path of the CSV file
+    """
+    progeny = results['samples'][2:]
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(['parent', 'chromosome', 'sample', 'n_calls', 'mean'])
+        for parent in PARENTS:
+            totals = results[parent]
+            for chrom, means in zip(totals.chromosomes(), totals.means()):
+                for sample, n_calls, mean in zip(progeny, totals.counts[chrom], means):
+                    writer.writerow([parent, chrom, sample, n_calls, mean])
+
+
+### MAIN CODE ###
+if __name__ == '__main__':
+    args = my_parse_args()
+    if args.PedFile:
+        families = read_ped(args.PedFile)
+        print(f'painting {len(families)} families from {args.VCFFile}')
+        results = run_families(args.VCFFile, families, processes=args.Processes, window_size=args.WindowSize,
+                               min_depth=args.MinDepth)
+        write_family_report(results, families, args.Output, n_permutations=args.Permutations)
+        print(f'family report written to {args.Output}')
+    else:
+        results = run_pipeline(args.VCFFile, chunk_length=args.ChunkLength, window_size=args.WindowSize,
+                               min_depth=args.MinDepth)
+        print(f'painted {len(results["samples"]) - 2} progeny on {len(results["paternal"].chromosomes())} chromosomes')
+        write_means(results, args.Output)
+        print(f'per-chromosome means written to {args.Output}')
@@ -0,0 +1,265 @@
+import argparse # Take in arguments
+import json # Read and write benchmark baselines
+import os # Manage the synthetic data directory
+import sys # Exit status for regressions
+import time # Wall-clock timing of each stage
+import tracemalloc # Peak memory of each stage
+import numpy as np # Generate synthetic genomes and variants
+import rad_hw # The pipeline being benchmarked
+
+"""
+Benchmark suite for the rad_hw pipeline. It generates synthetic genomes of the requested sizes with planted AanI and
+MroI cut sites, plus a matching two-sample VCF with a configurable variant density. It then times read_fasta,
+find_motifs, run_single_rad, run_ddrad and find_variable_sites and records the peak memory of each stage. Each stage's
+output counts are compared exactly against a stored baseline, and its time and memory must stay within a tolerance
+of that baseline. The real cichlid data can also be checked against the known expected outputs of the assignment.
+
+Example:
+    python rad_benchmark.py -Sizes 1000000 10000000 -UpdateBaseline    # record a baseline
+    python rad_benchmark.py -Sizes 1000000 10000000                    # compare against it
+"""
+
+SYNTHETIC_CHROMOSOME = 'synthetic_1'
+PLANTED_MOTIFS = ('TTATAA', 'TCCGGA') # AanI and MroI sites
+PLANTED_SPACING = 2000 # One planted cut site per this many bases on average
+LINE_LENGTH = 60 # Bases per FASTA line
+GENERATE_CHUNK = LINE_LENGTH * 100_000 # Bases generated at a time, a whole number of FASTA lines
+
+# Known outputs for chromosome NC_036780.1 of the course genome, from the assignment's testing code
+KNOWN_OUTPUTS = {'run_single_rad': {'n_sites': 19280, 'first_site': [44450, 44650]},
+                 'run_ddrad': {'n_sites': 848, 'first_site': [91143, 91243]}}
+
+
+def my_parse_args() -> argparse.Namespace:
+    """
+    Parse the command-line options of the benchmark.
+
+    :return parsed_args: the parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(description='benchmark the rad_hw pipeline on synthetic genomes and compare the '
+                                                 'results against a stored baseline')
+    parser.add_argument('-Sizes', type = int, nargs = '+', help = 'synthetic genome sizes in bases', default = [1_000_000, 10_000_000])
+    parser.add_argument('-VariantDensity', type = float, help = 'variants per base in the synthetic VCF', default = 0.001)
+    parser.add_argument('-Seed', type = int, help = 'random seed for the synthetic data', default = 8802)
+    parser.add_argument('-WorkDir', type = str, help = 'directory for the synthetic data', default = 'rad_benchmark_data')
+    parser.add_argument('-Baseline', type = str, help = 'baseline JSON file', default = 'rad_benchmark_baseline.json')
+    parser.add_argument('-UpdateBaseline', action = 'store_true', help = 'store this run as the new baseline')
+    parser.add_argument('-Tolerance', type = float, help = 'allowed slowdown / memory growth factor over the baseline', default = 1.5)
+    parser.add_argument('-GenomeFile', type = str, help = 'course genome file, to check the known expected outputs', default = None)
+    return parser.parse_args()
+
+
+def write_synthetic_genome(path: str, length: int, seed: int):
+    """
+    Write a single-chromosome FASTA of uniformly random bases with AanI and MroI sites planted at random positions.
+    The sequence is generated in chunks, so genomes up to the gigabase range never sit in memory at once.
+
+    :param path: path of the FASTA file to write
+    :param length: number of bases
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+    alphabet = np.frombuffer(b'ACGT', dtype=np.uint8)
+    motifs = [np.frombuffer(motif.encode(), dtype=np.uint8) for motif in PLANTED_MOTIFS]
+    with open(path, 'wb') as fasta:
+        fasta.write(f'>{SYNTHETIC_CHROMOSOME}\n'.encode())
+        for start in range(0, length, GENERATE_CHUNK):
+            n_bases = min(GENERATE_CHUNK, length - start)
+            seq = alphabet[rng.integers(0, 4, n_bases)]
+            n_sites = n_bases // PLANTED_SPACING
+            if n_bases > max(len(motif) for motif in motifs):
+                positions = rng.integers(0, n_bases - len(motifs[0]), n_sites)
+                which = rng.integers(0, len(motifs), n_sites)
+                for motif_idx, motif in enumerate(motifs):
+                    planted = positions[which == motif_idx]
+                    for offset, base in enumerate(motif):
+                        seq[planted + offset] = base
+            text = seq.tobytes()
+            fasta.write(b'\n'.join(text[i:i + LINE_LENGTH] for i in range(0, n_bases, LINE_LENGTH)) + b'\n')
+
+
+def write_synthetic_vcf(path: str, length: int, density: float, seed: int):
+    """
+    Write a two-sample VCF for the synthetic chromosome. Genotypes are drawn so that roughly a third of the variants
+    are fixed differences (0/0 vs 1/1), with the rest heterozygous, shared or uncalled.
+
+    :param path: path of the VCF file to write
+    :param length: length of the synthetic chromosome
+    :param density: variants per base
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed + 1)
+    positions = np.unique(rng.integers(1, length, max(1, int(length * density))))
+    genotype_pairs = np.array([['0/0', '1/1'], ['1/1', '0/0'], ['0/1', '1/1'], ['0/0', '0/1'], ['./.', '1/1'],
+                               ['0/0', '0/0']])
+    weights = np.array([0.17, 0.16, 0.2, 0.2, 0.07, 0.2])
+    drawn = genotype_pairs[rng.choice(len(genotype_pairs), positions.size, p=weights)]
+    with open(path, 'w') as vcf_file:
+        vcf_file.write('##fileformat=VCFv4.2\n')
+        vcf_file.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        vcf_file.write(f'##contig=<ID={SYNTHETIC_CHROMOSOME},length={length}>\n')
+        vcf_file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\n')
+        for start in range(0, positions.size, 100_000):
+            vcf_file.write(''.join(f'{SYNTHETIC_CHROMOSOME}\t{pos}\t.\tA\tG\t50\tPASS\t.\tGT\t{gt1}\t{gt2}\n'
+                                   for pos, (gt1, gt2) in zip(positions[start:start + 100_000].tolist(),
+                                                              drawn[start:start + 100_000].tolist())))
+
+
+def synthetic_dataset(work_dir: str, length: int, density: float, seed: int) -> tuple[str, str]:
+    """
+    Return the FASTA and VCF paths of a synthetic dataset, generating the files only if they do not exist yet.
+
+    :param work_dir: directory for the synthetic data
+    :param length: genome size in bases
+    :param density: variants per base
+    :param seed: random seed
+    :return genome_file, vcf_file: paths of the generated files
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    genome_file = os.path.join(work_dir, f'synthetic_{length}_{seed}.fa')
+    vcf_file = os.path.join(work_dir, f'synthetic_{length}_{seed}_{density}.vcf')
+    if not os.path.exists(genome_file):
+        write_synthetic_genome(genome_file, length, seed)
+        rad_hw.pyfaidx.Fasta(genome_file) # build the .fai index now so it is not timed as part of read_fasta
+    if not os.path.exists(vcf_file):
+        write_synthetic_vcf(vcf_file, length, density, seed)
+    return genome_file, vcf_file
+
+
+def measure(stage, *args, **kwargs) -> tuple[object, dict]:
+    """
+    Run one pipeline stage and measure its wall time and peak traced memory. Memory tracing adds the same overhead to
+    every run, so times stay comparable with a baseline recorded the same way.
+
+    :param stage: function to call
+    :return result, metrics: the stage's return value, and a dict with seconds and peak_mb
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = stage(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_mb': peak / 1024 ** 2}
+
+
+def benchmark_dataset(genome_file: str, vcf_file: str, chromosome: str) -> dict:
+    """
+    Time every stage of the pipeline on one chromosome and record each stage's output counts.
+
+    :param genome_file: path to the .fasta file containing the genome
+    :param vcf_file: path to the .vcf file with the DNA polymorphisms
+    :param chromosome: chromosome to analyze
+    :return stages: dict mapping each stage name to its metrics and output
+    """
+    stages = {}
+    motifs = [rad_hw.rest_dict['AanI']['site'], rad_hw.rest_dict['MroI']['site']]
+
+    dna, stages['read_fasta'] = measure(rad_hw.read_fasta, genome_file, chromosome)
+    stages['read_fasta']['output'] = {'length': len(dna)}
+
+    cut_sites, stages['find_motifs'] = measure(rad_hw.find_motifs_multi, dna, motifs)
+    stages['find_motifs']['output'] = {motif: int(sites.size) for motif, sites in cut_sites.items()}
+
+    srad_sites, stages['run_single_rad'] = measure(rad_hw.run_single_rad, dna, 'AanI')
+    stages['run_single_rad']['output'] = {'n_sites': len(srad_sites),
+                                          'first_site': list(srad_sites[0]) if srad_sites else None}
+
+    ddrad_sites, stages['run_ddrad'] = measure(rad_hw.run_ddrad, dna, 'AanI', 'MroI')
+    stages['run_ddrad']['output'] = {'n_sites': len(ddrad_sites),
+                                     'first_site': list(ddrad_sites[0]) if ddrad_sites else None}
+
+    if vcf_file:
+        variable_sites, stages['find_variable_sites'] = measure(rad_hw.find_variable_sites, vcf_file, srad_sites,
+                                                                chromosome)
+        stages['find_variable_sites']['output'] = {'n_var_sites': len(variable_sites)}
+    return stages
+
+
+def compare_to_baseline(name: str, stages: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare one dataset's results with its baseline entry. Outputs must match exactly; time and memory may grow by at
+    most the tolerance factor (plus a small absolute allowance so tiny stages are not flagged for timer noise).
+
+    :param name: dataset name, used in the messages
+    :param stages: results as returned by benchmark_dataset
+    :param baseline: the baseline entry for the same dataset
+    :param tolerance: allowed growth factor
+    :return problems: one message per regression found
+    """
+    problems = []
+    for stage, metrics in stages.items():
+        if stage not in baseline:
+            continue
+        expected = baseline[stage]
+        if metrics['output'] != expected['output']:
+            problems.append(f'{name} {stage}: output {metrics["output"]} differs from baseline {expected["output"]}')
+        if metrics['seconds'] > expected['seconds'] * tolerance + 0.05:
+            problems.append(f'{name} {stage}: {metrics["seconds"]:.3f}s vs baseline {expected["seconds"]:.3f}s')
+        if metrics['peak_mb'] > expected['peak_mb'] * tolerance + 1:
+            problems.append(f'{name} {stage}: {metrics["peak_mb"]:.1f} MB vs baseline {expected["peak_mb"]:.1f} MB')
+    return problems
+
+
+def check_known_outputs(stages: dict) -> list[str]:
+    """
+    Check the course genome's results against the expected outputs from the assignment.
+
+    :param stages: results of benchmark_dataset on chromosome NC_036780.1 of the course genome
+    :return problems: one message per mismatch
+    """
+    problems = []
+    for stage, expected in KNOWN_OUTPUTS.items():
+        if stages[stage]['output'] != expected:
+            problems.append(f'course genome {stage}: got {stages[stage]["output"]}, expected {expected}')
+    return problems
+
+
+def print_stages(name: str, stages: dict):
+    """Print a table of the measured stages of one dataset"""
+    print(name)
+    for stage, metrics in stages.items():
+        print(f'\t{stage:<20} {metrics["seconds"]:>9.3f}s {metrics["peak_mb"]:>10.1f} MB   {metrics["output"]}')
+
+
+if __name__ == '__main__':
+    args = my_parse_args()
+    results = {}
+    problems = []
+
+    for size in args.Sizes:
+        genome_file, vcf_file = synthetic_dataset(args.WorkDir, size, args.VariantDensity, args.Seed)
+        name = f'synthetic_{size}'
+        results[name] = benchmark_dataset(genome_file, vcf_file, SYNTHETIC_CHROMOSOME)
+        print_stages(name, results[name])
+
+    if args.GenomeFile:
+        # the VCF stage is skipped: its old expected count (2483) counted one site per variant, not per site
+        results['course_genome'] = benchmark_dataset(args.GenomeFile, None, 'NC_036780.1')
+        print_stages('course_genome', results['course_genome'])
+        problems += check_known_outputs(results['course_genome'])
+
+    if args.UpdateBaseline:
+        baseline = {}
+        if os.path.exists(args.Baseline):
+            with open(args.Baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+        with open(args.Baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+        print(f'baseline written to {args.Baseline}')
+    elif os.path.exists(args.Baseline):
+        with open(args.Baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        for name, stages in results.items():
+            if name in baseline:
+                problems += compare_to_baseline(name, stages, baseline[name], args.Tolerance)
+    else:
+        print(f'no baseline found at {args.Baseline}; run with -UpdateBaseline to record one')
+
+    if problems:
+        print('\nRegressions found:')
+        for problem in problems:
+            print(f'\t{problem}')
+        sys.exit(1)
+    print('\nBenchmark Complete')
@@ -4,6 +4,28 @@ import pdb # Debug
 import vcf # Read in vcf files
 from Bio.Restriction.Restriction_Dictionary import rest_dict # Library of restriction enzymes so users can enter enzyme names instead of motifs
 import re #for finding motifs
+import numpy as np # Vectorized motif scanning
+from concurrent.futures import ProcessPoolExecutor # Spread chromosomes across worker processes
+from typing import Iterator # Type hints for chunk generators
+import itertools # Enumerate candidate enzyme pairs
+import csv # Write screening reports
+import hashlib # Content hashes for the cut-site cache
+import json # Genome hash records of the cut-site cache
+import os # Look for VCF index files
+import time # Stage timings for the metrics file
+import contextlib # Stage context manager for the metrics file
+import cProfile # Optional per-stage profiles
+import gzip # Split compressed VCFs by chromosome
+import tempfile # Per-chromosome VCFs for WholeGenome mode
+from file_cache import file_sha256, write_atomic, cached_file_hash # Content hashes and atomic writes of the caches
+try:
+    import pysam # Lets PyVCF fetch regions from bgzip + tabix/CSI indexed VCFs; plain parsing is used without it
+except ImportError:
+    pysam = None
+try:
+    import resource # Peak memory of the process; not available on Windows
+except ImportError:
+    resource = None
 
 """
 Setup: Create a conda environment for this homework and install pyfaidx, vcf, and biopython. Confirm you can import 
@@ -31,10 +53,25 @@ def my_parse_args() -> argparse.Namespace:
     Set up your parser to take in the following positional arguments (in this order):
         GenomeFile: the path to the .fasta file containing the genome
         VCFFile: the path to the .vcf file with the DNA polymorphisms
-        Mode: whether to run SingleRad or ddRad
+        Mode: whether to run SingleRad, ddRad, or Screen (evaluate every ddRad pair from a list of enzymes)
         RE1: the name (not the motif) of the restriction enzyme
     As well as the following flagged argument:
         RE2: the name (not the motif) of the second restriction enzyme (only used in ddRad mode)
+    And these optional flags for choosing what part of the genome is analyzed:
+        Chromosome: the chromosome to analyze (defaults to NC_036780.1)
+        WholeGenome: analyze every chromosome in the genome file instead of a single one. A VCF without a
+        tabix/CSI index is first split by chromosome in one pass, so each worker only parses its own chromosome
+        Processes: number of worker processes used in WholeGenome mode (defaults to the number of CPUs)
+        ChunkSize: stream each chromosome in chunks of this many bases instead of reading it into memory at once
+    And these flags for Screen mode, where RE1 is the first candidate enzyme (or 'all' to screen every enzyme in rest_dict):
+        Enzymes: the other candidate enzymes to pair up
+        Output: path of a tab-separated report with one row per screened pair
+    And these flags for caching cut sites between runs:
+        CacheDir: directory of the on-disk cut-site cache (no caching if omitted)
+        CacheMaxMB: size bound of the cut-site cache in megabytes
+    And this flag for reusing parsed genotypes:
+        GenotypeStore: directory of a columnar genotype store, built from VCFFile on first use (and again whenever
+        VCFFile changes) and read instead of it
 
     :return parsed_args: the parsed command-line arguments
     """
@@ -47,17 +84,65 @@ def my_parse_args() -> argparse.Namespace:
     parser.add_argument('-RE2', type=str, help = 'name of the second restriction enzyme to use for ddRAD sequencing', required = False)
     parser.add_argument('GenomeFile', type = str, help = 'Genome file path')
     parser.add_argument('VCFFile', type = str, help = 'VCF file path')
-    parser.add_argument('Mode', type = str, help = 'enter SingleRad for single RAD sequecing, ddRad for double digest RAD sequencing', choices = ['SingleRad', 'ddRad'])
+    parser.add_argument('Mode', type = str, help = 'enter SingleRad for single RAD sequecing, ddRad for double digest RAD sequencing, Screen to evaluate every ddRad enzyme pair', choices = ['SingleRad', 'ddRad', 'Screen'])
+    parser.add_argument('-Chromosome', type = str, help = 'chromosome to analyze', default = 'NC_036780.1')
+    parser.add_argument('-WholeGenome', action = 'store_true', help = 'analyze every chromosome in the genome file in parallel; an unindexed VCF is first split by chromosome into the temporary directory')
+    parser.add_argument('-Processes', type = int, help = 'number of worker processes for WholeGenome mode', default = None)
+    parser.add_argument('-ChunkSize', type = int, help = 'stream chromosomes from the FASTA index in chunks of this many bases', default = None)
+    parser.add_argument('-Enzymes', type = str, nargs = '+', help = 'candidate enzymes to pair with RE1 in Screen mode', default = [])
+    parser.add_argument('-Output', type = str, help = 'tab-separated report file for Screen mode', default = None)
+    parser.add_argument('-CacheDir', type = str, help = 'directory for caching cut sites between runs', default = None)
+    parser.add_argument('-CacheMaxMB', type = int, help = 'size bound of the cut-site cache in megabytes', default = 2048)
+    parser.add_argument('-GenotypeStore', type = str, help = 'columnar genotype store directory, built from VCFFile if missing and rebuilt if VCFFile changed', default = None)
+    parser.add_argument('-Metrics', type = str, help = 'append per-stage timing, RSS change, process peak RSS and count records to this NDJSON file', default = None)
+    parser.add_argument('-ProfileDir', type = str, help = 'write a cProfile dump of every stage into this directory', default = None)
     parsed_args = parser.parse_args()
 
-    if parsed_args.Mode == 2:
+    if parsed_args.Mode == 'ddRad':
         if parsed_args.RE1 and not parsed_args.RE2:
             parser.error("Second restriction enzyme name for ddRAD sequencing is missing")
+    if parsed_args.Mode == 'Screen':
+        if parsed_args.RE1 != 'all' and not parsed_args.Enzymes:
+            parser.error("Screen mode needs at least two enzymes: pass -Enzymes, or 'all' as RE1")
+        if parsed_args.WholeGenome:
+            parser.error("Screen mode runs on a single chromosome; choose it with -Chromosome")
 
     return parsed_args
 
 
-def read_fasta(path_to_fasta: str, chromosome: str) -> str:
+DEFAULT_CHUNK_SIZE = 8_000_000 # Number of bases read at a time when streaming a chromosome
+
+
+class FastaStream:
+    """
+    A chromosome of an indexed FASTA file that is read lazily in fixed-size chunks through the pyfaidx index, instead
+    of being materialized as one str. The stream can be iterated any number of times, and find_motifs, run_single_rad
+    and run_ddrad accept it wherever they accept a DNA string, so peak memory stays at about one chunk.
+    """
+
+    def __init__(self, path_to_fasta: str, chromosome: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Open the indexed record; no sequence is read until chunks are requested"""
+        self.path_to_fasta = path_to_fasta
+        self.chromosome = chromosome
+        self.chunk_size = chunk_size
+        self.record = pyfaidx.Fasta(path_to_fasta)[chromosome]
+
+    def __len__(self) -> int:
+        return len(self.record)
+
+    def chunks(self, overlap: int = 0) -> Iterator[tuple[int, str]]:
+        """
+        Yield the chromosome as consecutive chunks. Chunk i owns the bases [i*chunk_size, (i+1)*chunk_size) but also
+        carries the next `overlap` bases, so a motif of length overlap + 1 that starts in the chunk is always seen whole.
+
+        :param overlap: number of bases each chunk extends into the next one
+        :return chunks: iterator of (offset of the chunk in the chromosome, chunk sequence) tuples
+        """
+        for start in range(0, len(self), self.chunk_size):
+            yield start, self.record[start:start + self.chunk_size + overlap].seq
+
+
+def read_fasta(path_to_fasta: str, chromosome: str, chunk_size: int = None) -> str | FastaStream:
     """
     Task 2:
     Implement a function to read the fasta file using pyfaidx. This function should return the dna sequence (as a str)
@@ -65,51 +150,347 @@ def read_fasta(path_to_fasta: str, chromosome: str) -> str:
 
     :param path_to_fasta: path to the fasta file, as a str
     :param chromosome: which chromosome to read. The default value of 'NC_036780.1' refers to the first chromosome
-    :return dna: the dna associated with the specified chromosome, as a str
+    :param chunk_size: if given, return a FastaStream reading the chromosome in chunks of this many bases instead
+    :return dna: the dna associated with the specified chromosome, as a str (or a FastaStream when chunk_size is set)
     """
 
+    if chunk_size:
+        return FastaStream(path_to_fasta, chromosome, chunk_size)
+
     genome = pyfaidx.Fasta(path_to_fasta)
     dna = genome[chromosome][:].seq
 
     return dna
 
-def find_motifs(dna: str, motif: str) -> list[int]:
+# Bit codes for the IUPAC nucleotide alphabet. Each concrete base owns one bit, so a degenerate code matches a base
+# whenever the two share a bit. Bases outside ACGT (N gaps, soft-masked lowercase) encode to 0 and never match.
+IUPAC_CODES = {'A': 0b0001, 'C': 0b0010, 'G': 0b0100, 'T': 0b1000, 'R': 0b0101, 'Y': 0b1010, 'S': 0b0110,
+               'W': 0b1001, 'K': 0b1100, 'M': 0b0011, 'B': 0b1110, 'D': 0b1101, 'H': 0b1011, 'V': 0b0111,
+               'N': 0b1111}
+COMPLEMENT = str.maketrans('ACGTRYSWKMBDHVN', 'TGCAYRSWMKVHDBN')
+SEED_LENGTH = 4 # Length of the k-mer used to seed candidate positions before the full motif is verified
+SEED_INDEX_MIN_PATTERNS = 8 # From this many patterns on, positions are bucketed by seed once instead of rescanned
+
+_BASE_BITS = np.zeros(256, dtype=np.uint8)
+_BASE_INDEX = np.zeros(256, dtype=np.uint8)
+for _index, _base in enumerate('ACGT'):
+    _BASE_BITS[ord(_base)] = IUPAC_CODES[_base]
+    _BASE_INDEX[ord(_base)] = _index
+
+
+def encode_dna(dna: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode a DNA sequence once for motif scanning. Returns the per-base IUPAC bit codes together with the 2-bit code
+    of the k-mer (SEED_LENGTH bases) starting at every position, which is what candidate sites are seeded from.
+
+    :param dna: DNA sequence to be encoded
+    :return bits, seeds: uint8 arrays of per-base bit codes and per-position seed k-mer codes
+    """
+    raw = np.frombuffer(dna.encode('ascii'), dtype=np.uint8)
+    bits = _BASE_BITS[raw]
+    two_bit = np.zeros(raw.size + SEED_LENGTH - 1, dtype=np.uint8)
+    two_bit[:raw.size] = _BASE_INDEX[raw]
+    seeds = np.zeros(raw.size, dtype=np.uint8)
+    for offset in range(SEED_LENGTH):
+        seeds <<= 2
+        seeds |= two_bit[offset:offset + raw.size]
+    return bits, seeds
+
+
+def motif_variants(motif: str, reverse_complement: bool = True) -> list[str]:
+    """
+    List the concrete patterns a restriction site stands for: alternative sites separated by '|' in rest_dict and,
+    optionally, their reverse complements. Palindromic sites collapse to a single pattern.
+
+    :param motif: restriction enzyme motif, possibly containing IUPAC codes
+    :param reverse_complement: whether to include the reverse complement of each site
+    :return variants: unique patterns to scan for
+    """
+    variants = motif.split('|')
+    if reverse_complement:
+        variants += [variant.translate(COMPLEMENT)[::-1] for variant in variants]
+    return list(dict.fromkeys(variants))
+
+
+def index_seeds(seeds: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bucket every position of the sequence by its seed k-mer code (a stable counting sort), so that the candidate
+    positions of any pattern can be gathered without another pass over the sequence.
+
+    :param seeds: per-position seed k-mer codes, as returned by encode_dna
+    :return order, offsets: positions sorted by seed code, and the start offset of each code's bucket in order
+    """
+    order = np.argsort(seeds, kind='stable')
+    offsets = np.zeros(4 ** SEED_LENGTH + 1, dtype=np.int64)
+    np.cumsum(np.bincount(seeds, minlength=4 ** SEED_LENGTH), out=offsets[1:])
+    return order, offsets
+
+
+def _match_pattern(bits: np.ndarray, seeds: np.ndarray, pattern: str,
+                   seed_index: tuple[np.ndarray, np.ndarray] = None) -> np.ndarray:
+    """
+    Find every start position of a single IUPAC pattern. Candidates are seeded from the least degenerate SEED_LENGTH
+    window of the pattern, either by comparing the pre-computed seed codes or by gathering the matching buckets of a
+    seed index, and are then verified column by column.
+    """
+    try:
+        codes = np.array([IUPAC_CODES[base] for base in pattern], dtype=np.uint8)
+    except KeyError as err:
+        raise ValueError(f'motif {pattern} contains a non-IUPAC character {err}') from None
+    n_starts = bits.size - codes.size + 1
+    if n_starts <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    # pad short patterns with N so every pattern has a full seed window, then pick the least degenerate window
+    padded = np.concatenate([codes, np.full(max(0, SEED_LENGTH - codes.size), 0b1111, dtype=np.uint8)])
+    popcounts = np.unpackbits(padded[:, None], axis=1).sum(axis=1)
+    offsets = range(max(1, codes.size - SEED_LENGTH + 1))
+    seed_offset = min(offsets, key=lambda o: np.prod(popcounts[o:o + SEED_LENGTH]))
+
+    kmers = np.arange(4 ** SEED_LENGTH)
+    table = np.ones(kmers.size, dtype=bool)
+    for col in range(SEED_LENGTH):
+        base_bit = 1 << ((kmers >> (2 * (SEED_LENGTH - 1 - col))) & 3)
+        table &= (padded[seed_offset + col] & base_bit) != 0
+    allowed = np.flatnonzero(table)
+
+    if seed_index is not None:
+        order, bucket_offsets = seed_index
+        candidates = np.sort(np.concatenate([order[bucket_offsets[kmer]:bucket_offsets[kmer + 1]]
+                                             for kmer in allowed.tolist()])) - seed_offset
+        candidates = candidates[(candidates >= 0) & (candidates < n_starts)]
+    else:
+        window = seeds[seed_offset:seed_offset + n_starts]
+        if allowed.size <= 4:
+            mask = window == allowed[0]
+            for kmer in allowed[1:]:
+                mask |= window == kmer
+        else:
+            mask = table[window]
+        candidates = np.flatnonzero(mask)
+
+    for col, code in enumerate(codes):
+        candidates = candidates[(bits[candidates + col] & code) != 0]
+    return candidates
+
+
+def _drop_overlapping(positions: np.ndarray, motif_length: int) -> np.ndarray:
+    """
+    Keep hits greedily from the left so that no two reported sites overlap, as str.find scanning would. A hit at least
+    motif_length past its predecessor is always kept, so only runs of overlapping hits need the sequential pass.
+    """
+    overlapping = np.flatnonzero(np.diff(positions) < motif_length) + 1
+    if not overlapping.size:
+        return positions
+    keep = np.ones(positions.size, dtype=bool)
+    last_kept = -motif_length
+    previous = -1
+    for idx in overlapping.tolist():
+        if previous != idx - 1:
+            last_kept = positions[idx - 1]
+        if positions[idx] - last_kept >= motif_length:
+            last_kept = positions[idx]
+        else:
+            keep[idx] = False
+        previous = idx
+    return positions[keep]
+
+
+def _scan_motifs(dna: str, motifs: list[str], reverse_complement: bool) -> dict[str, np.ndarray]:
+    """Return every (possibly overlapping) start position of each motif in a single in-memory sequence"""
+    bits, seeds = encode_dna(dna)
+    n_patterns = sum(len(motif_variants(motif, reverse_complement)) for motif in motifs)
+    seed_index = index_seeds(seeds) if n_patterns >= SEED_INDEX_MIN_PATTERNS else None
+    hits = {}
+    for motif in motifs:
+        motif_hits = np.sort(np.concatenate([_match_pattern(bits, seeds, variant, seed_index)
+                                             for variant in motif_variants(motif, reverse_complement)]))
+        hits[motif] = motif_hits[np.diff(motif_hits, prepend=-1) != 0] # a palindrome can hit on both strands at once
+    return hits
+
+
+def find_motifs_multi(dna: str | FastaStream, motifs: list[str],
+                      reverse_complement: bool = True) -> dict[str, np.ndarray]:
+    """
+    Find the cut sites of many motifs in one go. The sequence is encoded a single time and every motif is matched
+    against that shared encoding; for larger motif sets the positions are also bucketed by seed k-mer once, so each
+    further motif costs only its own candidates rather than another pass over the sequence. IUPAC degenerate sites are
+    supported, as are reverse-complement sites of non-palindromic motifs. A FastaStream is scanned chunk by chunk,
+    with chunks overlapping by the longest motif length minus one so no site is lost at a chunk boundary.
+
+    :param dna: DNA sequence to be analyzed, as a str or a FastaStream
+    :param motifs: restriction enzyme motifs
+    :param reverse_complement: whether to also report sites found on the reverse strand
+    :return positions: dict mapping each motif to a sorted int64 array of non-overlapping motif positions
+    """
+    motifs = list(dict.fromkeys(motifs))
+    motif_lengths = {motif: max(len(variant) for variant in motif.split('|')) for motif in motifs}
+
+    if isinstance(dna, FastaStream):
+        overlap = max(motif_lengths.values(), default=1) - 1
+        chunk_hits = {motif: [] for motif in motifs}
+        for offset, chunk in dna.chunks(overlap):
+            for motif, hits in _scan_motifs(chunk, motifs, reverse_complement).items():
+                # hits starting in the overlap belong to the next chunk, which sees them in full
+                chunk_hits[motif].append(hits[hits < dna.chunk_size] + offset)
+        hits = {motif: np.concatenate(chunk_hits[motif]) if chunk_hits[motif] else np.empty(0, dtype=np.int64)
+                for motif in motifs}
+    else:
+        hits = _scan_motifs(dna, motifs, reverse_complement)
+
+    return {motif: _drop_overlapping(hits[motif], motif_lengths[motif]) for motif in motifs}
+
+
+def find_enzyme_sites(dna: str | FastaStream, enzymes: list[str] = None) -> dict[str, np.ndarray]:
+    """
+    Find the cut sites for a set of enzymes (all of rest_dict by default) with a single call to find_motifs_multi.
+    Enzymes that share a recognition site share the same scan.
+
+    :param dna: DNA sequence to be analyzed, as a str or a FastaStream
+    :param enzymes: restriction enzyme names; defaults to every enzyme in rest_dict
+    :return positions: dict mapping each enzyme name to a sorted int64 array of its motif positions
+    """
+    if enzymes is None:
+        enzymes = list(rest_dict)
+    for enzyme in enzymes:
+        assert enzyme in rest_dict, f'no restriction enzyme named {enzyme} found in rest_dict'
+    motif_positions = find_motifs_multi(dna, [rest_dict[enzyme]["site"] for enzyme in enzymes])
+    return {enzyme: motif_positions[rest_dict[enzyme]["site"]] for enzyme in enzymes}
+
+
+def find_motifs(dna: str | FastaStream, motif: str) -> list[int]:
     """
     Task 3:
     Implement the find_motifs function to take DNA sequence (string, as returned by your read_fasta function)
     and a Restriction Enzyme motif (string) and will return a list of locations (integers) where the motif is found
 
-    :param dna: DNA sequence to be analyzed
+    :param dna: DNA sequence to be analyzed, as a str or a FastaStream
     :param motif: restriction enzyme motif
     :return positions: list of ints of the motif positions
     """
-    positions = []
-    
-    #option 1 - using find to search for motif 
-    loc = 0
-    while loc < len(dna):
-        loc = dna.find(motif, loc) 
-        if not loc == -1:
-            positions.append(loc)
-            loc += len(motif)
-        else:
-            break
+    #option 1 - using find to search for motif (kept for reference, superseded by the vectorized scanner below)
+    # positions = []
+    # loc = 0
+    # while loc < len(dna):
+    #     loc = dna.find(motif, loc)
+    #     if not loc == -1:
+    #         positions.append(loc)
+    #         loc += len(motif)
+    #     else:
+    #         break
 
     ##option 2 - using regex to substitute other symbols in motif other than ACGT
     # motif_pattern = motif.replace('N', '[ACGT]').replace('R', '[AG]').replace('Y', '[CT]').replace('W', '[AT]').replace('S', '[CG]').replace('M', '[AC]').replace('K', '[GT]').replace('B', '[CGT]').replace('D', '[AGT]').replace('H', '[ACT]').replace('V', '[ACG]')
     # positions = [match.start() for match in re.finditer(motif_pattern, dna)]
 
+    #option 3 - vectorized IUPAC-aware scan covering both strands
+    positions = find_motifs_multi(dna, [motif])[motif].tolist()
+
     return positions
 
-def run_single_rad(dna: str, re1: str) -> list[tuple[int, int]]:
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3 # Size bound of the cut-site cache when none is given
+
+
+class CutSiteCache:
+    """
+    On-disk cache of cut-site arrays, so repeated runs and parameter sweeps skip the motif scan. Each entry is a .npy
+    file keyed by a content hash of the genome file, the chromosome and the motif, and is memory-mapped when read.
+    Editing the genome changes its hash, so stale entries are never read again; they age out through the
+    least-recently-used eviction that keeps the cache below max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_BYTES):
+        """Create the cache directory if needed"""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def genome_hash(self, genome_file: str) -> str:
+        """
+        Hash the contents of a genome file, remembered in the cache directory so the file is only read again after it
+        changes (see cached_file_hash).
+
+        :param genome_file: path to the .fasta file containing the genome
+        :return digest: hex SHA-256 digest of the file contents
+        """
+        return cached_file_hash(genome_file, os.path.join(self.cache_dir, 'genome_hashes.json'))
+
+    def entry_path(self, genome_hash: str, chromosome: str, motif: str, reverse_complement: bool = True) -> str:
+        """Path of the .npy entry for one genome, chromosome and motif"""
+        key = hashlib.sha1(f'{chromosome}\t{motif}\t{reverse_complement}'.encode()).hexdigest()
+        return os.path.join(self.cache_dir, genome_hash, f'{key}.npy')
+
+    def find_motifs(self, dna: str | FastaStream, motifs: list[str], genome_file: str, chromosome: str,
+                    reverse_complement: bool = True) -> dict[str, np.ndarray]:
+        """
+        Look up the cut sites of each motif, scanning the sequence (with find_motifs_multi) only for motifs that are
+        not cached yet and storing their results. Pass a FastaStream as dna to avoid reading the sequence at all when
+        every motif is cached.
+
+        :param dna: DNA sequence of the chromosome, as a str or a FastaStream
+        :param motifs: restriction enzyme motifs
+        :param genome_file: path to the .fasta file the sequence was read from
+        :param chromosome: chromosome the sequence belongs to
+        :param reverse_complement: whether sites on the reverse strand are included
+        :return positions: dict mapping each motif to a sorted int64 array of motif positions (memory-mapped if cached)
+        """
+        genome_hash = self.genome_hash(genome_file)
+        os.makedirs(os.path.join(self.cache_dir, genome_hash), exist_ok=True)
+        positions = {}
+        missing = []
+        for motif in dict.fromkeys(motifs):
+            path = self.entry_path(genome_hash, chromosome, motif, reverse_complement)
+            try:
+                os.utime(path) # mark as recently used for eviction
+                positions[motif] = np.load(path, mmap_mode='r')
+            except FileNotFoundError: # not cached yet, or evicted by another worker in the meantime
+                missing.append(motif)
+
+        if missing:
+            scanned = find_motifs_multi(dna, missing, reverse_complement)
+            for motif, hits in scanned.items():
+                path = self.entry_path(genome_hash, chromosome, motif, reverse_complement)
+                write_atomic(path, lambda handle: np.save(handle, hits), mode='wb')
+            positions.update(scanned)
+            self.evict()
+        return positions
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes. Workers sharing the cache evict
+        concurrently, so an entry that another worker has already deleted is simply skipped.
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass # removed by another worker, which freed the space all the same
+            total -= size
+
+
+def run_single_rad(dna: str | FastaStream, re1: str, cut_sites: dict[str, np.ndarray] = None) -> list[tuple[int, int]]:
     """
     Task 4:
     implement a function for performing SingleRad. This function takes in the dna (str) and the name of the restriction
     enzyme (str), and returns a list of tuples where each tuple contains the start index (int) and stop index (int) of a
     site sequenced by SingleRad
 
-    :param dna: DNA sequence to be analyzed
+    :param dna: DNA sequence to be analyzed, as a str or a FastaStream
     :param re1: restriction enzyme name
+    :param cut_sites: optional pre-computed cut sites keyed by motif (e.g. from CutSiteCache); the sequence is only
+    scanned when the enzyme's motif is missing from it
     :return sequenced_sites: a list of tuples, where tuple contains the start and stop index of a sequenced site
     """
 
@@ -121,69 +502,132 @@ def run_single_rad(dna: str, re1: str) -> list[tuple[int, int]]:
     #TODO: use the rest_dict to look up the motif associated with the enzyme
     motif = rest_dict[re1]["site"]
     #TODO: use the find_motifs function to find the cut sites
-    loc_list = find_motifs(dna, motif)
+    if cut_sites is not None and motif in cut_sites:
+        loc_list = cut_sites[motif].tolist()
+    else:
+        loc_list = find_motifs(dna, motif)
     #TODO: use list comprehension (preferably) or a loop (acceptable) to create the desired list of sequence sites
     sequenced_sites = [(loc - seq_length, loc + seq_length) for loc in loc_list] #range of sequence extracted
 
     return sequenced_sites
 
 
-def run_ddrad(dna: str, re1: str, re2: str) -> list[tuple[int, int]]:
+def flank_re2_sites(re1_sites: np.ndarray, re2_sites: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    For every RE1 site, locate the nearest RE2 site on each side using binary search over the two sorted cut-site
+    arrays. A side only counts as a candidate ddRad fragment when that RE2 site exists and no other RE1 site lies
+    between it and the current RE1 site.
+
+    :param re1_sites: sorted positions of the first enzyme's cut sites
+    :param re2_sites: sorted positions of the second enzyme's cut sites
+    :return left_re2, left_ok, right_re2, right_ok: nearest RE2 position on each side of every RE1 site (undefined
+    where the matching ok flag is False) and whether that side forms an RE1/RE2 fragment
+    """
+    re1_sites = np.asarray(re1_sites, dtype=np.int64)
+    re2_sites = np.asarray(re2_sites, dtype=np.int64)
+    n_re1 = re1_sites.size
+    n_re2 = re2_sites.size
+    if not n_re2:
+        empty = np.zeros(n_re1, dtype=np.int64)
+        return empty, empty.astype(bool), empty, empty.astype(bool)
+
+    # looking left: the last RE2 site before r1 must come after the last RE1 site before r1
+    left_idx = np.searchsorted(re2_sites, re1_sites, side='left') - 1
+    left_re2 = re2_sites[np.maximum(left_idx, 0)]
+    prev_re1_idx = np.searchsorted(re1_sites, re1_sites, side='left') - 1
+    prev_re1 = np.where(prev_re1_idx >= 0, re1_sites[np.maximum(prev_re1_idx, 0)], -1)
+    left_ok = (left_idx >= 0) & (left_re2 > prev_re1)
+
+    # looking right: the first RE2 site after r1 must come before the first RE1 site after r1
+    right_idx = np.searchsorted(re2_sites, re1_sites, side='right')
+    right_re2 = re2_sites[np.minimum(right_idx, n_re2 - 1)]
+    next_re1_idx = np.searchsorted(re1_sites, re1_sites, side='right')
+    next_re1 = np.where(next_re1_idx < n_re1, re1_sites[np.minimum(next_re1_idx, n_re1 - 1)], np.iinfo(np.int64).max)
+    right_ok = (right_idx < n_re2) & (right_re2 < next_re1)
+
+    return left_re2, left_ok, right_re2, right_ok
+
+
+def ddrad_read_starts(re1_sites: list[int], re2_sites: list[int], min_size: int = 300, max_size: int = 700,
+                      seq_length: int = 100) -> np.ndarray:
+    """
+    Pair RE1 and RE2 cut sites into size-selected ddRad fragments in O(n log n) and return the start of every read
+    sequenced from them. Reads are ordered as in the original per-site loop: for every RE1 site, the fragment to its
+    left (RE2 read, then RE1 read) followed by the fragment to its right (RE1 read, then RE2 read).
+
+    :param re1_sites: sorted positions of the first enzyme's cut sites
+    :param re2_sites: sorted positions of the second enzyme's cut sites
+    :param min_size: shortest fragment kept by size selection (exclusive)
+    :param max_size: longest fragment kept by size selection (exclusive)
+    :param seq_length: length of the sequencing reads
+    :return starts: int64 array of read start positions; each read covers [start, start + seq_length)
+    """
+    re1_sites = np.asarray(re1_sites, dtype=np.int64)
+    left_re2, left_ok, right_re2, right_ok = flank_re2_sites(re1_sites, re2_sites)
+    left_ok &= (min_size < re1_sites - left_re2) & (re1_sites - left_re2 < max_size)
+    right_ok &= (min_size < right_re2 - re1_sites) & (right_re2 - re1_sites < max_size)
+
+    # one row per RE1 site with the four candidate reads in output order, then keep the rows' selected reads
+    starts = np.stack([left_re2, re1_sites - seq_length, re1_sites, right_re2 - seq_length], axis=1)
+    keep = np.stack([left_ok, left_ok, right_ok, right_ok], axis=1)
+    return starts[keep]
+
+
+def pair_ddrad_fragments(re1_sites: list[int], re2_sites: list[int], min_size: int = 300, max_size: int = 700,
+                         seq_length: int = 100) -> list[tuple[int, int]]:
+    """
+    Pair RE1 and RE2 cut sites into size-selected ddRad fragments and return the two reads sequenced from each
+    fragment, in the order described in ddrad_read_starts.
+
+    :param re1_sites: sorted positions of the first enzyme's cut sites
+    :param re2_sites: sorted positions of the second enzyme's cut sites
+    :param min_size: shortest fragment kept by size selection (exclusive)
+    :param max_size: longest fragment kept by size selection (exclusive)
+    :param seq_length: length of the sequencing reads
+    :return sequenced_sites: a list of tuples, where tuple contains the start and stop index of a sequenced site
+    """
+    starts = ddrad_read_starts(re1_sites, re2_sites, min_size, max_size, seq_length)
+    return list(zip(starts.tolist(), (starts + seq_length).tolist()))
+
+
+def run_ddrad(dna: str | FastaStream, re1: str, re2: str, min_size: int = 300, max_size: int = 700,
+              seq_length: int = 100, cut_sites: dict[str, np.ndarray] = None) -> list[tuple[int, int]]:
     """
     Task 5:
     implement a function for performing ddRad. This function takes in the dna (str) and the names of the restriction
     enzymes (str and str), and returns a list of tuples where each tuple contains the start index (int) and stop index
     (int) of a site sequenced by ddRad
-    :param dna: DNA sequence to be analyzed
+    :param dna: DNA sequence to be analyzed, as a str or a FastaStream
     :param re1: first restriction enzyme name
     :param re2: second restriction enzyme name
+    :param min_size: shortest distance for the DNA piece
+    :param max_size: longest distance for the DNA piece
+    :param seq_length: how long the sequencing reads are
+    :param cut_sites: optional pre-computed cut sites keyed by motif (e.g. from CutSiteCache); the sequence is only
+    scanned for motifs missing from it
     :return sequenced_sites: a list of tuples, where tuple contains the start and stop index of a sequenced site
     """
-    min_size = 300 # This variable stores the shortest distance for the DNA piece
-    max_size = 700 # This variable stores the longest distance for the DNA piece
-    seq_length = 100 # This variable stores how long the sequencing reads are
-
     #TODO: Use an assert statement to verify that RE1 and RE2 are both in the rest_dict provided by biopython
-    assert re1 in rest_dict[re1]["site"]
-    assert re2 in rest_dict[re2]["site"]
+    assert re1 in rest_dict
+    assert re2 in rest_dict
 
     #TODO: use the rest_dict to look up the motifs associated with the two enzyme
     motif1 = rest_dict[re1]["site"]
     motif2 = rest_dict[re2]["site"]
 
     #TODO: use your find_motifs function to find the sequencing sites for RE1 and RE2
-    re1_sites = find_motifs(dna, motif1)
-    re2_sites = find_motifs(dna, motif2)
-
-    #TODO: Complete the below loop, which is currently incomplete but has hints as comments
-    sequenced_sites = []
-    for r1 in re1_sites: # Loop through each RE1 site
-        # TODO: Look left of the current site
-        left_hits_r1 = [pos for pos in re1_sites if pos < r1]
-        left_hits_r2 = [pos for pos in re2_sites if pos < r1]
-
-        #TODO: create a series of nested if statements that check:
-        # 1) that left_hits_r2 is not empty
-        # 2) that re2 site is between min and max size
-        # 3) that re2 site is closer re1 site
-        if left_hits_r2:
-            if min_size < r1 - left_hits_r2[-1] < max_size:
-                if left_hits_r2[-1] > left_hits_r1[-1]:
-                # TODO: if all statements pass, add the two resulting sequence sites to the sequenced_sites list
-                    sequenced_sites.append((left_hits_r2[-1], left_hits_r2[-1] + seq_length))
-                    sequenced_sites.append((r1 - seq_length, r1))
-
-        # TODO: Now do the same thing but looking right
-        right_hits_r1 = [pos for pos in re1_sites if pos > r1]
-        right_hits_r2 = [pos for pos in re2_sites if pos > r1]
-
-        if right_hits_r2:
-            if min_size < right_hits_r2[0] - r1 < max_size:
-                if right_hits_r1[0] > right_hits_r2[0]:
-                # TODO: if all statements pass, add the two resulting sequence sites to the sequenced_sites list
-                    sequenced_sites.append((r1, r1 + seq_length))
-                    sequenced_sites.append((right_hits_r2[0] - seq_length, right_hits_r2[0]))
-    
+    # both motifs are scanned against a single encoding of the sequence, unless their sites were passed in
+    cut_sites = dict(cut_sites or {})
+    missing = [motif for motif in (motif1, motif2) if motif not in cut_sites]
+    if missing:
+        cut_sites.update(find_motifs_multi(dna, missing))
+    re1_sites = cut_sites[motif1]
+    re2_sites = cut_sites[motif2]
+
+    # The per-site loop that rebuilt the left/right hit lists for every RE1 site was O(n^2) in the number of cut
+    # sites; the same left/right checks are now answered by binary search over the two sorted site arrays
+    sequenced_sites = pair_ddrad_fragments(re1_sites, re2_sites, min_size, max_size, seq_length)
+
     ##Method - 2 - combining the locations obtained by both the REs
     # sequenced_sites = []
     # rs_pos = sorted([str(ele) + 'a' for ele in re1_sites] + [str(ele) + 'b' for ele in re2_sites], key = lambda ele:int(ele[:-1]))
@@ -197,38 +641,689 @@ def run_ddrad(dna: str, re1: str, re2: str) -> list[tuple[int, int]]:
 
     return sequenced_sites
 
-def find_variable_sites(vcf_file_path: str, sequenced_sites: list[tuple[int, int]]):
+class IntervalIndex:
+    """
+    Index over a list of (start, stop) intervals, such as the sequenced sites returned by run_single_rad or run_ddrad.
+    Intervals are kept as start-sorted arrays so that point and batch containment queries run in logarithmic time.
+    Containment is strict (start < pos < stop), matching the check used in find_variable_sites.
     """
-    Task 6:
-    Implement this function to take in a path to a VCF file and a list of sequenced sites (as returned by run_single_rad
-    or run_ddrad) and return a list of sites that are both sequenced and contain variation.
 
-    :param vcf_file_path: path to the VCF file
-    :param sequenced_sites: list of sequenced sites, as returned by run_single_rad or run_ddrad
-    :return sequenced_sites_variable: a list of sequenced sites that contain variation. This list is a subset of the
-    sequenced_sites list you input to the function
+    def __init__(self, intervals: list[tuple[int, int]]):
+        """Sort the intervals by start and remember the longest one, which bounds how far back a query must look"""
+        intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        self.order = np.argsort(intervals[:, 0], kind='stable')
+        self.starts = intervals[self.order, 0]
+        self.stops = intervals[self.order, 1]
+        self.max_length = int((self.stops - self.starts).max()) if len(intervals) else 0
+
+    def __len__(self) -> int:
+        return self.starts.size
+
+    def query(self, pos: int) -> np.ndarray:
+        """
+        Find the intervals that contain a single position.
+
+        :param pos: position to look up
+        :return hits: sorted indices (into the original interval list) of the intervals containing pos
+        """
+        # any containing interval starts in (pos - max_length, pos), so only that slice needs checking
+        lo = np.searchsorted(self.starts, pos - self.max_length, side='right')
+        hi = np.searchsorted(self.starts, pos, side='left')
+        candidates = np.arange(lo, hi)
+        return np.sort(self.order[candidates[self.stops[candidates] > pos]])
+
+    def query_batch(self, positions: list[int]) -> np.ndarray:
+        """
+        Find the intervals that contain at least one of many positions. Each interval is reported once, however many
+        of the positions fall inside it.
+
+        :param positions: positions to look up, in any order
+        :return hits: sorted indices (into the original interval list) of the intervals containing any position
+        """
+        positions = np.sort(np.asarray(positions, dtype=np.int64))
+        n_inside = (np.searchsorted(positions, self.stops, side='left')
+                    - np.searchsorted(positions, self.starts, side='right'))
+        return np.sort(self.order[n_inside > 0])
+
+
+VCF_MERGE_GAP = 1000 # Sequenced sites closer than this many bases are fetched from an indexed VCF in one region
+
+
+def merge_intervals(intervals: list[tuple[int, int]], max_gap: int = 0) -> list[tuple[int, int]]:
+    """
+    Merge overlapping intervals, and intervals separated by at most max_gap bases, into sorted disjoint regions.
+
+    :param intervals: list of (start, stop) tuples in any order
+    :param max_gap: largest gap between two intervals that still merges them into one region
+    :return regions: sorted list of merged (start, stop) tuples
+    """
+    intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+    if not len(intervals):
+        return []
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    reach = np.maximum.accumulate(intervals[:, 1])
+    # a new region begins wherever an interval starts beyond the reach of everything before it
+    region_starts = np.flatnonzero(np.concatenate([[True], intervals[1:, 0] > reach[:-1] + max_gap]))
+    region_stops = np.maximum.reduceat(intervals[:, 1], region_starts)
+    return list(zip(intervals[region_starts, 0].tolist(), region_stops.tolist()))
+
+
+def find_vcf_index(vcf_file_path: str) -> str | None:
+    """Return the tabix (.tbi) or CSI (.csi) index of a bgzip-compressed VCF, or None if it has no usable index"""
+    if pysam is None or not vcf_file_path.endswith('.gz'):
+        return None
+    for suffix in ('.tbi', '.csi'):
+        if os.path.exists(vcf_file_path + suffix):
+            return vcf_file_path + suffix
+    return None
+
+
+def iter_vcf_records(vcf_file_path: str, chromosome: str,
+                     sequenced_sites: list[tuple[int, int]] = None) -> Iterator[vcf.model._Record]:
+    """
+    Iterate over the VCF records of one chromosome. For a bgzip + tabix/CSI indexed VCF only the regions covered by
+    sequenced_sites are fetched, with nearby sites merged into larger fetches; otherwise the file is parsed in full
+    and records from other chromosomes are skipped. Records are not guaranteed to be unique across fetched regions.
+
+    :param vcf_file_path: path to the VCF file (plain, or .gz with a .tbi/.csi index for region access)
+    :param chromosome: chromosome whose records are wanted
+    :param sequenced_sites: if given, only records inside these sites are needed
+    :return records: iterator of PyVCF records
     """
+    index_path = find_vcf_index(vcf_file_path)
+
+    if sequenced_sites is not None and index_path:
+        # PyVCF's own fetch only finds .tbi indexes, so pysam fetches the lines of the regions through whichever index
+        # exists, and a PyVCF reader parses the header followed by those lines
+        with pysam.TabixFile(vcf_file_path, index=index_path) as tabix_file:
+            if chromosome not in tabix_file.contigs:
+                return # no records on this chromosome (e.g. chrM or an unplaced scaffold), as in the plain-text path
+            regions = merge_intervals(sequenced_sites, max_gap=VCF_MERGE_GAP)
+            # fetch takes 0-based half-open coordinates, so this covers every 1-based POS strictly inside the region
+            lines = itertools.chain(tabix_file.header, itertools.chain.from_iterable(
+                tabix_file.fetch(chromosome, max(start, 0), stop) for start, stop in regions))
+            yield from vcf.Reader(fsock=lines, compressed=False)
+        return
+
+    vcf_obj = vcf.Reader(filename=vcf_file_path)
+    in_chromosome = False
+    for record in vcf_obj:
+        if record.CHROM != chromosome: # Only look at records from the requested chromosome; the VCF is sorted, so stop
+            if in_chromosome:          # once its block of records has been passed
+                break
+            continue
+        in_chromosome = True
+        yield record
+
+
+class GenotypeStore:
+    """
+    Columnar copy of a VCF's positions and genotypes, converted once and then read as memory-mapped NumPy arrays, so
+    comparing variants against different enzyme designs never reparses the text VCF. Genotypes are stored as int8
+    codes per variant and sample: HOM_REF for 0/0, HOM_ALT for 1/1, MISSING for uncalled and OTHER for anything else.
+    The store records the size, modification time and SHA-256 of the VCF it was built from, and refuses to open once
+    that VCF has changed, so a regenerated VCF is never answered from stale genotypes.
+    """
+    MISSING, HOM_REF, OTHER, HOM_ALT = -1, 0, 1, 2
+
+    def __init__(self, store_dir: str):
+        """Open an existing store built by GenotypeStore.build, checking that its source VCF has not changed"""
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        # a store whose source is gone (e.g. copied to another machine) cannot be checked and is trusted
+        if os.path.exists(meta['source']) and not self.is_current(store_dir, meta['source']):
+            raise ValueError(f'genotype store {store_dir} is out of date: {meta["source"]} changed since it was '
+                             f'built; rebuild it with GenotypeStore.build')
+        self.chromosomes = meta['chromosomes']
+        self.samples = meta['samples']
+        self.chrom = np.load(os.path.join(store_dir, 'chrom.npy'), mmap_mode='r')
+        self.pos = np.load(os.path.join(store_dir, 'pos.npy'), mmap_mode='r')
+        self.gt = np.load(os.path.join(store_dir, 'gt.npy'), mmap_mode='r')
 
-    #TODO: read in the VCF file using the VCFReader class
-    vcf_obj = vcf.Reader(open(vcf_file_path, 'r'))
+    @staticmethod
+    def is_store(path: str) -> bool:
+        """Check whether a path is a genotype store directory"""
+        return os.path.isfile(os.path.join(path, 'meta.json'))
 
-    #TODO: complete the below loop
-    sequenced_sites_variable = [] # This list will keep track of all of the sequenced DNA pieces that also contain variation
+    @staticmethod
+    def is_current(store_dir: str, vcf_file_path: str) -> bool:
+        """
+        Check whether a store was built from the current contents of a VCF. A VCF with the recorded size and
+        modification time is taken as unchanged; one with the recorded size but a new modification time is hashed,
+        and if its contents are unchanged the new modification time is recorded so it is not hashed again.
+
+        :param store_dir: genotype store directory
+        :param vcf_file_path: path to the VCF the store should hold
+        :return current: False if the VCF differs from the store's source, or the store predates source checks
+        """
+        meta_path = os.path.join(store_dir, 'meta.json')
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if 'source_sha256' not in meta:
+            return False
+        stat = os.stat(vcf_file_path)
+        if stat.st_size != meta['source_size']:
+            return False
+        if stat.st_mtime_ns == meta['source_mtime_ns']:
+            return True
+        if file_sha256(vcf_file_path) != meta['source_sha256']:
+            return False
+        meta['source_mtime_ns'] = stat.st_mtime_ns
+        write_atomic(meta_path, lambda handle: json.dump(meta, handle))
+        return True
+
+    @classmethod
+    def build(cls, vcf_file_path: str, store_dir: str) -> 'GenotypeStore':
+        """
+        Convert a VCF into a genotype store. This is the only step that parses the text VCF.
+
+        :param vcf_file_path: path to the VCF file (plain or .gz)
+        :param store_dir: directory to write the store to
+        :return store: the newly built store
+        """
+        stat = os.stat(vcf_file_path)
+        source = {'source': os.path.abspath(vcf_file_path), 'source_size': stat.st_size,
+                  'source_mtime_ns': stat.st_mtime_ns, 'source_sha256': file_sha256(vcf_file_path)}
+        vcf_obj = vcf.Reader(filename=vcf_file_path)
+        codes = {'0/0': cls.HOM_REF, '1/1': cls.HOM_ALT}
+        chromosomes = {}
+        chrom, pos, gt = [], [], []
+        for record in vcf_obj:
+            chrom.append(chromosomes.setdefault(record.CHROM, len(chromosomes)))
+            pos.append(record.POS)
+            gt.append([codes.get(call.gt_nums, cls.OTHER) if call.called else cls.MISSING for call in record.samples])
+
+        os.makedirs(store_dir, exist_ok=True)
+        if cls.is_store(store_dir): # rebuilding: the old store is incomplete until the new meta.json is written
+            os.remove(os.path.join(store_dir, 'meta.json'))
+        np.save(os.path.join(store_dir, 'chrom.npy'), np.array(chrom, dtype=np.int32))
+        np.save(os.path.join(store_dir, 'pos.npy'), np.array(pos, dtype=np.int64))
+        np.save(os.path.join(store_dir, 'gt.npy'), np.array(gt, dtype=np.int8).reshape(len(pos), len(vcf_obj.samples)))
+        # meta.json goes last: its presence marks the store as complete
+        meta = {**source, 'chromosomes': list(chromosomes), 'samples': vcf_obj.samples}
+        write_atomic(os.path.join(store_dir, 'meta.json'), lambda handle: json.dump(meta, handle))
+        return cls(store_dir)
+
+    def fixed_differences(self, chromosome: str, sample1: int = 0, sample2: int = 1) -> np.ndarray:
+        """
+        Find the variants on one chromosome where both samples are called and one is homozygous reference while the
+        other is homozygous alternate, as a single vectorized mask over the whole chromosome.
+
+        :param chromosome: chromosome whose variants are wanted
+        :param sample1: column of the first sample
+        :param sample2: column of the second sample
+        :return positions: int64 array of the 1-based positions of the passing variants
+        """
+        if chromosome not in self.chromosomes:
+            return np.empty(0, dtype=np.int64)
+        in_chrom = self.chrom == self.chromosomes.index(chromosome)
+        gt1 = self.gt[in_chrom, sample1]
+        gt2 = self.gt[in_chrom, sample2]
+        fixed = (((gt1 == self.HOM_REF) & (gt2 == self.HOM_ALT))
+                 | ((gt1 == self.HOM_ALT) & (gt2 == self.HOM_REF)))
+        return np.asarray(self.pos[in_chrom][fixed], dtype=np.int64)
+
+
+def load_variable_positions(vcf_file_path: str, chromosome: str,
+                            sequenced_sites: list[tuple[int, int]] = None, stats: dict = None) -> np.ndarray:
+    """
+    Collect the positions of the variants on one chromosome where both samples have called genotypes and one sample
+    is homozygous reference (0/0) while the other is homozygous alternate (1/1).
+
+    :param vcf_file_path: path to the VCF file; a bgzip-compressed VCF with a tabix or CSI index is read by region,
+    and a GenotypeStore directory is filtered without parsing any text
+    :param chromosome: chromosome whose variants are wanted
+    :param sequenced_sites: if given, only variants inside these sites are needed (used to limit indexed reads)
+    :param stats: if given, 'records_parsed' and 'variants_passing' counts are added to this dict
+    :return positions: int64 array of the 1-based positions of the passing variants
+    """
+    if stats is None:
+        stats = {}
+    if GenotypeStore.is_store(vcf_file_path):
+        positions = GenotypeStore(vcf_file_path).fixed_differences(chromosome)
+        stats['variants_passing'] = stats.get('variants_passing', 0) + int(positions.size)
+        return positions
+
+    # only the records of this chromosome are read, and only the sequenced regions when the VCF is indexed
+    vcf_obj = iter_vcf_records(vcf_file_path, chromosome, sequenced_sites)
+
+    variable_positions = [] # This list will keep track of the positions of all variants that pass the filters
+    n_records = 0
     for record in vcf_obj: # Create loop to read through every record
-        if record.CHROM != 'NC_036780.1': # These two lines will make sure that you are only looking at records from Chromosome 1
-            break
-        # TODO:add an if statement here to ensure that both samples have called genotypes (num_called attribute is your friend)
+        n_records += 1
+        # make sure that both samples have called genotypes
         if record.num_called == 2:
-            # TODO:add another if statement to ensure that one genotype is 0/0 and the other is 1/1 (use gt_nums)
+            # make sure that one genotype is 0/0 and the other is 1/1
             sample1_gt = record.samples[0].gt_nums
             sample2_gt = record.samples[1].gt_nums
             if (sample1_gt == '0/0' and sample2_gt == '1/1') or (sample1_gt == '1/1' and sample2_gt == '0/0'):
-                # TODO:if both if conditions pass, Use list comprehension to determine if this variants falls within sequenced DNA
-                # TODO:if the variant falls within sequenced DNA, add it to the sequenced_sites_variables list
-                _ = [sequenced_sites_variable.append(site) for site in sequenced_sites if site[0] < record.POS < site[1]]
+                variable_positions.append(record.POS)
+    stats['records_parsed'] = stats.get('records_parsed', 0) + n_records
+    stats['variants_passing'] = stats.get('variants_passing', 0) + len(variable_positions)
+    return np.asarray(variable_positions, dtype=np.int64)
+
+
+def find_variable_sites(vcf_file_path: str, sequenced_sites: list[tuple[int, int]], chromosome: str = 'NC_036780.1',
+                        stats: dict = None):
+    """
+    Task 6:
+    Implement this function to take in a path to a VCF file and a list of sequenced sites (as returned by run_single_rad
+    or run_ddrad) and return a list of sites that are both sequenced and contain variation.
+
+    :param vcf_file_path: path to the VCF file; a bgzip-compressed VCF with a tabix or CSI index is read by region,
+    and a GenotypeStore directory is used directly
+    :param sequenced_sites: list of sequenced sites, as returned by run_single_rad or run_ddrad
+    :param chromosome: chromosome the sequenced sites come from
+    :param stats: if given, the record counts of load_variable_positions and 'intervals_queried' are added to this dict
+    :return sequenced_sites_variable: a list of sequenced sites that contain variation. This list is a subset of the
+    sequenced_sites list you input to the function, in the same order and with each site listed once
+    """
+
+    # reading the VCF and filtering its records lives in load_variable_positions so that other callers can reuse it
+    if stats is None:
+        stats = {}
+    variable_positions = load_variable_positions(vcf_file_path, chromosome, sequenced_sites, stats=stats)
+
+    # The variants are matched against the sequenced DNA in one batch query instead of scanning every site for every
+    # variant, and a site holding several variants is only reported once
+    hits = IntervalIndex(sequenced_sites).query_batch(variable_positions)
+    sequenced_sites_variable = [sequenced_sites[idx] for idx in hits.tolist()]
+    stats['intervals_queried'] = stats.get('intervals_queried', 0) + len(sequenced_sites)
     return sequenced_sites_variable
 
 
+class StageMetrics:
+    """
+    Opt-in instrumentation of the pipeline stages. Each stage run inside stage() appends one JSON line to the metrics
+    file with its wall time, CPU time, the change of the process RSS over the stage (rss_delta_mb), the peak RSS of the
+    process so far (process_peak_rss_mb, which includes every earlier stage of the process, so it is not the memory of
+    this stage) and whatever item counts the stage filled in, and, if a profile directory is set, dumps a cProfile of
+    the stage there. A memory field is None where the platform does not provide it. Without a metrics file or profile
+    directory every stage is a no-op, so the pipeline can always be written against a StageMetrics.
+
+    :param metrics_path: NDJSON file the stage records are appended to
+    :param profile_dir: directory for the per-stage .prof files
+    :param tags: fields added to every record, e.g. mode or chromosome
+    """
+    def __init__(self, metrics_path: str = None, profile_dir: str = None, **tags):
+        self.metrics_path = metrics_path
+        self.profile_dir = profile_dir
+        self.tags = tags
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.metrics_path or self.profile_dir)
+
+    def tagged(self, **tags) -> 'StageMetrics':
+        """Return a StageMetrics writing to the same places with extra tags (e.g. one per chromosome worker)."""
+        return StageMetrics(self.metrics_path, self.profile_dir, **{**self.tags, **tags})
+
+    @staticmethod
+    def process_peak_rss_mb() -> float:
+        """Peak resident set size of this process so far in megabytes (ru_maxrss is in kB on Linux, bytes on macOS)."""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+    @staticmethod
+    def current_rss_mb() -> float:
+        """Current resident set size of this process in megabytes, from /proc/self/statm; None without /proc."""
+        try:
+            with open('/proc/self/statm') as statm:
+                pages = int(statm.read().split()[1])
+        except OSError:
+            return None
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **tags) -> Iterator[dict]:
+        """
+        Time the body of the with block as one stage.
+
+        :param name: stage name
+        :param tags: fields added to this record only
+        :return counts: dict the stage fills with its item counts (cut sites, records parsed, ...)
+        """
+        counts = {}
+        if not self.enabled:
+            yield counts
+            return
+        profiler = cProfile.Profile() if self.profile_dir else None
+        rss_start = self.current_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield counts
+        finally:
+            if profiler:
+                profiler.disable()
+            rss_end = self.current_rss_mb()
+            record = {'stage': name, **self.tags, **tags,
+                      'wall_s': time.perf_counter() - wall_start,
+                      'cpu_s': time.process_time() - cpu_start,
+                      'rss_delta_mb': None if rss_start is None or rss_end is None else rss_end - rss_start,
+                      'process_peak_rss_mb': self.process_peak_rss_mb(),
+                      'pid': os.getpid(),
+                      **counts}
+            if profiler:
+                label = '_'.join(str(value) for value in [name, *self.tags.values(), *tags.values()])
+                profiler.dump_stats(os.path.join(self.profile_dir, f'{label}_{os.getpid()}.prof'))
+            if self.metrics_path:
+                # one short line per write, so records from worker processes appending to the same file stay whole
+                with open(self.metrics_path, 'a') as metrics_file:
+                    metrics_file.write(json.dumps(record) + '\n')
+
+
+def analyze_chromosome(genome_file: str, vcf_file: str, chromosome: str, mode: str, re1: str,
+                       re2: str = None, chunk_size: int = None, cache: CutSiteCache = None,
+                       metrics: StageMetrics = None) -> dict:
+    """
+    Run the full pipeline (read_fasta, cut-site scan, SingleRad or ddRad, variant overlap) for one chromosome and
+    return its summary counts. This is the unit of work handed to each worker process in WholeGenome mode.
+
+    :param genome_file: path to the .fasta file containing the genome
+    :param vcf_file: path to the .vcf file with the DNA polymorphisms
+    :param chromosome: chromosome to analyze
+    :param mode: SingleRad or ddRad
+    :param re1: first restriction enzyme name
+    :param re2: second restriction enzyme name (ddRad only)
+    :param chunk_size: if given, stream the chromosome in chunks of this many bases
+    :param cache: optional cut-site cache; with a cache the chromosome is always streamed, so it is not read at all
+    when its cut sites are cached
+    :param metrics: optional stage instrumentation; its records are tagged with the chromosome
+    :return summary: dict with the chromosome name, its length, and the number of sequenced sites, sequenced bases and
+    sites with variation
+    """
+    metrics = (metrics or StageMetrics()).tagged(chromosome=chromosome)
+    enzymes = [re1] if mode == 'SingleRad' else [re1, re2]
+    motifs = [rest_dict[enzyme]["site"] for enzyme in enzymes]
+    if cache is not None:
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    with metrics.stage('read_fasta') as counts:
+        dna = read_fasta(path_to_fasta=genome_file, chromosome=chromosome, chunk_size=chunk_size)
+        counts['bases'] = len(dna)
+    with metrics.stage('cut_site_scan') as counts:
+        if cache is not None:
+            cut_sites = cache.find_motifs(dna, motifs, genome_file, chromosome)
+        else:
+            cut_sites = find_motifs_multi(dna, motifs)
+        counts['cut_sites'] = sum(int(sites.size) for sites in cut_sites.values())
+    with metrics.stage('single_rad' if mode == 'SingleRad' else 'ddrad_pairing') as counts:
+        if mode == 'SingleRad':
+            seq_sites = run_single_rad(dna, re1, cut_sites=cut_sites)
+        else:
+            seq_sites = run_ddrad(dna, re1, re2, cut_sites=cut_sites)
+        counts['sequenced_sites'] = len(seq_sites)
+    with metrics.stage('vcf_overlap') as counts:
+        variable_sites = find_variable_sites(vcf_file, sequenced_sites=seq_sites, chromosome=chromosome, stats=counts)
+        counts['variable_sites'] = len(variable_sites)
+    return {'chromosome': chromosome,
+            'length': len(dna),
+            'n_sites': len(seq_sites),
+            'sequenced_bases': sum(stop - start for start, stop in seq_sites),
+            'n_var_sites': len(variable_sites)}
+
+
+def split_vcf_by_chromosome(vcf_file_path: str, out_dir: str, chromosomes: list[str]) -> dict[str, str]:
+    """
+    Copy the records of every wanted chromosome of a VCF into a VCF of its own, in one pass over the file and
+    without parsing the records, so that each chromosome can later be parsed without reading the others.
+
+    :param vcf_file_path: path to the VCF file (plain or .gz)
+    :param out_dir: directory for the per-chromosome VCFs
+    :param chromosomes: chromosomes to keep; every one gets a file, header-only if it has no records
+    :return paths: per-chromosome VCF path keyed by chromosome
+    """
+    compressed = vcf_file_path.endswith('.gz')
+    opener = (lambda path, mode: gzip.open(path, mode, compresslevel=1)) if compressed else open
+    paths = {chrom: os.path.join(out_dir, f'{idx}.vcf{".gz" if compressed else ""}')
+             for idx, chrom in enumerate(chromosomes)}
+    header = []
+    current, out_file = None, None
+    with (gzip.open if compressed else open)(vcf_file_path, 'rb') as vcf_file:
+        for line in vcf_file:
+            if line.startswith(b'#'):
+                header.append(line)
+                continue
+            chrom = line[:line.find(b'\t')].decode()
+            if chrom != current:
+                # records of a chromosome are normally contiguous, so one file is open at a time
+                if out_file is not None:
+                    out_file.close()
+                current = chrom
+                out_file = None
+                if chrom in paths:
+                    new_file = not os.path.exists(paths[chrom])
+                    out_file = opener(paths[chrom], 'ab')
+                    if new_file:
+                        out_file.writelines(header)
+            if out_file is not None:
+                out_file.write(line)
+    if out_file is not None:
+        out_file.close()
+    for path in paths.values():
+        if not os.path.exists(path):
+            with opener(path, 'wb') as out_file:
+                out_file.writelines(header)
+    return paths
+
+
+def run_whole_genome(genome_file: str, vcf_file: str, mode: str, re1: str, re2: str = None,
+                     chromosomes: list[str] = None, processes: int = None, chunk_size: int = None,
+                     cache: CutSiteCache = None, metrics: StageMetrics = None) -> list[dict]:
+    """
+    Run analyze_chromosome for every chromosome of the genome, spread across a pool of worker processes. A VCF that
+    can't be read by region (no tabix/CSI index, or no pysam) is split by chromosome into a temporary directory
+    first, so every worker parses its own chromosome instead of the VCF up to it.
+
+    :param genome_file: path to the .fasta file containing the genome
+    :param vcf_file: path to the .vcf file with the DNA polymorphisms, or a GenotypeStore directory
+    :param mode: SingleRad or ddRad
+    :param re1: first restriction enzyme name
+    :param re2: second restriction enzyme name (ddRad only)
+    :param chromosomes: chromosomes to analyze; defaults to every chromosome in the genome file
+    :param processes: number of worker processes; defaults to the number of CPUs
+    :param chunk_size: if given, stream each chromosome in chunks of this many bases
+    :param cache: optional cut-site cache shared by all workers
+    :param metrics: optional stage instrumentation; every worker appends its own chromosome-tagged records
+    :return results: per-chromosome summaries, in the order of the chromosomes list
+    """
+    if chromosomes is None:
+        chromosomes = list(pyfaidx.Fasta(genome_file).keys())
+    n_chrom = len(chromosomes)
+    with contextlib.ExitStack() as stack:
+        vcf_files = [vcf_file] * n_chrom
+        if not GenotypeStore.is_store(vcf_file) and find_vcf_index(vcf_file) is None:
+            split_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='rad_hw_vcf_'))
+            with (metrics or StageMetrics()).stage('split_vcf') as counts:
+                split_files = split_vcf_by_chromosome(vcf_file, split_dir, chromosomes)
+                counts['chromosomes'] = n_chrom
+            vcf_files = [split_files[chrom] for chrom in chromosomes]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(analyze_chromosome, [genome_file] * n_chrom, vcf_files, chromosomes,
+                                    [mode] * n_chrom, [re1] * n_chrom, [re2] * n_chrom, [chunk_size] * n_chrom,
+                                    [cache] * n_chrom, [metrics] * n_chrom))
+    return results
+
+
+def summarize_genome(results: list[dict]) -> dict:
+    """
+    Merge per-chromosome summaries into genome-wide totals and fractions.
+
+    :param results: per-chromosome summaries, as returned by analyze_chromosome
+    :return summary: genome-wide totals, with the sequenced fraction and the fraction of sites with variation
+    """
+    summary = {key: sum(result[key] for result in results)
+               for key in ('length', 'n_sites', 'sequenced_bases', 'n_var_sites')}
+    summary['n_chromosomes'] = len(results)
+    summary['sequenced_fraction'] = summary['sequenced_bases'] / summary['length'] if summary['length'] else 0.0
+    summary['var_fraction'] = summary['n_var_sites'] / summary['n_sites'] if summary['n_sites'] else 0.0
+    return summary
+
+
+def size_selection_grid(min_sizes: list[int], max_sizes: list[int], seq_lengths: list[int]) -> np.ndarray:
+    """
+    Build every (min_size, max_size, seq_length) combination with min_size < max_size, as input for sweep_ddrad_windows.
+
+    :param min_sizes: candidate shortest fragment sizes
+    :param max_sizes: candidate longest fragment sizes
+    :param seq_lengths: candidate read lengths
+    :return windows: int64 array of shape (n, 3) with one size-selection setting per row
+    """
+    windows = np.array(list(itertools.product(min_sizes, max_sizes, seq_lengths)), dtype=np.int64).reshape(-1, 3)
+    return windows[windows[:, 0] < windows[:, 1]]
+
+
+def sweep_ddrad_windows(re1_sites: list[int], re2_sites: list[int], variable_positions: list[int],
+                        windows: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Evaluate ddRad for a whole grid of size-selection settings at once. The RE1/RE2 fragments and their lengths are
+    found once; for each read length the fragments are sorted by length with a running count of their variable reads,
+    so every (min_size, max_size) window is answered by two binary searches. The counts match running run_ddrad and
+    find_variable_sites for each setting separately.
+
+    :param re1_sites: sorted positions of the first enzyme's cut sites
+    :param re2_sites: sorted positions of the second enzyme's cut sites
+    :param variable_positions: positions of the variable sites (e.g. from load_variable_positions)
+    :param windows: array of shape (n, 3) with (min_size, max_size, seq_length) rows, e.g. from size_selection_grid
+    :return sweep: dict of arrays aligned with the rows of windows: min_size, max_size, seq_length, n_fragments,
+    n_sites (two reads per fragment), sequenced_bases and n_var_sites
+    """
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 3)
+    re1_sites = np.asarray(re1_sites, dtype=np.int64)
+    variable_positions = np.sort(np.asarray(variable_positions, dtype=np.int64))
+
+    # every candidate fragment, size selection aside, as its outer ends; reads come from both ends inwards
+    left_re2, left_ok, right_re2, right_ok = flank_re2_sites(re1_sites, re2_sites)
+    frag_lo = np.concatenate([left_re2[left_ok], re1_sites[right_ok]])
+    frag_hi = np.concatenate([re1_sites[left_ok], right_re2[right_ok]])
+    order = np.argsort(frag_hi - frag_lo, kind='stable')
+    frag_lo, frag_hi = frag_lo[order], frag_hi[order]
+    frag_len = frag_hi - frag_lo
+
+    def has_variant(starts: np.ndarray, seq_length: int) -> np.ndarray:
+        return (np.searchsorted(variable_positions, starts + seq_length, side='left')
+                > np.searchsorted(variable_positions, starts, side='right'))
+
+    n_fragments = np.zeros(len(windows), dtype=np.int64)
+    n_var_sites = np.zeros(len(windows), dtype=np.int64)
+    for seq_length in np.unique(windows[:, 2]).tolist():
+        rows = np.flatnonzero(windows[:, 2] == seq_length)
+        var_reads = has_variant(frag_lo, seq_length).astype(np.int64) + has_variant(frag_hi - seq_length, seq_length)
+        cum_var = np.concatenate([[0], np.cumsum(var_reads)])
+        lo = np.searchsorted(frag_len, windows[rows, 0], side='right') # fragments longer than min_size ...
+        hi = np.searchsorted(frag_len, windows[rows, 1], side='left')  # ... and shorter than max_size
+        hi = np.maximum(hi, lo)
+        n_fragments[rows] = hi - lo
+        n_var_sites[rows] = cum_var[hi] - cum_var[lo]
+
+    return {'min_size': windows[:, 0], 'max_size': windows[:, 1], 'seq_length': windows[:, 2],
+            'n_fragments': n_fragments, 'n_sites': 2 * n_fragments, 'sequenced_bases': 2 * n_fragments * windows[:, 2],
+            'n_var_sites': n_var_sites}
+
+
+_SCREEN_STATE = {} # Cut sites and variant positions shared with screening workers, set by _init_screen_worker
+
+
+def _init_screen_worker(cut_sites: dict[str, np.ndarray], variable_positions: np.ndarray,
+                        size_selection: tuple[int, int, int]):
+    """Store the data every screened pair needs once per worker process instead of once per task"""
+    _SCREEN_STATE.update(cut_sites=cut_sites, variable_positions=variable_positions, size_selection=size_selection)
+
+
+def _screen_pair(motif_pair: tuple[str, str]) -> tuple[int, int]:
+    """Run ddRad for one pair of motifs from the shared state and count its sequenced and variable sites"""
+    cut_sites = _SCREEN_STATE['cut_sites']
+    min_size, max_size, seq_length = _SCREEN_STATE['size_selection']
+    starts = ddrad_read_starts(cut_sites[motif_pair[0]], cut_sites[motif_pair[1]], min_size, max_size, seq_length)
+    intervals = np.stack([starts, starts + seq_length], axis=1)
+    n_var_sites = IntervalIndex(intervals).query_batch(_SCREEN_STATE['variable_positions']).size
+    return starts.size, n_var_sites
+
+
+def screen_enzyme_pairs(dna: str | FastaStream, vcf_file_path: str, chromosome: str, enzymes: list[str] = None,
+                        processes: int = None, min_size: int = 300, max_size: int = 700, seq_length: int = 100,
+                        cut_sites: dict[str, np.ndarray] = None, metrics: StageMetrics = None) -> list[dict]:
+    """
+    Evaluate every ddRad pair from a list of candidate enzymes on one chromosome. The cut sites of all candidates are
+    found in a single scan and the passing variants are read once; both are then shared with a pool of worker
+    processes that pair the enzymes. Enzymes recognizing the same site are evaluated together as one candidate.
+
+    :param dna: DNA sequence to be analyzed, as a str or a FastaStream
+    :param vcf_file_path: path to the VCF file
+    :param chromosome: chromosome the sequence comes from
+    :param enzymes: candidate restriction enzyme names; defaults to every enzyme in rest_dict
+    :param processes: number of worker processes; defaults to the number of CPUs
+    :param min_size: shortest fragment kept by size selection (exclusive)
+    :param max_size: longest fragment kept by size selection (exclusive)
+    :param seq_length: length of the sequencing reads
+    :param cut_sites: optional pre-computed cut sites keyed by motif (e.g. from CutSiteCache); only the motifs
+    missing from it are scanned
+    :param metrics: optional stage instrumentation of the scan, the variant read and the pairing
+    :return results: one dict per pair of recognition sites with the enzyme names, the number of ddRad fragments and
+    sequenced sites, the sequenced fraction and the number of sites with variation, sorted by that last count
+    """
+    if enzymes is None:
+        enzymes = list(rest_dict)
+    for enzyme in enzymes:
+        assert enzyme in rest_dict, f'no restriction enzyme named {enzyme} found in rest_dict'
+    enzymes_by_motif = {}
+    for enzyme in enzymes:
+        enzymes_by_motif.setdefault(rest_dict[enzyme]["site"], []).append(enzyme)
+
+    if metrics is None:
+        metrics = StageMetrics()
+
+    with metrics.stage('cut_site_scan', chromosome=chromosome) as stage_counts:
+        cut_sites = {motif: cut_sites[motif] for motif in enzymes_by_motif if cut_sites and motif in cut_sites}
+        missing = [motif for motif in enzymes_by_motif if motif not in cut_sites]
+        if missing:
+            cut_sites.update(find_motifs_multi(dna, missing))
+        stage_counts['motifs_scanned'] = len(missing)
+        stage_counts['cut_sites'] = sum(int(sites.size) for sites in cut_sites.values())
+    with metrics.stage('load_variants', chromosome=chromosome) as stage_counts:
+        variable_positions = load_variable_positions(vcf_file_path, chromosome, stats=stage_counts)
+    input_len = len(dna)
+    motif_pairs = list(itertools.combinations(enzymes_by_motif, 2))
+
+    with metrics.stage('pair_screen', chromosome=chromosome) as stage_counts:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_screen_worker,
+                                 initargs=(cut_sites, variable_positions, (min_size, max_size, seq_length))) as pool:
+            counts = list(pool.map(_screen_pair, motif_pairs, chunksize=max(1, len(motif_pairs) // 256)))
+        stage_counts['pairs'] = len(motif_pairs)
+
+    results = []
+    for (motif1, motif2), (n_sites, n_var_sites) in zip(motif_pairs, counts):
+        results.append({'re1': ','.join(enzymes_by_motif[motif1]),
+                        're2': ','.join(enzymes_by_motif[motif2]),
+                        'n_fragments': n_sites // 2,
+                        'n_sites': n_sites,
+                        'sequenced_fraction': n_sites * seq_length / input_len if input_len else 0.0,
+                        'n_var_sites': n_var_sites})
+    results.sort(key=lambda result: result['n_var_sites'], reverse=True)
+    return results
+
+
+def write_screen_report(results: list[dict], path: str):
+    """
+    Write the results of screen_enzyme_pairs as a tab-separated file with one row per screened pair.
+
+    :param results: results as returned by screen_enzyme_pairs
+    :param path: path of the report to write
+    """
+    with open(path, 'w', newline='') as report:
+        writer = csv.DictWriter(report, fieldnames=['re1', 're2', 'n_fragments', 'n_sites', 'sequenced_fraction',
+                                                    'n_var_sites'], delimiter='\t')
+        writer.writeheader()
+        writer.writerows(results)
+
+
 # ###TESTING CODE###
 # # This section of code is provided to help you test your functions as you develop them. Feel free to add additional
 # # debugging code to this section, but ensure that all code required to run the script remains in the function
@@ -311,31 +1406,107 @@ def find_variable_sites(vcf_file_path: str, sequenced_sites: list[tuple[int, int
 # Once you think your code is complete, comment out the above testing section, uncomment the below section,
 # and run the script.
 
-args = my_parse_args()
-target_chromosome = 'NC_036780.1'
-dna_string = read_fasta(path_to_fasta=args.GenomeFile, chromosome=target_chromosome)
-
-if args.Mode == 'SingleRad':
-    print(f'running SingleRad for chromosome {target_chromosome} and restriction enzyme {args.RE1}')
-    seq_sites = run_single_rad(dna_string, args.RE1)
-elif args.Mode == 'ddRad':
-    print(f'running ddRad for chromosome {target_chromosome} and restriction enzymes {args.RE1} and {args.RE2}')
-    seq_sites = run_ddrad(dna_string, args.RE1, args.RE2)
-
-input_len = len(dna_string)
-n_sites = len(seq_sites)
-sequencing_length = seq_sites[0][1] - seq_sites[0][0]
-sequenced_fraction = sequencing_length*n_sites/input_len
-print(f'{args.Mode} sequencing complete.')
-print(f'\tlength of input sequence: {input_len}')
-print(f'\tnumber of sequencing sites located: {n_sites}')
-print(f'\tpercentage of nucleotides sequenced: {100*sequenced_fraction:.3f}%')
-
-print('checking for variation within sequenced sites')
-variable_sites = find_variable_sites(args.VCFFile, sequenced_sites=seq_sites)
-n_var_sites = len(variable_sites)
-var_fraction = n_var_sites / n_sites
-print(f'\tnumber of sites with variation: {n_var_sites}')
-print(f'\tfraction of sites with variation: {var_fraction}')
-
-print('\nAnalysis Complete')
\ No newline at end of file
+if __name__ == '__main__':
+    args = my_parse_args()
+    metrics = StageMetrics(args.Metrics, args.ProfileDir, mode=args.Mode)
+    cache = CutSiteCache(args.CacheDir, args.CacheMaxMB * 1024 ** 2) if args.CacheDir else None
+    # with a cache the chromosome is streamed, so nothing is read from the FASTA when its cut sites are cached
+    chunk_size = args.ChunkSize or (DEFAULT_CHUNK_SIZE if cache else None)
+    if args.GenotypeStore:
+        store_exists = GenotypeStore.is_store(args.GenotypeStore)
+        if not store_exists or not GenotypeStore.is_current(args.GenotypeStore, args.VCFFile):
+            if store_exists:
+                print(f'{args.VCFFile} changed since genotype store {args.GenotypeStore} was built; rebuilding it')
+            else:
+                print(f'converting {args.VCFFile} into genotype store {args.GenotypeStore}')
+            with metrics.stage('build_genotype_store'):
+                GenotypeStore.build(args.VCFFile, args.GenotypeStore)
+        args.VCFFile = args.GenotypeStore
+
+    if args.WholeGenome:
+        enzymes = args.RE1 if args.Mode == 'SingleRad' else f'{args.RE1} and {args.RE2}'
+        print(f'running {args.Mode} on every chromosome of {args.GenomeFile} with restriction enzyme(s) {enzymes}')
+        with metrics.stage('whole_genome') as counts:
+            results = run_whole_genome(args.GenomeFile, args.VCFFile, args.Mode, args.RE1, args.RE2,
+                                       processes=args.Processes, chunk_size=args.ChunkSize, cache=cache,
+                                       metrics=metrics)
+            counts['chromosomes'] = len(results)
+        for result in results:
+            print(f"\t{result['chromosome']}: length {result['length']}, {result['n_sites']} sequencing sites, "
+                  f"{result['n_var_sites']} with variation")
+        summary = summarize_genome(results)
+        print(f'{args.Mode} sequencing complete across {summary["n_chromosomes"]} chromosomes.')
+        print(f'\tlength of input sequence: {summary["length"]}')
+        print(f'\tnumber of sequencing sites located: {summary["n_sites"]}')
+        print(f'\tpercentage of nucleotides sequenced: {100*summary["sequenced_fraction"]:.3f}%')
+        print(f'\tnumber of sites with variation: {summary["n_var_sites"]}')
+        print(f'\tfraction of sites with variation: {summary["var_fraction"]}')
+    elif args.Mode == 'Screen':
+        target_chromosome = args.Chromosome
+        enzymes = None if args.RE1 == 'all' else [args.RE1] + args.Enzymes
+        n_enzymes = len(rest_dict) if enzymes is None else len(enzymes)
+        print(f'screening ddRad pairs of {n_enzymes} restriction enzymes on chromosome {target_chromosome}')
+        with metrics.stage('read_fasta', chromosome=target_chromosome) as counts:
+            dna_string = read_fasta(path_to_fasta=args.GenomeFile, chromosome=target_chromosome, chunk_size=chunk_size)
+            counts['bases'] = len(dna_string)
+        cut_sites = None
+        if cache:
+            with metrics.stage('cut_site_cache', chromosome=target_chromosome) as counts:
+                motifs = [rest_dict[enzyme]["site"] for enzyme in (enzymes or rest_dict)]
+                cut_sites = cache.find_motifs(dna_string, motifs, args.GenomeFile, target_chromosome)
+                counts['cut_sites'] = sum(int(sites.size) for sites in cut_sites.values())
+        results = screen_enzyme_pairs(dna_string, args.VCFFile, target_chromosome, enzymes, processes=args.Processes,
+                                      cut_sites=cut_sites, metrics=metrics)
+        print(f'Screen complete: {len(results)} enzyme pairs evaluated. Pairs with the most variable sites:')
+        for result in results[:20]:
+            print(f"\t{result['re1']} + {result['re2']}: {result['n_fragments']} fragments, "
+                  f"{100*result['sequenced_fraction']:.3f}% sequenced, {result['n_var_sites']} sites with variation")
+        if args.Output:
+            write_screen_report(results, args.Output)
+            print(f'full report written to {args.Output}')
+    else:
+        target_chromosome = args.Chromosome
+        metrics = metrics.tagged(chromosome=target_chromosome)
+        with metrics.stage('read_fasta') as counts:
+            dna_string = read_fasta(path_to_fasta=args.GenomeFile, chromosome=target_chromosome, chunk_size=chunk_size)
+            counts['bases'] = len(dna_string)
+        enzymes = [args.RE1] if args.Mode == 'SingleRad' else [args.RE1, args.RE2]
+        motifs = [rest_dict[enzyme]["site"] for enzyme in enzymes]
+        with metrics.stage('cut_site_scan') as counts:
+            if cache:
+                cut_sites = cache.find_motifs(dna_string, motifs, args.GenomeFile, target_chromosome)
+            else:
+                cut_sites = find_motifs_multi(dna_string, motifs)
+            counts['cut_sites'] = sum(int(sites.size) for sites in cut_sites.values())
+
+        if args.Mode == 'SingleRad':
+            print(f'running SingleRad for chromosome {target_chromosome} and restriction enzyme {args.RE1}')
+            with metrics.stage('single_rad') as counts:
+                seq_sites = run_single_rad(dna_string, args.RE1, cut_sites=cut_sites)
+                counts['sequenced_sites'] = len(seq_sites)
+        elif args.Mode == 'ddRad':
+            print(f'running ddRad for chromosome {target_chromosome} and restriction enzymes {args.RE1} and {args.RE2}')
+            with metrics.stage('ddrad_pairing') as counts:
+                seq_sites = run_ddrad(dna_string, args.RE1, args.RE2, cut_sites=cut_sites)
+                counts['sequenced_sites'] = len(seq_sites)
+
+        input_len = len(dna_string)
+        n_sites = len(seq_sites)
+        sequencing_length = seq_sites[0][1] - seq_sites[0][0]
+        sequenced_fraction = sequencing_length*n_sites/input_len
+        print(f'{args.Mode} sequencing complete.')
+        print(f'\tlength of input sequence: {input_len}')
+        print(f'\tnumber of sequencing sites located: {n_sites}')
+        print(f'\tpercentage of nucleotides sequenced: {100*sequenced_fraction:.3f}%')
+
+        print('checking for variation within sequenced sites')
+        with metrics.stage('vcf_overlap') as counts:
+            variable_sites = find_variable_sites(args.VCFFile, sequenced_sites=seq_sites, chromosome=target_chromosome,
+                                                 stats=counts)
+            counts['variable_sites'] = len(variable_sites)
+        n_var_sites = len(variable_sites)
+        var_fraction = n_var_sites / n_sites
+        print(f'\tnumber of sites with variation: {n_var_sites}')
+        print(f'\tfraction of sites with variation: {var_fraction}')
+
+    print('\nAnalysis Complete')
@@ -0,0 +1,294 @@
+import argparse # Take in arguments
+import json # Encode queries and results
+import threading # Guard the shared workspace between request threads
+import time # Report how long each batch took
+import urllib.request # Client helper for notebooks
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # Local HTTP interface
+import rad_hw # The pipeline being served
+from rad_hw import rest_dict # Restriction enzymes, imported once for the life of the server
+
+"""
+Resident server for the rad_hw pipeline. Starting rad_hw.py imports Biopython, opens the FASTA index, reads the
+chromosome and parses the VCF before it can answer one question; the server does that work once and keeps the
+sequences, the cut sites of every motif asked about so far and the passing variant positions in memory. Clients post
+batches of SingleRad/ddRad queries as JSON and get the summaries back without any of the startup cost.
+
+Example:
+    python rad_server.py genome.fna variants.vcf -Chromosomes NC_036780.1        # start the server
+
+    from rad_server import query_server                                          # from a notebook
+    query_server([{'mode': 'ddRad', 're1': 'AanI', 're2': 'MroI', 'min_size': 250}])
+
+Each query is a dict with 'mode' (SingleRad or ddRad), 're1', 're2' (ddRad only) and optionally 'chromosome',
+'min_size', 'max_size', 'seq_length' (ddRad only) and 'sites' (true to return the sequenced and variable sites too).
+"""
+
+DEFAULT_PORT = 8802
+DEFAULT_CHROMOSOME = 'NC_036780.1'
+MODES = ('SingleRad', 'ddRad')
+SIZE_FIELDS = ('min_size', 'max_size', 'seq_length')
+
+
+def my_parse_args() -> argparse.Namespace:
+    """
+    Parse the command-line options of the server.
+
+    :return parsed_args: the parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(description='keep a genome and its variants loaded and answer batches of '
+                                                 'SingleRad/ddRad queries over local HTTP')
+    parser.add_argument('GenomeFile', type = str, help = 'Genome file path')
+    parser.add_argument('VCFFile', type = str, help = 'VCF file path, or a GenotypeStore directory')
+    parser.add_argument('-Chromosomes', type = str, nargs = '+', help = 'chromosomes to load at startup; others are loaded on first use', default = [])
+    parser.add_argument('-Enzymes', type = str, nargs = '+', help = 'enzymes whose cut sites are found at startup', default = [])
+    parser.add_argument('-Host', type = str, help = 'interface to listen on', default = '127.0.0.1')
+    parser.add_argument('-Port', type = int, help = 'port to listen on', default = DEFAULT_PORT)
+    parser.add_argument('-CacheDir', type = str, help = 'directory for caching cut sites between server runs', default = None)
+    parser.add_argument('-Verbose', action = 'store_true', help = 'log every request')
+    return parser.parse_args()
+
+
+def validate_query(query) -> list[str]:
+    """
+    Check the types and values of a query before any work is done for it.
+
+    :param query: query as decoded from the request
+    :return enzymes: the query's restriction enzymes (re1, then re2 for ddRad)
+    """
+    if not isinstance(query, dict):
+        raise ValueError(f'a query must be a JSON object, not {type(query).__name__}')
+    mode = query.get('mode')
+    if mode not in MODES:
+        raise ValueError(f'unknown mode {mode!r}; use SingleRad or ddRad')
+    enzymes = [query.get('re1')] if mode == 'SingleRad' else [query.get('re1'), query.get('re2')]
+    for enzyme in enzymes:
+        if not isinstance(enzyme, str) or enzyme not in rest_dict:
+            raise ValueError(f'no restriction enzyme named {enzyme!r} found in rest_dict')
+    if not isinstance(query.get('chromosome', DEFAULT_CHROMOSOME), str):
+        raise ValueError('chromosome must be a string')
+    for field in SIZE_FIELDS:
+        value = query.get(field, 1)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f'{field} must be a non-negative integer, not {value!r}')
+    if query.get('min_size', 300) > query.get('max_size', 700):
+        raise ValueError('min_size must not be larger than max_size')
+    return enzymes
+
+
+class RadWorkspace:
+    """
+    The data the server keeps warm: per chromosome, its sequence, the cut sites of every motif scanned so far and the
+    positions of the variants passing the rad_hw filter. Chromosomes are loaded on first use and motifs are scanned
+    on first use, all motifs missing for a batch in a single pass over the sequence.
+
+    :param genome_file: path to the .fasta file containing the genome
+    :param vcf_file: path to the VCF file or GenotypeStore directory
+    :param cache: optional cut-site cache, so motifs scanned by an earlier server (or rad_hw run) are just loaded
+    """
+    def __init__(self, genome_file: str, vcf_file: str, cache: rad_hw.CutSiteCache = None):
+        self.genome_file = genome_file
+        self.vcf_file = vcf_file
+        self.cache = cache
+        self.sequences = {}
+        self.cut_sites = {}
+        self.variable_positions = {}
+        self.lock = threading.Lock()
+
+    def load(self, chromosome: str, motifs: list[str] = ()):
+        """
+        Make sure a chromosome and the cut sites of the given motifs are in memory.
+
+        :param chromosome: chromosome to load
+        :param motifs: recognition sites whose cut sites are needed
+        """
+        with self.lock:
+            if chromosome not in self.sequences:
+                # a chromosome is only registered once all of its data has loaded, so a failed load (e.g. an
+                # unreadable VCF) leaves nothing half-filled behind and the next query simply tries again
+                dna = rad_hw.read_fasta(self.genome_file, chromosome)
+                positions = rad_hw.load_variable_positions(self.vcf_file, chromosome)
+                self.sequences[chromosome] = dna
+                self.variable_positions[chromosome] = positions
+                self.cut_sites[chromosome] = {}
+            known = self.cut_sites[chromosome]
+            missing = list(dict.fromkeys(motif for motif in motifs if motif not in known))
+            if not missing:
+                return
+            dna = self.sequences[chromosome]
+            if self.cache is not None:
+                known.update(self.cache.find_motifs(dna, missing, self.genome_file, chromosome))
+            else:
+                known.update(rad_hw.find_motifs_multi(dna, missing))
+
+    def answer(self, query: dict) -> dict:
+        """
+        Answer one SingleRad/ddRad query from the loaded data.
+
+        :param query: dict with mode, re1, re2 and the optional chromosome, min_size, max_size, seq_length and sites
+        :return result: dict with the number of sequenced sites, the sequenced fraction, the number and fraction of
+        sites with variation, and the sites themselves if asked for
+        """
+        enzymes = validate_query(query)
+        mode = query['mode']
+        chromosome = query.get('chromosome', DEFAULT_CHROMOSOME)
+        self.load(chromosome, [rest_dict[enzyme]["site"] for enzyme in enzymes])
+        dna = self.sequences[chromosome]
+        cut_sites = self.cut_sites[chromosome]
+
+        if mode == 'SingleRad':
+            seq_sites = rad_hw.run_single_rad(dna, query['re1'], cut_sites=cut_sites)
+        else:
+            seq_sites = rad_hw.run_ddrad(dna, query['re1'], query['re2'], min_size=query.get('min_size', 300),
+                                         max_size=query.get('max_size', 700), seq_length=query.get('seq_length', 100),
+                                         cut_sites=cut_sites)
+
+        hits = rad_hw.IntervalIndex(seq_sites).query_batch(self.variable_positions[chromosome])
+        sequenced_bases = sum(stop - start for start, stop in seq_sites)
+        result = {'chromosome': chromosome,
+                  'n_sites': len(seq_sites),
+                  'sequenced_fraction': sequenced_bases / len(dna) if len(dna) else 0.0,
+                  'n_var_sites': int(hits.size),
+                  'var_fraction': hits.size / len(seq_sites) if seq_sites else 0.0}
+        if query.get('sites'):
+            result['sites'] = [[int(start), int(stop)] for start, stop in seq_sites]
+            result['variable_sites'] = [result['sites'][idx] for idx in hits.tolist()]
+        return result
+
+    def answer_batch(self, queries: list[dict]) -> list[dict]:
+        """
+        Answer a batch of queries. The motifs of the whole batch are scanned up front, one pass per chromosome, and a
+        query that fails, for bad input or anything else, gets an 'error' entry instead of failing the batch.
+
+        :param queries: list of query dicts
+        :return results: one result dict per query, in order
+        """
+        motifs_by_chromosome = {}
+        for query in queries:
+            try:
+                enzymes = validate_query(query)
+            except ValueError:
+                continue # reported when the query is answered
+            motifs = [rest_dict[enzyme]["site"] for enzyme in enzymes]
+            motifs_by_chromosome.setdefault(query.get('chromosome', DEFAULT_CHROMOSOME), []).extend(motifs)
+        for chromosome, motifs in motifs_by_chromosome.items():
+            try:
+                self.load(chromosome, motifs)
+            except Exception:
+                pass # an unknown chromosome is reported by the queries that use it
+
+        results = []
+        for query in queries:
+            try:
+                results.append(self.answer(query))
+            except Exception as error:
+                results.append({'error': f'{type(error).__name__}: {error}'})
+        return results
+
+    def status(self) -> dict:
+        """
+        Describe what is loaded.
+
+        :return status: dict with the loaded chromosomes, their lengths, number of scanned motifs and passing variants
+        """
+        with self.lock:
+            return {'genome_file': self.genome_file,
+                    'vcf_file': self.vcf_file,
+                    'chromosomes': {chromosome: {'length': len(dna),
+                                                 'motifs': len(self.cut_sites[chromosome]),
+                                                 'variants': int(self.variable_positions[chromosome].size)}
+                                    for chromosome, dna in self.sequences.items()}}
+
+
+class RadRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the server: POST /query with {"queries": [...]} returns {"results": [...], "elapsed_s": ...},
+    and GET /status describes the loaded data.
+    """
+    workspace: RadWorkspace = None
+    verbose = False
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send_json(self.workspace.status())
+        else:
+            self._send_json({'error': f'unknown path {self.path}'}, status=404)
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._send_json({'error': f'unknown path {self.path}'}, status=404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            queries = request['queries'] if isinstance(request, dict) else request
+            assert isinstance(queries, list), 'queries must be a list'
+        except (ValueError, KeyError, AssertionError) as error:
+            self._send_json({'error': f'bad request: {error}'}, status=400)
+            return
+        start = time.perf_counter()
+        try:
+            results = self.workspace.answer_batch(queries)
+        except Exception as error:
+            self._send_json({'error': f'{type(error).__name__}: {error}'}, status=500)
+            return
+        self._send_json({'results': results, 'elapsed_s': time.perf_counter() - start})
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(workspace: RadWorkspace, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+          verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    Create the HTTP server for a workspace; call serve_forever() on it to start answering.
+
+    :param workspace: loaded data to answer from
+    :param host: interface to listen on
+    :param port: port to listen on (0 picks a free one)
+    :param verbose: log every request
+    :return server: the HTTP server
+    """
+    handler = type('BoundRadRequestHandler', (RadRequestHandler,), {'workspace': workspace, 'verbose': verbose})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def query_server(queries: list[dict], url: str = f'http://127.0.0.1:{DEFAULT_PORT}', timeout: float = 600) -> list[dict]:
+    """
+    Send a batch of queries to a running server.
+
+    :param queries: list of query dicts
+    :param url: base URL of the server
+    :param timeout: seconds to wait for the answer
+    :return results: one result dict per query, in order
+    """
+    request = urllib.request.Request(f'{url}/query', data=json.dumps({'queries': queries}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())['results']
+
+
+### MAIN CODE ###
+if __name__ == '__main__':
+    args = my_parse_args()
+    cache = rad_hw.CutSiteCache(args.CacheDir) if args.CacheDir else None
+    workspace = RadWorkspace(args.GenomeFile, args.VCFFile, cache=cache)
+    motifs = [rest_dict[enzyme]["site"] for enzyme in args.Enzymes]
+    for chromosome in args.Chromosomes:
+        print(f'loading chromosome {chromosome}')
+        workspace.load(chromosome, motifs)
+    server = serve(workspace, args.Host, args.Port, verbose=args.Verbose)
+    print(f'serving rad_hw queries on http://{args.Host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nshutting down')
+    finally:
+        server.server_close()
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fatality_engine as fe
+
+
+def write_demographics(path, n_countries=9, seed=0):
+    """Demographics CSV laid out like WorldDemographics.csv: shuffled rows with an unnamed index column, extra
+    columns, repeated (country, age) rows and ages above MAX_AGE"""
+    rng = np.random.default_rng(seed)
+    rows = [(f'Country {country:03d}', age, int(rng.integers(0, 10 ** 6)))
+            for country in range(n_countries) for age in range(fe.MAX_AGE + 6)]
+    rows += [(f'Country {int(country):03d}', int(age), int(rng.integers(0, 1000)))
+             for country, age in zip(rng.integers(0, n_countries, 50), rng.integers(0, fe.MAX_AGE + 1, 50))]
+    table = pd.DataFrame(rows, columns=['PopulationID', 'Age', '#Alive']).sample(frac=1, random_state=seed)
+    table['country_code'] = table['PopulationID'].str[-3:].astype(int)
+    table.reset_index(drop=True).to_csv(path)
+
+
+def merge_groupby_table(csv_path):
+    """Steps 1-6 of hw4.py as they were before the matrix engine: merge on Age and group by country"""
+    d = {'Age': [], 'FPM': []}
+    for i in range(101):
+        d['Age'].append(i)
+        if i < 18:
+            d['FPM'].append(20/1000000)
+        elif 18 <= i <= 49:
+            d['FPM'].append(500/1000000)
+        elif 50 <= i <= 64:
+            d['FPM'].append(6000/1000000)
+        else:
+            d['FPM'].append(90000/1000000)
+    dt1 = pd.DataFrame.from_dict(d)
+    dt2 = pd.read_csv(csv_path)
+    dt2 = dt2.drop(['Unnamed: 0'], axis=1)
+    covid_dt = pd.merge(dt1, dt2, how='inner', on='Age')
+    covid_dt['exp_death'] = covid_dt['FPM'] * covid_dt['#Alive']
+    dt3 = covid_dt.groupby('PopulationID').agg(total_polulation=('#Alive', 'sum'), total_exp_death=('exp_death', 'sum'))
+    dt3['died_perc'] = dt3['total_exp_death'] / dt3['total_polulation'] * 100
+    return dt3
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 37, 250, 10 ** 6])
+def test_fatality_table_matches_merge_groupby(tmp_path, chunk_rows):
+    csv_path = str(tmp_path / 'demographics.csv')
+    write_demographics(csv_path)
+    countries, population = fe.read_population_matrix(csv_path, chunk_rows=chunk_rows, use_cache=False)
+    assert population.shape == (9, fe.MAX_AGE + 1) and population.dtype == np.int64
+
+    names, rates = fe.scenario_matrix({'cdc': fe.band_rates()})
+    deaths = fe.expected_deaths(population, rates)
+    table = fe.fatality_table(countries, population, deaths[:, names.index('cdc')])
+    pd.testing.assert_frame_equal(table, merge_groupby_table(csv_path), check_names=False)
+
+
+def test_population_cache_round_trips(tmp_path, monkeypatch):
+    csv_path = str(tmp_path / 'demographics.csv')
+    write_demographics(csv_path)
+    countries, population = fe.read_population_matrix(csv_path, chunk_rows=100)
+    assert os.path.exists(fe.population_cache_path(csv_path))
+
+    # while the cache is newer than the CSV the matrix comes from the cache, not from the CSV
+    def no_csv(*args):
+        raise AssertionError('the CSV was read again')
+    monkeypatch.setattr(fe, '_stream_population_matrix', no_csv)
+    cached_countries, cached_population = fe.read_population_matrix(csv_path)
+    monkeypatch.undo()
+    pd.testing.assert_index_equal(cached_countries, countries)
+    np.testing.assert_array_equal(cached_population, population)
+    assert cached_population.dtype == population.dtype
+
+    # an edited CSV is read again
+    write_demographics(csv_path, seed=1)
+    cache_mtime = os.path.getmtime(fe.population_cache_path(csv_path))
+    os.utime(csv_path, (cache_mtime + 1, cache_mtime + 1))
+    _, edited_population = fe.read_population_matrix(csv_path)
+    np.testing.assert_array_equal(edited_population,
+                                  fe.read_population_matrix(csv_path, use_cache=False)[1])
+    assert not np.array_equal(edited_population, population)
+
+
+def test_band_rates_and_scenarios():
+    rates = fe.band_rates()
+    assert rates[17] == 20 / 10 ** 6 and rates[18] == 500 / 10 ** 6
+    assert rates[64] == 6000 / 10 ** 6 and rates[65] == rates[fe.MAX_AGE] == 90000 / 10 ** 6
+    with pytest.raises(AssertionError):
+        fe.band_rates([((0, 17), 20), ((19, fe.MAX_AGE), 500)])
+
+    draws = fe.monte_carlo_rates(n_draws=3, seed=1)
+    names, matrix = fe.scenario_matrix({'cdc': rates, 'draw': draws})
+    assert names == ['cdc', 'draw_0', 'draw_1', 'draw_2']
+    np.testing.assert_array_equal(matrix, np.column_stack([rates, draws]))
+    # all ages of a band share one multiplier per draw
+    np.testing.assert_allclose(draws[:18] / rates[:18, None], np.broadcast_to(draws[0] / rates[0], (18, 3)))
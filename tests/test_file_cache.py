@@ -0,0 +1,25 @@
+import hashlib
+import json
+import os
+
+from file_cache import cached_file_hash, file_sha256, write_atomic
+
+
+def test_cached_file_hash_is_remembered_until_the_file_changes(tmp_path):
+    path = str(tmp_path / 'genome.fa')
+    record_path = str(tmp_path / 'hashes.json')
+    with open(path, 'w') as handle:
+        handle.write('>chr1\nACGT\n')
+    assert cached_file_hash(path, record_path) == hashlib.sha256(b'>chr1\nACGT\n').hexdigest() == file_sha256(path)
+
+    # a remembered hash is returned without reading the file again
+    with open(record_path) as record_file:
+        records = json.load(record_file)
+    records[os.path.abspath(path)]['sha256'] = 'remembered'
+    write_atomic(record_path, lambda handle: json.dump(records, handle))
+    assert cached_file_hash(path, record_path) == 'remembered'
+
+    with open(path, 'w') as handle:
+        handle.write('>chr1\nACGTT\n')
+    assert cached_file_hash(path, record_path) == hashlib.sha256(b'>chr1\nACGTT\n').hexdigest()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,189 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from file_manager import FileManager, TransferResult, file_md5
+
+REMOTE = 'testlocal'
+
+needs_rclone = pytest.mark.skipif(shutil.which('rclone') is None, reason='rclone is not installed')
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """FileManager on an rclone local-filesystem remote configured through the environment"""
+    monkeypatch.setenv(f'RCLONE_CONFIG_{REMOTE.upper()}_TYPE', 'local')
+    local = tmp_path / 'local'
+    local.mkdir()
+    cloud_master = os.path.relpath(tmp_path / 'cloud', '/')
+    return FileManager(REMOTE, str(local), cloud_master, retries=1, backoff=0.0, max_workers=4)
+
+
+def write_files(manager, n_files):
+    """Local files of different sizes, some in subdirectories; returns {path: contents}"""
+    files = {}
+    for idx in range(n_files):
+        path = os.path.join(manager.local_master, f'run{idx % 3}', f'sample_{idx}.vcf')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        contents = f'sample {idx}\n'.encode() * (idx * 97 + 1)
+        with open(path, 'wb') as handle:
+            handle.write(contents)
+        files[path] = contents
+    return files
+
+
+def read(path):
+    with open(path, 'rb') as handle:
+        return handle.read()
+
+
+@needs_rclone
+def test_upload_and_download_many_round_trip(manager):
+    files = write_files(manager, 12)
+    uploaded = manager.upload_many(list(files))
+    assert len(uploaded.succeeded) == len(files) and not uploaded.failed
+    assert uploaded.size == sum(len(contents) for contents in files.values())
+    for path, contents in files.items():
+        cloud_path = manager.convertLocalToCloud(path).split(':', 1)[1]
+        assert read(cloud_path) == contents
+
+    shutil.rmtree(manager.local_master)
+    cloud_files = [manager.convertLocalToCloud(path) for path in files]
+    downloaded = manager.download_many(cloud_files, max_workers=2)
+    assert [result.destination for result in downloaded.results] == list(files)
+    assert all(result.success and result.attempts == 1 for result in downloaded.results)
+    for path, contents in files.items():
+        assert read(path) == contents
+
+
+@needs_rclone
+def test_missing_file_fails_alone_after_retries(manager):
+    files = write_files(manager, 3)
+    missing = os.path.join(manager.local_master, 'missing.vcf')
+    batch = manager.upload_many([*files, missing])
+    assert [result.source for result in batch.succeeded] == list(files)
+    [failed] = batch.failed
+    assert failed.source == missing
+    assert failed.attempts == manager.retries + 1
+    assert failed.error
+
+
+def unrunnable_rclone(tmp_path):
+    """An rclone that exists but is not executable, so subprocess.run raises PermissionError"""
+    rclone = tmp_path / 'rclone'
+    rclone.write_text('')
+    rclone.chmod(0o644)
+    return str(rclone)
+
+
+def test_batch_reports_rclone_that_cannot_run(tmp_path):
+    manager = FileManager(REMOTE, str(tmp_path / 'local'), 'cloud', rclone=unrunnable_rclone(tmp_path), retries=2)
+    files = [os.path.join(manager.local_master, f'sample_{idx}.vcf') for idx in range(3)]
+    batch = manager.upload_many(files)
+    assert [result.source for result in batch.failed] == files
+    assert all(result.attempts == 1 and 'Permission denied' in result.error for result in batch.failed)
+
+
+def test_prefetch_ends_when_rclone_cannot_run(tmp_path):
+    manager = FileManager(REMOTE, str(tmp_path / 'local'), 'cloud', rclone=unrunnable_rclone(tmp_path), retries=0)
+    prefetcher = manager.prefetch([f'{REMOTE}:/cloud/a.vcf', f'{REMOTE}:/cloud/b.vcf'])
+    fetched = []
+    consumer = threading.Thread(target=lambda: fetched.extend(prefetcher), daemon=True)
+    consumer.start()
+    consumer.join(timeout=10)
+    assert not consumer.is_alive(), 'the consumer never got the end of the downloads'
+    assert fetched == []
+    assert [result.source for result in prefetcher.batch.failed] == [f'{REMOTE}:/cloud/a.vcf', f'{REMOTE}:/cloud/b.vcf']
+    assert all('Permission denied' in result.error for result in prefetcher.batch.failed)
+
+
+@needs_rclone
+def test_prefetch_evicts_only_the_files_it_created(manager):
+    files = write_files(manager, 4)
+    assert not manager.upload_many(list(files)).failed
+    kept, *fetched = files
+    for path in fetched:
+        os.remove(path)
+    cloud_files = [manager.convertLocalToCloud(path) for path in files]
+
+    seen = []
+    with manager.prefetch(cloud_files, depth=1, disk_budget=1, evict=True) as inputs:
+        for path in inputs:
+            seen.append((path, read(path)))
+    assert seen == list(files.items())
+    # the file that was in the mirror before the prefetch is kept; the downloaded copies are gone
+    assert read(kept) == files[kept]
+    assert not any(os.path.exists(path) for path in fetched)
+
+    with manager.prefetch(cloud_files) as inputs:
+        assert list(inputs) == list(files)
+    assert all(read(path) == contents for path, contents in files.items())
+
+
+def cloud_read(manager, path):
+    """Contents of the remote copy of a local file"""
+    return read(manager.convertLocalToCloud(path).split(':', 1)[1])
+
+
+@needs_rclone
+@pytest.mark.parametrize('check_remote', [True, False])
+def test_sync_skips_unchanged_and_uploads_edited_files(manager, check_remote):
+    files = write_files(manager, 5)
+    first = manager.sync(check_remote=check_remote)
+    assert sorted(result.source for result in first.succeeded) == sorted(files) and first.skipped == 0
+    assert set(manager.read_manifest()) == {os.path.relpath(path, manager.local_master) for path in files}
+
+    second = manager.sync(check_remote=check_remote)
+    assert second.results == [] and second.skipped == len(files)
+
+    edited = list(files)[2]
+    with open(edited, 'wb') as handle:
+        handle.write(b'edited\n')
+    third = manager.sync(check_remote=check_remote)
+    assert [result.source for result in third.results] == [edited] and third.skipped == len(files) - 1
+    assert cloud_read(manager, edited) == b'edited\n'
+    entry = manager.read_manifest()[os.path.relpath(edited, manager.local_master)]
+    assert entry['size'] == len(b'edited\n') and entry['md5'] == file_md5(edited)
+
+
+@needs_rclone
+def test_sync_leaves_failed_uploads_out_of_the_manifest(manager, monkeypatch):
+    files = write_files(manager, 3)
+    manager.sync()
+    added = os.path.join(manager.local_master, 'run9', 'added.vcf')
+    os.makedirs(os.path.dirname(added))
+    with open(added, 'wb') as handle:
+        handle.write(b'added\n')
+
+    transfer = FileManager._transfer
+    def fail_added(self, source, destination):
+        if source == added:
+            return TransferResult(source, destination, False, 1, 0.0, error='simulated failure')
+        return transfer(self, source, destination)
+    monkeypatch.setattr(FileManager, '_transfer', fail_added)
+    failed = manager.sync()
+    assert [result.source for result in failed.failed] == [added]
+    manifest = manager.read_manifest()
+    assert 'run9/added.vcf' not in manifest
+    assert set(manifest) == {os.path.relpath(path, manager.local_master) for path in files}
+
+    # without the manifest entry the file is tried again on the next sync, even with the remote unchecked
+    monkeypatch.undo()
+    retried = manager.sync(check_remote=False)
+    assert [result.source for result in retried.succeeded] == [added]
+    assert 'run9/added.vcf' in manager.read_manifest()
+
+
+@needs_rclone
+def test_sync_uploads_everything_again_after_cloud_master_changes(manager, tmp_path):
+    files = write_files(manager, 4)
+    manager.sync()
+    manager.cloud_master = os.path.relpath(tmp_path / 'elsewhere', '/')
+    moved = manager.sync(check_remote=False)
+    assert sorted(result.source for result in moved.succeeded) == sorted(files) and moved.skipped == 0
+    for path, contents in files.items():
+        assert cloud_read(manager, path) == contents
+    assert all(entry['cloud'].startswith(f'{REMOTE}:/{manager.cloud_master}/')
+               for entry in manager.read_manifest().values())
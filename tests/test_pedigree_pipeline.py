@@ -0,0 +1,89 @@
+import allel
+import numpy as np
+import pytest
+
+import pedigree_pipeline as pp
+
+CHROMOSOMES = ['chr1', 'chr2']
+
+
+def noisy_pedigree(n_variants, n_progeny, missing, error, seed):
+    """Unphased genotypes of two parents and their progeny, with recombination, genotyping errors and missing calls"""
+    rng = np.random.default_rng(seed)
+    father = rng.integers(0, 2, (n_variants, 2))
+    mother = rng.integers(0, 2, (n_variants, 2))
+    genotypes = np.zeros((n_variants, n_progeny + 2, 2), dtype='i1')
+    genotypes[:, 0] = father
+    genotypes[:, 1] = mother
+    rows = np.arange(n_variants)
+    for child in range(2, n_progeny + 2):
+        from_father = (np.cumsum(rng.random(n_variants) < 0.002) + rng.integers(0, 2)) % 2
+        from_mother = (np.cumsum(rng.random(n_variants) < 0.002) + rng.integers(0, 2)) % 2
+        genotypes[:, child, 0] = father[rows, from_father]
+        genotypes[:, child, 1] = mother[rows, from_mother]
+    errors = rng.random(genotypes.shape[:2]) < error
+    genotypes[errors, 0] = 1 - genotypes[errors, 0]
+    genotypes = np.sort(genotypes, axis=2)
+    genotypes[rng.random(genotypes.shape[:2]) < missing] = -1
+    return genotypes
+
+
+def write_vcf(path, genotypes, depth):
+    n_variants, n_samples, _ = genotypes.shape
+    per_chromosome = n_variants // len(CHROMOSOMES)
+    with open(path, 'w') as vcf:
+        vcf.write('##fileformat=VCFv4.2\n')
+        for chrom in CHROMOSOMES:
+            vcf.write(f'##contig=<ID={chrom}>\n')
+        vcf.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        vcf.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">\n')
+        vcf.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'
+                  + '\t'.join(f's{idx}' for idx in range(n_samples)) + '\n')
+        for row in range(n_variants):
+            chrom = CHROMOSOMES[min(row // per_chromosome, len(CHROMOSOMES) - 1)]
+            calls = ['./.' if genotype[0] < 0 else f'{genotype[0]}/{genotype[1]}' for genotype in genotypes[row]]
+            cells = '\t'.join(f'{call}:{dp}' for call, dp in zip(calls, depth[row]))
+            vcf.write(f'{chrom}\t{row + 1}\t.\tA\tG\t50\tPASS\t.\tGT:DP\t{cells}\n')
+
+
+def whole_vcf_means(vcf_path, window_size, min_depth):
+    """Sections 2-4 of the assignment: read everything, phase each parent's informative variants at once"""
+    callset = allel.read_vcf(vcf_path, fields=pp.VCF_FIELDS)
+    genotype = allel.GenotypeArray(callset['calldata/GT'])
+    depth = callset['calldata/DP']
+    chromosomes = callset['variants/CHROM']
+    means = {}
+    for parent, mask in pp.parent_masks(genotype).items():
+        phased = allel.phase_by_transmission(genotype[mask], window_size)
+        filtered = pp.filter_painted(pp.paint_progeny(phased, parent), phased.is_phased[:, 2:], depth[mask][:, 2:],
+                                     min_depth)
+        means[parent] = pp.chromosome_means(chromosomes[mask], filtered, CHROMOSOMES)
+    return means
+
+
+@pytest.mark.parametrize('n_progeny, missing, error', [(24, 0.03, 0.01), (6, 0.2, 0.05), (3, 0.3, 0.1)])
+@pytest.mark.parametrize('window_size', [1, 7, 100])
+def test_streaming_phaser_matches_whole_array(n_progeny, missing, error, window_size):
+    genotypes = allel.GenotypeArray(noisy_pedigree(3000, n_progeny, missing, error, seed=n_progeny))
+    for rows in [slice(None), *pp.parent_masks(genotypes).values()]:
+        block = genotypes[rows]
+        whole = allel.phase_by_transmission(block, window_size)
+        for chunk_length in (1, 50, 173, 1000, 5000):
+            phaser = pp.StreamingPhaser(window_size)
+            parts = [phaser.phase(block[start:start + chunk_length]) for start in range(0, len(block), chunk_length)]
+            np.testing.assert_array_equal(np.concatenate([part.values for part in parts]), whole.values)
+            np.testing.assert_array_equal(np.concatenate([part.is_phased for part in parts]), whole.is_phased)
+
+
+@pytest.mark.parametrize('chunk_length', [50, 173, 1000, 100000])
+def test_run_pipeline_matches_whole_vcf(tmp_path, chunk_length):
+    genotypes = noisy_pedigree(4000, 6, 0.2, 0.05, seed=7)
+    depth = np.random.default_rng(7).integers(0, 30, genotypes.shape[:2])
+    vcf_path = str(tmp_path / 'pedigree.vcf')
+    write_vcf(vcf_path, genotypes, depth)
+
+    expected = whole_vcf_means(vcf_path, pp.PHASE_WINDOW, pp.MIN_DEPTH)
+    results = pp.run_pipeline(vcf_path, chunk_length=chunk_length)
+    for parent in pp.PARENTS:
+        assert results[parent].chromosomes() == CHROMOSOMES
+        np.testing.assert_array_equal(np.vstack(results[parent].means()), np.vstack(expected[parent]))
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import pytest
+from Bio.Restriction.Restriction_Dictionary import rest_dict
+
+import rad_hw
+
+RE1 = 'MroI'
+RE2 = 'AanI'
+CHROMOSOME = 'chrT'
+
+
+def random_cut_sites(n_re1, n_re2, length, seed):
+    """Sorted, distinct cut-site positions of two enzymes"""
+    rng = np.random.default_rng(seed)
+    sites = rng.choice(length, n_re1 + n_re2, replace=False)
+    return np.sort(sites[:n_re1]), np.sort(sites[n_re1:])
+
+
+def adjacent_fragments(re1_sites, re2_sites):
+    """Every RE1/RE2 fragment by definition: neighbouring cut sites of different enzymes, as (lo, hi)"""
+    tagged = sorted([(int(pos), 1) for pos in re1_sites] + [(int(pos), 2) for pos in re2_sites])
+    return [(lo, hi) for (lo, lo_enzyme), (hi, hi_enzyme) in zip(tagged, tagged[1:]) if lo_enzyme != hi_enzyme]
+
+
+def brute_force_window(fragments, variable_positions, min_size, max_size, seq_length):
+    """Fragments, sequenced bases and variable reads of one size-selection window, one read at a time"""
+    reads = []
+    for lo, hi in fragments:
+        if min_size < hi - lo < max_size:
+            reads += [(lo, lo + seq_length), (hi - seq_length, hi)]
+    n_var_sites = sum(any(start < pos < stop for pos in variable_positions) for start, stop in reads)
+    return len(reads) // 2, sum(stop - start for start, stop in reads), n_var_sites
+
+
+def write_vcf(path, variable_positions, decoy_positions):
+    """Two-sample VCF where the variable positions are fixed differences (0/0 vs 1/1) and the decoys are not"""
+    decoy_calls = ['0/1\t1/1', '1/1\t1/1', './.\t1/1', '0/0\t0/1']
+    records = [(pos, '0/0\t1/1' if idx % 2 else '1/1\t0/0') for idx, pos in enumerate(variable_positions)]
+    records += [(pos, decoy_calls[idx % len(decoy_calls)]) for idx, pos in enumerate(decoy_positions)]
+    with open(path, 'w') as vcf:
+        vcf.write('##fileformat=VCFv4.2\n')
+        vcf.write(f'##contig=<ID={CHROMOSOME}>\n')
+        vcf.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        vcf.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ts1\ts2\n')
+        for pos, calls in sorted(records):
+            vcf.write(f'{CHROMOSOME}\t{pos}\t.\tA\tG\t50\tPASS\t.\tGT\t{calls}\n')
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_sweep_matches_brute_force(seed):
+    re1_sites, re2_sites = random_cut_sites(300, 300, 200_000, seed)
+    fragments = adjacent_fragments(re1_sites, re2_sites)
+    lengths = sorted({hi - lo for lo, hi in fragments})
+    rng = np.random.default_rng(seed)
+    # variants on read boundaries check that containment stays strict at both ends
+    boundaries = np.array([[lo, lo + 100, hi - 100, hi] for lo, hi in fragments[::7]]).ravel()
+    variable_positions = np.unique(np.concatenate([rng.choice(200_000, 400, replace=False), boundaries]))
+
+    # exact fragment lengths as bounds check that size selection is exclusive at both ends
+    min_sizes = [0, 150, 300, lengths[len(lengths) // 3]]
+    max_sizes = [200, 700, lengths[2 * len(lengths) // 3], 10 ** 6]
+    windows = rad_hw.size_selection_grid(min_sizes, max_sizes, [1, 50, 100, 400])
+    sweep = rad_hw.sweep_ddrad_windows(re1_sites, re2_sites, variable_positions, windows)
+
+    for row, (min_size, max_size, seq_length) in enumerate(windows.tolist()):
+        n_fragments, sequenced_bases, n_var_sites = brute_force_window(fragments, variable_positions.tolist(),
+                                                                       min_size, max_size, seq_length)
+        assert sweep['n_fragments'][row] == n_fragments
+        assert sweep['n_sites'][row] == 2 * n_fragments
+        assert sweep['sequenced_bases'][row] == sequenced_bases
+        assert sweep['n_var_sites'][row] == n_var_sites
+
+
+def test_sweep_matches_run_ddrad_and_find_variable_sites(tmp_path):
+    re1_sites, re2_sites = random_cut_sites(120, 150, 60_000, seed=8802)
+    rng = np.random.default_rng(8802)
+    positions = rng.choice(np.arange(1, 60_000), 600, replace=False)
+    variable_positions, decoy_positions = np.sort(positions[:300]), np.sort(positions[300:])
+    vcf_path = str(tmp_path / 'variants.vcf')
+    write_vcf(vcf_path, variable_positions.tolist(), decoy_positions.tolist())
+
+    windows = rad_hw.size_selection_grid([100, 300], [500, 700, 2000], [50, 100])
+    sweep = rad_hw.sweep_ddrad_windows(re1_sites, re2_sites, rad_hw.load_variable_positions(vcf_path, CHROMOSOME),
+                                       windows)
+    cut_sites = {rest_dict[RE1]['site']: re1_sites, rest_dict[RE2]['site']: re2_sites}
+    for row, (min_size, max_size, seq_length) in enumerate(windows.tolist()):
+        sites = rad_hw.run_ddrad('', RE1, RE2, min_size, max_size, seq_length, cut_sites=cut_sites)
+        variable_sites = rad_hw.find_variable_sites(vcf_path, sites, chromosome=CHROMOSOME)
+        assert sweep['n_sites'][row] == len(sites)
+        assert sweep['sequenced_bases'][row] == sum(stop - start for start, stop in sites)
+        assert sweep['n_var_sites'][row] == len(variable_sites)
+
+
+@pytest.mark.skipif(rad_hw.pysam is None, reason='pysam is not installed')
+@pytest.mark.parametrize('csi', [False, True])
+def test_indexed_vcf_matches_plain_vcf(tmp_path, csi):
+    rng = np.random.default_rng(5)
+    positions = np.sort(rng.choice(np.arange(1, 60_000), 400, replace=False))
+    vcf_path = str(tmp_path / 'variants.vcf')
+    write_vcf(vcf_path, positions[:200].tolist(), positions[200:].tolist())
+    indexed_path = rad_hw.pysam.tabix_index(vcf_path, preset='vcf', keep_original=True, csi=csi)
+    assert rad_hw.find_vcf_index(indexed_path)
+
+    re1_sites, re2_sites = random_cut_sites(120, 150, 60_000, seed=5)
+    sites = rad_hw.pair_ddrad_fragments(re1_sites, re2_sites)
+    assert (rad_hw.find_variable_sites(indexed_path, sites, chromosome=CHROMOSOME)
+            == rad_hw.find_variable_sites(vcf_path, sites, chromosome=CHROMOSOME))
+    # a chromosome without records in the index has no variable sites, as in the plain-text path
+    assert rad_hw.find_variable_sites(indexed_path, sites, chromosome='chrM') == []
+    assert rad_hw.find_variable_sites(vcf_path, sites, chromosome='chrM') == []
+
+
+def test_cut_site_cache_survives_entries_deleted_by_other_workers(tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    dna = ''.join(rng.choice(list('ACGT'), 20_000))
+    genome_file = str(tmp_path / 'genome.fa')
+    with open(genome_file, 'w') as fasta:
+        fasta.write(f'>{CHROMOSOME}\n{dna}\n')
+    motifs = [rest_dict[RE1]['site'], rest_dict[RE2]['site']]
+    expected = rad_hw.find_motifs_multi(dna, motifs)
+    cache = rad_hw.CutSiteCache(str(tmp_path / 'cache'))
+    cache.find_motifs(dna, motifs, genome_file, CHROMOSOME)
+
+    # another worker evicts an entry after it was found but before it is read: the motif is scanned again
+    load = np.load
+    def load_after_eviction(path, *args, **kwargs):
+        os.remove(path)
+        return load(path, *args, **kwargs)
+    monkeypatch.setattr(rad_hw.np, 'load', load_after_eviction)
+    found = cache.find_motifs(dna, motifs, genome_file, CHROMOSOME)
+    monkeypatch.undo()
+    for motif in motifs:
+        np.testing.assert_array_equal(found[motif], expected[motif])
+
+    # another worker removes the entries this one is evicting
+    remove = os.remove
+    def remove_twice(path):
+        remove(path)
+        remove(path)
+    monkeypatch.setattr(rad_hw.os, 'remove', remove_twice)
+    cache.max_bytes = 0
+    cache.evict()
+    monkeypatch.undo()
+    assert not [name for _, _, names in os.walk(cache.cache_dir) for name in names if name.endswith('.npy')]